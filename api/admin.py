@@ -1,24 +1,95 @@
 # api/admin.py
 
 from django.contrib import admin
-from .models import User, Wallet, BiometricData, Bill, Transaction
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import User, Wallet, WalletShard, BiometricData, Bill, Transaction, LedgerEntry
+from .bill_events import publish_bill_event_on_commit
+from .wallet_cache import get_wallet_cache
+
+# Shard rows are created, consolidated and deleted by set_wallet_shards only
+class WalletShardInline(admin.TabularInline):
+    model = WalletShard
+    extra = 0
+    can_delete = False
+    readonly_fields = ('index', 'balance', 'updated_at')
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ('owner', 'balance', 'updated_at')
+    list_display = ('owner', 'balance', 'shard_count', 'updated_at')
     search_fields = ('owner__username',)
+    inlines = [WalletShardInline]
+    # Changing it here would orphan or skip shard rows; use set_wallet_shards
+    readonly_fields = ('shard_count',)
+
+    # Balance edits made here go on the ledger, and must not be hidden by a cached wallet
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            if obj.balance:
+                LedgerEntry.objects.create(wallet=obj, kind='ADJUSTMENT', amount=obj.balance)
+        else:
+            # Never write the whole row back: payments and top-ups that landed
+            # while the form was open would be lost. A balance edit applies as
+            # the difference from what the form showed, like any other write.
+            with transaction.atomic():
+                fields = [name for name in form.changed_data if name != 'balance']
+                if fields:
+                    obj.save(update_fields=fields)
+                if 'balance' in form.changed_data:
+                    delta = obj.balance - form.initial['balance']
+                    Wallet.objects.filter(id=obj.id).update(balance=F('balance') + delta, updated_at=timezone.now())
+                    LedgerEntry.objects.create(wallet=obj, kind='ADJUSTMENT', amount=delta)
+                    obj.refresh_from_db(fields=['balance', 'updated_at'])
+        get_wallet_cache().invalidate_on_commit(obj.owner_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        get_wallet_cache().invalidate_on_commit(obj.owner_id)
+
+    def delete_queryset(self, request, queryset):
+        owner_ids = list(queryset.values_list('owner_id', flat=True))
+        super().delete_queryset(request, queryset)
+        get_wallet_cache().invalidate_on_commit(*owner_ids)
 
 class BillAdmin(admin.ModelAdmin):
     list_display = ('id', 'initiating_shop', 'customer', 'amount', 'status', 'created_at')
     list_filter = ('status', 'initiating_shop')
     search_fields = ('customer__username', 'initiating_shop__username')
 
+    # Cancelling a bill happens here; the shop's dashboard hears about it
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change or 'status' in form.changed_data:
+            publish_bill_event_on_commit(obj)
+
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ('id', 'source_wallet', 'destination_wallet', 'amount', 'timestamp')
     search_fields = ('source_wallet__owner__username', 'destination_wallet__owner__username')
 
+# The ledger is append-only: readable here, never edited
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'wallet', 'kind', 'amount', 'bill', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('wallet__owner__username',)
+    raw_id_fields = ('wallet', 'bill')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # Register your models here.
 admin.site.register(User)
 admin.site.register(Wallet, WalletAdmin)
 admin.site.register(BiometricData)
 admin.site.register(Bill, BillAdmin)
-admin.site.register(Transaction, TransactionAdmin)
\ No newline at end of file
+admin.site.register(Transaction, TransactionAdmin)
+admin.site.register(LedgerEntry, LedgerEntryAdmin)
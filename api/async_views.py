@@ -0,0 +1,154 @@
+# api/async_views.py
+#
+# Async versions of the hot endpoints for ASGI deployments (core/asgi.py).
+# Under ASGI, Django runs every sync view on one shared thread, so a slow
+# biometric check stalls every other request. These views keep the event loop
+# free: CV work runs in an executor and the ORM is used through its async API
+# or sync_to_async, so cheap wallet reads keep flowing while payments are
+# being verified.
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from .bill_events import astream_bill_events
+from .idempotency import get_idempotency_key, get_idempotency_store, replay_response
+from .instrumentation import stage_timer
+from .models import Wallet
+from .views import BillEventStreamView, BillListCreateView, PaymentView, WalletDetailView
+from .wallet_cache import get_wallet_cache
+
+
+class AsyncAPIViewMixin:
+    """
+    Lets a DRF view declare `async def` handlers. Request setup (JWT
+    authentication, permissions, throttling) runs through sync_to_async and
+    the handler is awaited (sync ones, like the inherited `options`, through
+    sync_to_async too); exception handling and response finalization are
+    the usual DRF ones.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.view_is_async:
+            return super().dispatch(request, *args, **kwargs)
+        return self.async_dispatch(request, *args, **kwargs)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                # Inherited sync handlers (OPTIONS, 405s) may use the ORM
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def get_request_data(self, request):
+        # Multipart parsing of camera uploads is CPU work; keep it off the loop.
+        return await sync_to_async(lambda: request.data, thread_sensitive=False)()
+
+
+class AsyncWalletDetailView(AsyncAPIViewMixin, WalletDetailView):
+    async def get(self, request, *args, **kwargs):
+        wallet_cache = get_wallet_cache()
+        data, version = await wallet_cache.aget(request.user.id)
+        if data is None:
+            try:
+                wallet = await Wallet.objects.select_related('owner').with_shard_balance().aget(
+                    owner_id=request.user.id
+                )
+            except Wallet.DoesNotExist:
+                # The same 404 get_object_or_404 gives the sync view
+                raise NotFound("No Wallet matches the given query.")
+            data = self.get_serializer(wallet).data
+            await wallet_cache.aset(request.user.id, version, data)
+        return Response(data)
+
+
+class AsyncBillListCreateView(AsyncAPIViewMixin, BillListCreateView):
+    async def get(self, request, *args, **kwargs):
+        # Fetching a page is a single LIMIT query
+        page = await sync_to_async(self.paginate_queryset)(
+            self.as_values(self.filter_queryset(self.get_queryset()))
+        )
+        return self.get_paginated_response(self.list_serializer_class(page).data)
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=await self.get_request_data(request))
+        # Validating `customer` runs a query, and saving needs the ORM too
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        await sync_to_async(self.perform_create)(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class AsyncBillEventStreamView(AsyncAPIViewMixin, BillEventStreamView):
+    async def get(self, request, *args, **kwargs):
+        # Waiting for events is an await, so open streams cost no threads
+        return self.event_stream(astream_bill_events(request.user.id, self.get_cursor(request)))
+
+
+class AsyncPaymentView(AsyncAPIViewMixin, PaymentView):
+    async def post(self, request, *args, **kwargs):
+        data = await self.get_request_data(request)
+        bill_id = self.get_bill_id(data)
+        key = get_idempotency_key(request)
+        if key is None:
+            return await self.apay(data, bill_id)
+
+        # Waiting on an in-flight duplicate polls the cache; do it off the loop
+        entry = await sync_to_async(get_idempotency_store().claim, thread_sensitive=False)(
+            request.user.id, key, bill_id
+        )
+        if entry is not None:
+            return replay_response(entry)
+        try:
+            outcome = await self.apay(data, bill_id)
+        except Exception as exc:
+            outcome = exc
+        return await sync_to_async(self.remember)(key, bill_id, outcome)
+
+    async def apay(self, data, bill_id):
+        timer = stage_timer(self.request)
+        with timer.stage('fetch'):
+            bill = await sync_to_async(get_object_or_404)(
+                self.get_bill_queryset(), id=bill_id, status='PENDING'
+            )
+
+        serializer = self.get_serializer(data=data)
+        # Face detection waits on the biometric worker pool; do that waiting
+        # on an executor thread rather than the event loop.
+        with timer.stage('validate'):
+            await sync_to_async(serializer.is_valid, thread_sensitive=False)(raise_exception=True)
+        live_frame = serializer.validated_data['live_image']
+        timer.merge(live_frame.timings)
+
+        # Any database work for old templates happens on the thread the ORM
+        # runs on; what is left of the check is CPU work
+        await sync_to_async(self.prepare_biometrics)(bill)
+        error_response = await sync_to_async(self.check_biometrics, thread_sensitive=False)(
+            bill, live_frame
+        )
+        if error_response is not None:
+            return error_response
+        return await sync_to_async(self.settle)(bill)
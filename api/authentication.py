@@ -0,0 +1,138 @@
+# api/authentication.py
+#
+# JWT authentication without a user lookup per request. Login tokens carry the
+# user's role and wallet id as claims (ClaimsTokenObtainPairSerializer), and
+# ClaimsJWTAuthentication turns a valid token straight into a ClaimsUser. The
+# claims are only as fresh as the access token: a role change or deactivation
+# takes effect when it expires and the client refreshes (SIMPLE_JWT
+# ACCESS_TOKEN_LIFETIME).
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User, Wallet
+
+
+def set_claims(token, user):
+    token['username'] = user.username
+    token['role'] = user.role
+    token['wallet_id'] = Wallet.objects.filter(owner_id=user.id).values_list('id', flat=True).first()
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    The auth/login/ serializer: adds username, role and wallet_id claims.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return set_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    The auth/token/refresh/ serializer. The new access token gets the user's
+    current claims rather than copies of those in the refresh token, so a
+    role change reaches clients within one access token lifetime.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = User.objects.filter(id=access[api_settings.USER_ID_CLAIM]).first()
+        if user is not None:
+            data['access'] = str(set_claims(access, user))
+        return data
+
+
+def get_cached_claims(user_id):
+    """
+    Returns the claims a login token would carry for a user id (username,
+    role, wallet_id) plus is_active, kept in the cache for
+    settings.USER_CACHE_TIMEOUT seconds, or None if there is no such user.
+    Only these fields are cached: never the password hash or the rest of
+    the row, which a shared cache would hand to anyone who can read it.
+    """
+    cache = caches[settings.USER_CACHE_ALIAS]
+    key = f'user-claims:{user_id}'
+    claims = cache.get(key)
+    if claims is None:
+        claims = (
+            User.objects.filter(id=user_id)
+            .values('username', 'role', 'is_active', wallet_id=F('wallet__id'))
+            .first()
+        )
+        if claims is not None:
+            cache.set(key, claims, settings.USER_CACHE_TIMEOUT)
+    return claims
+
+
+class ClaimsUser(TokenUser):
+    """
+    request.user for a token with claims: enough for permissions and for
+    filtering by owner, with no database row behind it. get_user() fetches
+    the full model for code that needs one.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def role(self):
+        return self.token['role']
+
+    @cached_property
+    def wallet_id(self):
+        return self.token.get('wallet_id')
+
+    def get_user(self):
+        return User.objects.filter(id=self.id).first()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates a token with claims as a ClaimsUser, without a query.
+    Tokens issued before the claims existed get theirs from the user cache.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        if 'role' in validated_token:
+            return ClaimsUser(validated_token)
+
+        claims = get_cached_claims(validated_token[api_settings.USER_ID_CLAIM])
+        if claims is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not claims['is_active']:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return ClaimsUser({**validated_token.payload, **claims})
+
+
+class QueryTokenJWTAuthentication(ClaimsJWTAuthentication):
+    """
+    Also accepts the access token as ?access_token=, for browser EventSource
+    clients, which cannot send an Authorization header. Only the bill event
+    stream uses it, so tokens don't end up in the URLs (and logs) of other
+    endpoints.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            return result
+        raw_token = request.query_params.get('access_token')
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token.encode())
+        return self.get_user(validated_token), validated_token
@@ -0,0 +1,238 @@
+# api/bill_events.py
+#
+# Bill status events for the shop dashboard's stream (shop/bills/events/).
+# Views publish an event once the write behind it commits; the stream sends a
+# shop its events as server-sent events, each with an id the browser hands
+# back (Last-Event-ID) when it reconnects, so nothing is missed in between.
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+
+from .serializers import BillListSerializer
+
+# Bill status -> event type
+EVENT_TYPES = {
+    'PENDING': 'bill.created',
+    'PAID_CASH': 'bill.paid',
+    'PAID_WALLET': 'bill.paid',
+    'CANCELLED': 'bill.cancelled',
+}
+
+
+class InProcessBillEventBroker:
+    """
+    Keeps the last BILL_EVENT_BUFFER_SIZE events of each shop in memory and
+    wakes the streams waiting on them, whether they block a thread (WSGI) or
+    await on an event loop (ASGI).
+
+    Only streams served by the process that published an event see it, so
+    this suits a single-process deployment. A broker for several processes
+    (e.g. on Redis pub/sub) implements the same publish/read/wait/await_events
+    methods and is selected with settings.BILL_EVENT_BROKER.
+    """
+
+    def __init__(self, buffer_size=None):
+        self.buffer_size = buffer_size or settings.BILL_EVENT_BUFFER_SIZE
+        self._condition = threading.Condition()
+        # Ids keep increasing across restarts, so a cursor from a previous
+        # run is recognizably older than anything this process has
+        self.first_id = time.time_ns() // 1000
+        self.last_id = self.first_id
+        self._events = {}
+        # shop id -> id of the newest event dropped from its buffer
+        self._dropped = {}
+        self._async_waiters = set()
+
+    def publish(self, shop_id, event_type, data):
+        with self._condition:
+            self.last_id += 1
+            event = {'id': self.last_id, 'type': event_type, 'data': data}
+            events = self._events.setdefault(shop_id, deque())
+            events.append(event)
+            if len(events) > self.buffer_size:
+                self._dropped[shop_id] = events.popleft()['id']
+            self._condition.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, wakeup in waiters:
+            loop.call_soon_threadsafe(wakeup.set)
+        return event
+
+    def latest_id(self):
+        with self._condition:
+            return self.last_id
+
+    def read(self, shop_id, after_id):
+        """
+        Returns (events, cursor, complete): the shop's events newer than
+        `after_id` and the cursor to continue from. complete is False when
+        some events since `after_id` are no longer (or were never) in this
+        broker, in which case the client should reload its bill list.
+        """
+        with self._condition:
+            events = self._events.get(shop_id, ())
+            oldest_known = max(self._dropped.get(shop_id, self.first_id), self.first_id)
+            if after_id < oldest_known or after_id > self.last_id:
+                return [], self.last_id, False
+            newer = [event for event in events if event['id'] > after_id]
+            return newer, self.last_id, True
+
+    def wait(self, shop_id, after_id, timeout):
+        """
+        Like read(), but blocks up to `timeout` seconds for a new event.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                result = self.read(shop_id, after_id)
+                remaining = deadline - time.monotonic()
+                if result[0] or not result[2] or remaining <= 0:
+                    return result
+                # Any shop's event wakes every waiter; read() sorts out whose it was
+                self._condition.wait(remaining)
+
+    async def await_events(self, shop_id, after_id, timeout):
+        """
+        The async version of wait(), for streams on an event loop.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            wakeup = asyncio.Event()
+            waiter = (loop, wakeup)
+            with self._condition:
+                self._async_waiters.add(waiter)
+            try:
+                result = self.read(shop_id, after_id)
+                remaining = deadline - loop.time()
+                if result[0] or not result[2] or remaining <= 0:
+                    return result
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._condition:
+                    self._async_waiters.discard(waiter)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_bill_event_broker():
+    """
+    Returns the process-wide broker (settings.BILL_EVENT_BROKER), creating it
+    on first use.
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.BILL_EVENT_BROKER)()
+        return _broker
+
+
+def bill_event_data(bill):
+    # The same fields as a shop/bills/ list row
+    return BillListSerializer([{
+        'id': bill.id, 'customer_id': bill.customer_id, 'amount': bill.amount, 'status': bill.status,
+    }]).data[0]
+
+
+def publish_bill_event_on_commit(bill, event_type=None, using=None):
+    """
+    Publishes a bill's current status to its shop's stream once the current
+    transaction commits (at once outside one). event_type defaults to the
+    one for the bill's status.
+    """
+    shop_id = bill.initiating_shop_id
+    data = bill_event_data(bill)
+    event_type = event_type or EVENT_TYPES[bill.status]
+    transaction.on_commit(lambda: get_bill_event_broker().publish(shop_id, event_type, data), using=using)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets the stream endpoint accept EventSource's "Accept: text/event-stream".
+    The stream itself bypasses rendering; errors (401, 403) render as JSON.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def format_reset(cursor):
+    # Events were missed: the dashboard should reload shop/bills/
+    return f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+
+
+def parse_cursor(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def stream_bill_events(shop_id, after_id):
+    """
+    Yields the shop's events as server-sent events, blocking between them,
+    for BILL_EVENT_STREAM_TIMEOUT seconds; the browser then reconnects.
+    """
+    broker = get_bill_event_broker()
+    if after_id is None:
+        after_id = broker.latest_id()  # a new stream starts with what happens next
+    deadline = time.monotonic() + settings.BILL_EVENT_STREAM_TIMEOUT
+    yield f"retry: {settings.BILL_EVENT_RETRY_MS}\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        events, cursor, complete = broker.wait(
+            shop_id, after_id, min(remaining, settings.BILL_EVENT_HEARTBEAT)
+        )
+        if not complete:
+            yield format_reset(cursor)
+        for event in events:
+            yield format_event(event)
+        if not events and complete:
+            yield ": keep-alive\n\n"
+        after_id = cursor
+
+
+async def astream_bill_events(shop_id, after_id):
+    """
+    The async version of stream_bill_events, for ASGI.
+    """
+    broker = get_bill_event_broker()
+    if after_id is None:
+        after_id = broker.latest_id()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.BILL_EVENT_STREAM_TIMEOUT
+    yield f"retry: {settings.BILL_EVENT_RETRY_MS}\n\n"
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        events, cursor, complete = await broker.await_events(
+            shop_id, after_id, min(remaining, settings.BILL_EVENT_HEARTBEAT)
+        )
+        if not complete:
+            yield format_reset(cursor)
+        for event in events:
+            yield format_event(event)
+        if not events and complete:
+            yield ": keep-alive\n\n"
+        after_id = cursor
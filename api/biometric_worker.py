@@ -0,0 +1,139 @@
+# api/biometric_worker.py
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+def setup_worker_process():
+    """
+    Initializer for worker processes. They start from a fresh interpreter,
+    so Django is set up before any job (which may use models or settings)
+    is unpickled.
+    """
+    import django
+
+    django.setup()
+
+
+def worker_pool(max_workers):
+    """
+    A ProcessPoolExecutor whose workers are spawned rather than forked: a
+    fork would copy this process's open database connections, and the locks
+    of its other threads (index scans, event streams) in whatever state they
+    happen to be.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=setup_worker_process,
+    )
+
+
+class BiometricWorkerBusy(APIException):
+    """
+    Every worker slot (running + queued) is taken. Returned as a 503 with a
+    Retry-After header so clients back off instead of piling up.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Biometric service is busy, please retry shortly.'
+    default_code = 'biometric_busy'
+    wait = 1
+
+
+class BiometricWorkerTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Biometric processing timed out, please retry.'
+    default_code = 'biometric_timeout'
+    wait = 1
+
+
+class BiometricWorker:
+    """
+    A bounded process pool for OpenCV work (decode, equalization, Haar
+    detection) so it never runs on the request thread.
+
+    At most pool_size jobs run and queue_depth more wait; anything beyond
+    that is rejected immediately with BiometricWorkerBusy. A pool_size of 0
+    runs jobs inline, which is handy for tests and single-process debugging.
+    """
+
+    def __init__(self, pool_size, queue_depth, timeout):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, pool_size + queue_depth))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = worker_pool(self.pool_size)
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, fn, *args):
+        """
+        Runs fn(*args) in the pool and returns its result. Exceptions raised
+        by fn (e.g. ValueError for "no face") propagate to the caller.
+        """
+        if self.pool_size <= 0:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise BiometricWorkerBusy()
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise BiometricWorkerBusy()
+        # The slot is held until the job really finishes, even if we stop
+        # waiting for it, so timed-out jobs still count against the queue.
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise BiometricWorkerTimeout()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge image); start a fresh pool next time
+            self._reset_executor(executor)
+            raise BiometricWorkerBusy()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_biometric_worker():
+    """
+    Returns the process-wide BiometricWorker configured from settings.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = BiometricWorker(
+                pool_size=settings.BIOMETRIC_WORKER_POOL_SIZE,
+                queue_depth=settings.BIOMETRIC_WORKER_QUEUE_DEPTH,
+                timeout=settings.BIOMETRIC_WORKER_TIMEOUT,
+            )
+        return _worker
+
+
+def run_biometric_job(fn, *args):
+    return get_biometric_worker().run(fn, *args)
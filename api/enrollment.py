@@ -0,0 +1,289 @@
+# api/enrollment.py
+#
+# Bulk customer enrollment, shared by POST /api/shop/customers/bulk/ and
+# `manage.py enroll_customers`. A manifest (CSV) lists the customers and names
+# each one's face photo inside an image source (a zip archive or directory).
+# Face processing and password hashing, the expensive parts, run across a
+# process pool; the database writes are bulk inserts in chunks. A bad row is
+# reported and skipped, it never aborts the batch.
+
+import csv
+import io
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .biometric_worker import worker_pool
+from .face_utils import process_and_validate_face_for_registration
+from .models import BiometricData, User, Wallet
+from .serializers import BulkEnrollmentRowSerializer
+from .template_index import get_template_index
+
+MANIFEST_IMAGE_COLUMN = 'image'
+
+
+class DirectoryImages:
+    def __init__(self, path):
+        self.root = os.path.realpath(path)
+
+    def read(self, name):
+        path = os.path.realpath(os.path.join(self.root, name))
+        # Manifest names must stay inside the directory
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Image {name} is outside the image directory.")
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            raise ValueError(f"Image {name} not found.")
+
+
+class ZipImages:
+    def __init__(self, file):
+        try:
+            self.archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise ValueError("The image archive is not a valid zip file.")
+
+    def read(self, name):
+        try:
+            return self.archive.read(name)
+        except KeyError:
+            raise ValueError(f"Image {name} not found in the archive.")
+
+
+def open_images(path_or_file):
+    """
+    Returns an image source for a directory path, a .zip path or an uploaded zip file.
+    """
+    if isinstance(path_or_file, str) and os.path.isdir(path_or_file):
+        return DirectoryImages(path_or_file)
+    return ZipImages(path_or_file)
+
+
+def read_manifest(file):
+    """
+    Parses a CSV manifest (bytes or text file) into a list of row dicts. The
+    columns are username, password and image, plus optional email,
+    first_name, last_name and biometric_type.
+    """
+    data = file.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(data))
+    if not reader.fieldnames or not {'username', 'password', MANIFEST_IMAGE_COLUMN} <= set(reader.fieldnames):
+        raise ValueError("The manifest needs username, password and image columns.")
+    return list(reader)
+
+
+def prepare_customer(row, image_bytes):
+    """
+    Worker job: the per-customer CPU work. Returns the row with its hashed
+    password and compact face template, or raises ValueError.
+    """
+    return {
+        **row,
+        'password': make_password(row['password']),
+        'template': process_and_validate_face_for_registration(image_bytes),
+    }
+
+
+class BulkEnrollment:
+    """
+    Enrolls the customers of a manifest. workers=0 does the CPU work inline.
+    Pass `pool` to use an existing process pool instead of starting one.
+    Returns one result per manifest row, in order: {"row", "username", "id"}
+    or {"row", "username", "error"}.
+    """
+
+    def __init__(self, workers=2, chunk_size=500, pool=None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool = pool
+        # Set if a worker process died, leaving the pool unusable
+        self.pool_broken = False
+
+    def run(self, rows, images):
+        self.results = [None] * len(rows)
+        self.usernames = [row.get('username') for row in rows]
+        jobs = self.validate(rows)
+        if self.pool is not None:
+            self.write(self.prepare(jobs, images, self.pool))
+        elif self.workers > 0:
+            with worker_pool(self.workers) as pool:
+                self.write(self.prepare(jobs, images, pool))
+        else:
+            self.write(self.prepare(jobs, images, None))
+        return self.results
+
+    def fail(self, index, error):
+        self.results[index] = {"row": index + 1, "username": self.usernames[index], "error": error}
+
+    def validate(self, rows):
+        # Cheap checks first, so bad rows never reach the pool
+        jobs = []
+        seen = set()
+        for index, raw in enumerate(rows):
+            serializer = BulkEnrollmentRowSerializer(data=raw)
+            if not serializer.is_valid():
+                self.fail(index, serializer.errors)
+                continue
+            row = dict(serializer.validated_data)
+            if row['username'] in seen:
+                self.fail(index, "Duplicate username in the manifest.")
+                continue
+            seen.add(row['username'])
+            jobs.append((index, row, row.pop(MANIFEST_IMAGE_COLUMN)))
+        return jobs
+
+    def prepare(self, jobs, images, pool):
+        """
+        Yields (index, future) in manifest order. Images are read as jobs are
+        submitted and only a few jobs per worker are in flight, so a large
+        batch never holds all of its images in memory.
+        """
+        in_flight = deque()
+        for index, row, image_name in jobs:
+            in_flight.append((index, self.submit(pool, row, images, image_name)))
+            if len(in_flight) > max(1, self.workers) * 4:
+                yield in_flight.popleft()
+        while in_flight:
+            yield in_flight.popleft()
+
+    @staticmethod
+    def submit(pool, row, images, image_name):
+        future = Future()
+        try:
+            image = images.read(image_name)
+            if pool is not None:
+                return pool.submit(prepare_customer, row, image)
+            future.set_result(prepare_customer(row, image))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def write(self, prepared):
+        chunk = []
+        for index, future in prepared:
+            try:
+                chunk.append((index, future.result()))
+            except Exception as e:
+                # No face, unreadable image, a crashed worker...: this row only
+                self.pool_broken |= isinstance(e, BrokenProcessPool)
+                self.fail(index, str(e))
+                continue
+            if len(chunk) >= self.chunk_size:
+                self.insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.insert_chunk(chunk)
+
+    def insert_chunk(self, chunk):
+        # One query finds the usernames that are already taken
+        taken = set(User.objects.filter(
+            username__in=[row['username'] for _, row in chunk]
+        ).values_list('username', flat=True))
+        for index, row in chunk:
+            if row['username'] in taken:
+                self.fail(index, "A user with that username already exists.")
+        chunk = [(index, row) for index, row in chunk if row['username'] not in taken]
+        if not chunk:
+            return
+        try:
+            self.insert_rows(chunk)
+        except IntegrityError:
+            # Someone registered one of these usernames meanwhile; isolate the row(s)
+            if len(chunk) == 1:
+                self.fail(chunk[0][0], "A user with that username already exists.")
+                return
+            for item in chunk:
+                self.insert_chunk([item])
+
+    def insert_rows(self, chunk):
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=row['username'],
+                    password=row['password'],
+                    email=row['email'],
+                    first_name=row['first_name'],
+                    last_name=row['last_name'],
+                    role='CUSTOMER',
+                )
+                for _, row in chunk
+            ])
+            Wallet.objects.bulk_create(Wallet(owner=user) for user in users)
+            biometrics = BiometricData.objects.bulk_create(
+                BiometricData(owner=user, biometric_type=row['biometric_type'], template=row['template'])
+                for user, (_, row) in zip(users, chunk)
+            )
+            transaction.on_commit(lambda: self.index(biometrics))
+
+        for user, (index, row) in zip(users, chunk):
+            self.results[index] = {"row": index + 1, "username": row['username'], "id": user.id}
+
+    @staticmethod
+    def index(biometrics):
+        # Make the new customers identifiable without waiting for an index refresh
+        index = get_template_index()
+        for biometric_data in biometrics:
+            if biometric_data.biometric_type == 'FACE':
+                index.add(biometric_data.id, biometric_data.owner_id, biometric_data.stored_histogram())
+
+
+class BulkEnrollmentBusy(APIException):
+    """
+    BULK_ENROLL_MAX_CONCURRENT bulk enrollments are already running in this
+    process. Returned as a 503 with a Retry-After header.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Another bulk enrollment is running, please retry shortly.'
+    default_code = 'bulk_enrollment_busy'
+    wait = 5
+
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+
+def enroll_from_request(rows, images):
+    """
+    Runs a BulkEnrollment for the HTTP endpoint. Requests share one pool of
+    BULK_ENROLL_WORKERS processes, started on first use, and at most
+    BULK_ENROLL_MAX_CONCURRENT of them run at once; the rest get
+    BulkEnrollmentBusy rather than more processes.
+    """
+    global _pool, _slots
+    with _lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(max(1, settings.BULK_ENROLL_MAX_CONCURRENT))
+    if not _slots.acquire(blocking=False):
+        raise BulkEnrollmentBusy()
+    try:
+        pool = None
+        if settings.BULK_ENROLL_WORKERS > 0:
+            with _lock:
+                if _pool is None:
+                    _pool = worker_pool(settings.BULK_ENROLL_WORKERS)
+                pool = _pool
+        enrollment = BulkEnrollment(workers=settings.BULK_ENROLL_WORKERS, pool=pool)
+        results = enrollment.run(rows, images)
+        if enrollment.pool_broken:
+            # A worker died (e.g. OOM on a huge image); start a fresh pool next time
+            with _lock:
+                if _pool is pool:
+                    _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+        return results
+    finally:
+        _slots.release()
@@ -1,16 +1,24 @@
+import logging
+import time
+
 import cv2
 import numpy as np
 from django.conf import settings
 import os
 from io import BytesIO # Needed for handling processed image data
 
-# Initialize the LBPH Face Recognizer globally.
-RECOGNIZER = cv2.face.LBPHFaceRecognizer_create(
-    radius=1,
-    neighbors=8,
-    grid_x=8,
-    grid_y=8
-)
+# LBPH parameters. These match what
+# cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=8, grid_x=8, grid_y=8)
+# computes; the NumPy implementation below replaces the stateful recognizer.
+LBPH_RADIUS = 1
+LBPH_NEIGHBORS = 8
+LBPH_GRID_X = 8
+LBPH_GRID_Y = 8
+LBPH_PATTERNS = 2 ** LBPH_NEIGHBORS
+LBPH_HISTOGRAM_SIZE = LBPH_GRID_X * LBPH_GRID_Y * LBPH_PATTERNS
+
+# Probe/template pairs compared per chunk in chi_square_distances (bounds temporary memory)
+CHI_SQUARE_CHUNK = 256
 
 # Define the acceptable distance for LBPH.
 # This threshold (e.g., 60-80) is an empirical measure of dissimilarity (distance)
@@ -18,6 +26,13 @@ RECOGNIZER = cv2.face.LBPHFaceRecognizer_create(
 LBPH_DISTANCE_THRESHOLD = 150 
 FACE_SIZE = (100, 100) 
 
+# Pixels per LBPH grid cell for a FACE_SIZE crop. Every histogram bin is a
+# multiple of 1 / LBPH_CELL_PIXELS, so histograms pack losslessly as uint8 counts.
+LBPH_CELL_PIXELS = (
+    ((FACE_SIZE[1] - 2 * LBPH_RADIUS) // LBPH_GRID_Y)
+    * ((FACE_SIZE[0] - 2 * LBPH_RADIUS) // LBPH_GRID_X)
+)
+
 # Haar Cascade is initialized globally
 CASCADE_PATH = os.path.join(
     settings.BASE_DIR, "api", "haarcascade_frontalface_default.xml"
@@ -27,22 +42,120 @@ if not os.path.exists(CASCADE_PATH):
 
 face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
 
+logger = logging.getLogger(__name__)
+
 
-def preprocess_image_for_comparison(image_data, is_file_path=False):
+class ProcessedFrame:
     """
-    Decodes the image, converts to grayscale, detects the face, crops, and resizes to 100x100.
-    Returns the preprocessed grayscale face crop, or None if no face is detected.
+    A request-scoped image that has been decoded, equalized and scanned for a
+    face exactly once. The serializer builds it and the view hands it straight
+    to verification, so the frame is never decoded twice.
+    """
+
+    def __init__(self, gray, equalized, face_box, timings=None):
+        self.gray = gray
+        self.equalized = equalized
+        # (x, y, w, h) of the first detected face, or None
+        self.face_box = face_box
+        self.face = None
+        if face_box is not None:
+            x, y, w, h = face_box
+            # Resize the crop to the standard size (100x100)
+            self.face = cv2.resize(equalized[y : y + h, x : x + w], FACE_SIZE)
+        # Seconds spent decoding, equalizing and detecting, for the
+        # request's Server-Timing (the frame may come from a worker process)
+        self.timings = timings or {}
+
+    @classmethod
+    def from_face(cls, face, timings=None):
+        """
+        A frame for a face that was already cropped (a POS terminal's upload),
+        with no full-resolution images behind it.
+        """
+        frame = cls(None, None, None, timings)
+        frame.face = face
+        return frame
+
+    @property
+    def has_face(self):
+        return self.face is not None
+
+    def compact(self):
+        """
+        Drops the full-resolution images, keeping the face box and crop.
+        Used before a frame is sent back from a worker process.
+        """
+        self.gray = None
+        self.equalized = None
+        return self
+
+
+def read_upload(uploaded_file):
     """
-    if is_file_path:
-        # Load stored template directly as grayscale
-        img = cv2.imread(image_data, cv2.IMREAD_GRAYSCALE)
+    Returns the raw bytes of an uploaded file, leaving its pointer at the start.
+    """
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return data
+
+
+def detect_face_box(equalized, mode=None):
+    """
+    Runs the Haar cascade and returns the first face as (x, y, w, h) in
+    full-resolution coordinates, or None.
+
+    "accurate" mode scans the full frame at every scale. "fast" mode scans a
+    copy downscaled to FACE_DETECTION_MAX_DIMENSION, only at face sizes
+    between FACE_DETECTION_MIN_FACE_RATIO and FACE_DETECTION_MAX_FACE_RATIO
+    of the frame's shorter side, then maps the box back to full resolution.
+    """
+    mode = mode or settings.FACE_DETECTION_MODE
+    if mode != 'fast':
+        faces = face_cascade.detectMultiScale(equalized, scaleFactor=1.1, minNeighbors=5)
+        return tuple(int(v) for v in faces[0]) if len(faces) else None
+
+    height, width = equalized.shape[:2]
+    scale = min(1.0, settings.FACE_DETECTION_MAX_DIMENSION / max(height, width))
+    if scale < 1.0:
+        small = cv2.resize(equalized, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small = equalized
+
+    shorter = min(small.shape[:2])
+    min_side = max(24, int(shorter * settings.FACE_DETECTION_MIN_FACE_RATIO))
+    max_side = max(min_side, int(shorter * settings.FACE_DETECTION_MAX_FACE_RATIO))
+    faces = face_cascade.detectMultiScale(
+        small, scaleFactor=1.1, minNeighbors=5,
+        minSize=(min_side, min_side), maxSize=(max_side, max_side),
+    )
+    if len(faces) == 0:
+        return None
+
+    x, y, w, h = (int(round(v / scale)) for v in faces[0])
+    # Rounding can push the box a pixel past the frame
+    return x, y, min(w, width - x), min(h, height - y)
+
+
+def process_frame(image_bytes, mode=None):
+    """
+    Decodes an encoded image, converts to grayscale, equalizes it and detects
+    the face. Returns a ProcessedFrame (face_box is None if no face was found).
+    Raises ValueError if the image cannot be decoded.
+    """
+    mode = mode or settings.FACE_DETECTION_MODE
+    started = time.perf_counter()
+    img_array = np.frombuffer(image_bytes, np.uint8)
+    if mode == 'fast':
+        # Let the decoder produce grayscale directly instead of BGR + cvtColor
+        img = cv2.imdecode(img_array, cv2.IMREAD_GRAYSCALE)
     else:
-        # For live image (from request)
-        img_array = np.frombuffer(image_data.read(), np.uint8)
         img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
 
     if img is None:
-        return None
+        raise ValueError("Failed to decode image data.")
+
+    decoded = time.perf_counter()
 
     # Ensure it's grayscale for processing (necessary for LBPH)
     if len(img.shape) == 3:
@@ -52,131 +165,335 @@ def preprocess_image_for_comparison(image_data, is_file_path=False):
 
     # Apply Histogram Equalization to normalize brightness (key for LBPH)
     equalized_gray = cv2.equalizeHist(gray)
+    equalized = time.perf_counter()
+
+    # Use the first detected face
+    face_box = detect_face_box(equalized_gray, mode)
+    timings = {
+        'decode': decoded - started,
+        'equalize': equalized - decoded,
+        'detect': time.perf_counter() - equalized,
+    }
+    return ProcessedFrame(gray, equalized_gray, face_box, timings)
 
-    # Detect face (using cascade as before)
-    faces = face_cascade.detectMultiScale(equalized_gray, scaleFactor=1.1, minNeighbors=5)
 
-    if len(faces) == 0:
-        return None  # No face detected
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
 
-    # Use the first detected face
-    x, y, w, h = faces[0]
-    face_crop = equalized_gray[y : y + h, x : x + w]
 
-    # Resize to the standard size (100x100)
-    return cv2.resize(face_crop, FACE_SIZE)
+def process_face_crop(data, crop_format, width, height):
+    """
+    Builds a ProcessedFrame from a face cropped on the client: `width` x
+    `height` grayscale pixels, either 'raw' (one byte per pixel, row by row)
+    or a 'png'. Only the crop is decoded and equalized; there is no face
+    detection. Raises ValueError if the data doesn't match the declared
+    format and size.
+    """
+    started = time.perf_counter()
+    if crop_format == 'raw':
+        if len(data) != width * height:
+            raise ValueError(f"Expected {width * height} bytes for a {width}x{height} raw face, got {len(data)}.")
+        face = np.frombuffer(data, np.uint8).reshape(height, width)
+    elif crop_format == 'png':
+        # Check the size in the IHDR header before decoding anything
+        if len(data) < 24 or data[:8] != PNG_SIGNATURE or data[12:16] != b'IHDR':
+            raise ValueError("The face crop is not a PNG image.")
+        declared = (int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big'))
+        if declared != (width, height):
+            raise ValueError(f"The PNG face is {declared[0]}x{declared[1]}, not {width}x{height}.")
+        face = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if face is None:
+            raise ValueError("Failed to decode the PNG face.")
+    else:
+        raise ValueError(f"Unsupported face crop format: {crop_format}.")
+    decoded = time.perf_counter()
+
+    if face.shape != FACE_SIZE[::-1]:
+        face = cv2.resize(face, FACE_SIZE)
+    # Same normalization as a full frame gets, applied to the crop alone
+    face = cv2.equalizeHist(face)
+    timings = {'decode': decoded - started, 'equalize': time.perf_counter() - decoded}
+    return ProcessedFrame.from_face(face, timings)
 
 
-def compare_faces(stored_template_path, live_image_data):
+def _lbp_sampling_points():
+    """
+    Bilinear sampling points and weights for the circular LBP neighbourhood,
+    computed the same way (and with the same float32 rounding) as OpenCV.
+    """
+    points = []
+    for n in range(LBPH_NEIGHBORS):
+        x = np.float32(LBPH_RADIUS * np.cos(2.0 * np.pi * n / float(LBPH_NEIGHBORS)))
+        y = np.float32(-LBPH_RADIUS * np.sin(2.0 * np.pi * n / float(LBPH_NEIGHBORS)))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = np.float32(x - fx), np.float32(y - fy)
+        one = np.float32(1)
+        weights = (
+            (one - tx) * (one - ty),
+            tx * (one - ty),
+            (one - tx) * ty,
+            tx * ty,
+        )
+        offsets = ((fy, fx), (fy, cx), (cy, fx), (cy, cx))
+        points.append(tuple(zip(offsets, weights)))
+    return points
+
+
+LBP_SAMPLING_POINTS = _lbp_sampling_points()
+
+
+def lbp_codes(faces):
+    """
+    Applies the circular LBP operator to a stack of grayscale faces.
+    Accepts an (H, W) or (N, H, W) array and returns (N, H-2r, W-2r) int32 codes.
     """
-    Compares two faces using the Local Binary Patterns Histogram (LBPH) method.
+    faces = np.asarray(faces)
+    if faces.ndim == 2:
+        faces = faces[np.newaxis]
+    src = faces.astype(np.float32)
+    r = LBPH_RADIUS
+    rows, cols = src.shape[1], src.shape[2]
+    center = src[:, r : rows - r, r : cols - r]
+    eps = np.finfo(np.float32).eps
+
+    codes = np.zeros(center.shape, dtype=np.int32)
+    for n, samples in enumerate(LBP_SAMPLING_POINTS):
+        t = None
+        for (dy, dx), weight in samples:
+            term = weight * src[:, r + dy : rows - r + dy, r + dx : cols - r + dx]
+            t = term if t is None else t + term
+        codes |= ((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n
+    return codes
+
+
+def lbph_histograms(faces):
     """
-    stored_face = preprocess_image_for_comparison(
-        stored_template_path, is_file_path=True
+    Computes LBPH spatial histograms for a stack of faces in one call.
+    Accepts an (H, W) or (N, H, W) uint8 array and returns an
+    (N, grid_x * grid_y * 256) float32 array, each cell normalized by its
+    pixel count.
+    """
+    codes = lbp_codes(faces)
+    count, rows, cols = codes.shape
+    cell_h, cell_w = rows // LBPH_GRID_Y, cols // LBPH_GRID_X
+
+    # (N, grid_y, cell_h, grid_x, cell_w) -> (N, cells, pixels per cell)
+    cells = codes[:, : LBPH_GRID_Y * cell_h, : LBPH_GRID_X * cell_w]
+    cells = cells.reshape(count, LBPH_GRID_Y, cell_h, LBPH_GRID_X, cell_w)
+    cells = cells.transpose(0, 1, 3, 2, 4).reshape(count, LBPH_GRID_Y * LBPH_GRID_X, -1)
+
+    # Offset every code by its (face, cell) bin block so one bincount covers the stack
+    blocks = np.arange(count * LBPH_GRID_Y * LBPH_GRID_X).reshape(count, -1, 1)
+    binned = np.bincount(
+        (cells + blocks * LBPH_PATTERNS).ravel(),
+        minlength=count * LBPH_HISTOGRAM_SIZE,
     )
-    live_face = preprocess_image_for_comparison(live_image_data, is_file_path=False)
+    histograms = binned.reshape(count, LBPH_HISTOGRAM_SIZE).astype(np.float32)
+    return histograms / np.float32(cell_h * cell_w)
 
-    if stored_face is None or live_face is None:
-        print("Debug: No face detected in one or both images after pre-processing.")
-        return False
 
-    # LBPH requires training on the known face before prediction
-    faces = [stored_face]
-    labels = np.array([1])  # Training with a dummy label
+def compute_lbph_histogram(face):
+    """
+    Computes the LBPH feature histogram for a preprocessed 100x100 face.
+    Returns a flat float32 array (grid_x * grid_y * 256 values).
+    """
+    return lbph_histograms(face)[0]
+
+
+def chi_square_distances(probe_histograms, template_histograms):
+    """
+    Chi-square (alternative) distances between every probe and every template,
+    the measure LBPHFaceRecognizer.predict() reports. Accepts (P, D) / (D,)
+    and (M, D) arrays and returns a (P, M) float64 matrix.
+    """
+    probes = np.atleast_2d(np.asarray(probe_histograms, dtype=np.float32))
+    templates = np.atleast_2d(np.asarray(template_histograms, dtype=np.float32))
+    distances = np.empty((probes.shape[0], templates.shape[0]), dtype=np.float64)
+
+    # Keep the (probes x chunk x D) temporaries to about CHI_SQUARE_CHUNK rows
+    step = max(1, CHI_SQUARE_CHUNK // probes.shape[0])
+    for start in range(0, templates.shape[0], step):
+        chunk = templates[np.newaxis, start : start + step]
+        diff = (probes[:, np.newaxis] - chunk).astype(np.float64)
+        total = (probes[:, np.newaxis] + chunk).astype(np.float64)
+        ratio = np.divide(diff * diff, total, out=np.zeros_like(total), where=total > 0)
+        distances[:, start : start + step] = 2.0 * ratio.sum(axis=2)
+    return distances
+
+
+def verify_batch(probes, templates, threshold=LBPH_DISTANCE_THRESHOLD):
+    """
+    Verifies a stack of preprocessed probe faces (N x 100 x 100) against the
+    matching stored histograms (N x D), pairing them row by row.
+    Returns (distances, matches) arrays of length N.
+    """
+    probe_histograms = lbph_histograms(probes)
+    templates = np.atleast_2d(np.asarray(templates, dtype=np.float32))
+    if probe_histograms.shape != templates.shape:
+        raise ValueError("verify_batch needs one stored histogram per probe face.")
 
-    try:
-        # Train the model with the stored template
-        RECOGNIZER.train(faces, labels)
+    diff = (probe_histograms - templates).astype(np.float64)
+    total = (probe_histograms + templates).astype(np.float64)
+    ratio = np.divide(diff * diff, total, out=np.zeros_like(total), where=total > 0)
+    distances = 2.0 * ratio.sum(axis=1)
+    return distances, distances < threshold
 
-        # Predict the label and get the confidence (distance) for the live face
-        predicted_label, distance = RECOGNIZER.predict(live_face)
 
-        print(
-            f"Debug: LBPH Distance = {distance:.2f} (Threshold: < {LBPH_DISTANCE_THRESHOLD})"
-        )
+def histogram_to_bytes(histogram):
+    """
+    Serializes an LBPH histogram for storage in a BinaryField.
+    """
+    return np.asarray(histogram, dtype="<f4").tobytes()
 
-        # FIX: Remove the 'predicted_label == 1' check. Trust the distance score alone.
-        # This prevents false rejections when the distance is good but the label check fails.
-        if distance < LBPH_DISTANCE_THRESHOLD:
-            return True
 
-    except cv2.error as e:
-        print(f"OpenCV Error during prediction: {e}")
-        return False
+def histogram_from_bytes(data):
+    """
+    Restores an LBPH histogram stored with histogram_to_bytes().
+    """
+    return np.frombuffer(bytes(data), dtype="<f4")
 
-    return False
+
+def pack_histograms(histograms):
+    """
+    Packs normalized LBPH histograms into uint8 bin counts. Lossless, and a
+    quarter of the float32 size.
+    """
+    histograms = np.atleast_2d(np.asarray(histograms, dtype=np.float32))
+    return np.rint(histograms * LBPH_CELL_PIXELS).astype(np.uint8)
 
 
-def validate_face_present(uploaded_file):
+def unpack_histograms(counts):
     """
-    Checks if a face is present in the uploaded file without saving the result.
-    Raises ValueError if no face is detected.
+    Restores normalized float32 histograms from packed counts.
     """
-    # This logic is correct for validation and is kept.
-    uploaded_file.seek(0)
-    # ... (rest of validate_face_present logic from previous step, ensuring seek(0) is at the end) ...
-    # NOTE: You should ensure the logic inside this function uses the new 'preprocess_image_for_comparison' 
-    # logic up to the face detection part to maintain consistency.
-    
-    # Simple check for now: just attempt to preprocess and check for None
-    temp_file = uploaded_file # Temporary alias
-    temp_file.seek(0)
-    
-    # We need a new function for registration since this one is now complex
-    # Let's keep the old logic but use the new preprocessing parts
-    img_array = np.frombuffer(temp_file.read(), np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+    return np.asarray(counts, dtype=np.float32) / np.float32(LBPH_CELL_PIXELS)
 
-    if img is None:
-        raise ValueError("Failed to decode image data.")
 
-    # Ensure it's grayscale for processing
-    if len(img.shape) == 3:
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = img
-        
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+# Compact face templates (BiometricData.template). The first byte is the format
+# version; version 1 is followed by the raw FACE_SIZE uint8 face, row by row,
+# and then its LBPH histogram packed as uint8 bin counts: 26 KB in all, read
+# with np.frombuffer alone.
+TEMPLATE_VERSION = 1
+TEMPLATE_FACE_BYTES = FACE_SIZE[0] * FACE_SIZE[1]
+TEMPLATE_V1_SIZE = 1 + TEMPLATE_FACE_BYTES + LBPH_HISTOGRAM_SIZE
 
-    if len(faces) == 0:
+
+def encode_template(face):
+    """
+    Serializes a preprocessed 100x100 grayscale face (and its histogram) as a
+    compact template.
+    """
+    face = np.ascontiguousarray(face, dtype=np.uint8)
+    if face.shape != FACE_SIZE[::-1]:
+        raise ValueError("Face templates must be preprocessed FACE_SIZE crops.")
+    counts = pack_histograms(compute_lbph_histogram(face))[0]
+    return bytes([TEMPLATE_VERSION]) + face.tobytes() + counts.tobytes()
+
+
+def decode_template(data):
+    """
+    Returns the (face, packed histogram counts) arrays of a compact template.
+    Both are read-only views of data.
+    """
+    data = bytes(data)
+    if not data or data[0] != TEMPLATE_VERSION or len(data) != TEMPLATE_V1_SIZE:
+        raise ValueError("Unsupported face template format.")
+    buffer = np.frombuffer(data, dtype=np.uint8, offset=1)
+    face = buffer[:TEMPLATE_FACE_BYTES].reshape(FACE_SIZE[::-1])
+    return face, buffer[TEMPLATE_FACE_BYTES:]
+
+
+def stored_histogram(template, lbph_histogram=None):
+    """
+    The enrolled LBPH histogram from a compact template or, for customers
+    enrolled before templates and not yet converted, the legacy float32
+    histogram column. Returns None if there is neither.
+    """
+    if template is not None:
+        return unpack_histograms(decode_template(template)[1])
+    if lbph_histogram is not None:
+        return histogram_from_bytes(lbph_histogram)
+    return None
+
+
+def load_template_face(stored_template_path):
+    """
+    Loads an enrolled face template (already cropped at registration) as a
+    100x100 grayscale array, or None if the file cannot be read.
+    """
+    stored_face = cv2.imread(stored_template_path, cv2.IMREAD_GRAYSCALE)
+    if stored_face is None:
+        return None
+    if stored_face.shape != FACE_SIZE[::-1]:
+        stored_face = cv2.resize(stored_face, FACE_SIZE)
+    return stored_face
+
+
+def template_from_file(stored_template_path):
+    """
+    Builds a compact template from a JPEG template file saved on disk by
+    earlier versions, or returns None if the file cannot be read.
+    """
+    stored_face = load_template_face(stored_template_path)
+    if stored_face is None:
+        return None
+    return encode_template(stored_face)
+
+
+def compare_faces(stored_histogram, live_frame):
+    """
+    Compares a live frame against an enrolled face using the Local Binary
+    Patterns Histogram (LBPH) method. The stored side is the histogram
+    computed at enrollment and the live side is the ProcessedFrame built by
+    the serializer, so no image is decoded here.
+    """
+    live_face = live_frame.face
+
+    if live_face is None:
+        logger.info("No face detected in the live image after pre-processing.")
+        return False
+
+    live_histogram = compute_lbph_histogram(live_face)
+    distance = chi_square_distances(live_histogram, stored_histogram)[0, 0]
+    matched = bool(distance < LBPH_DISTANCE_THRESHOLD)
+
+    logger.debug(
+        "LBPH comparison",
+        extra={'distance': round(float(distance), 2), 'threshold': LBPH_DISTANCE_THRESHOLD, 'matched': matched},
+    )
+
+    # Trust the distance score alone.
+    return matched
+
+
+# The functions below take raw image bytes and return picklable results so
+# they can run in the biometric worker pool (see api/biometric_worker.py).
+
+
+def validate_face_present(image_bytes):
+    """
+    Checks if a face is present in the image and returns the (compact)
+    ProcessedFrame so it can be reused for verification.
+    Raises ValueError if no face is detected.
+    """
+    frame = process_frame(image_bytes)
+
+    if not frame.has_face:
         raise ValueError("No face detected in the live image.")
-    
-    # Reset file pointer after reading so it can be read again in PaymentView
-    uploaded_file.seek(0)
-    return True
+
+    return frame.compact()
 
 
-def process_and_validate_face_for_registration(uploaded_file):
+def process_and_validate_face_for_registration(image_bytes):
     """
     Validates face detection and returns the processed 100x100 grayscale face
-    as a Django ContentFile, or raises an exception.
+    as a compact template (encode_template), or raises an exception.
     """
-    
-    # Read the content of the uploaded file
-    uploaded_file.seek(0) # Ensure we read from the start
-    img_array = np.frombuffer(uploaded_file.read(), np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-
-    if img is None:
-        raise ValueError("Failed to decode image data.")
+    frame = process_frame(image_bytes)
 
-    # Get the processed face using the common function
-    # Note: We must re-read the file if the above logic is used. A cleaner way
-    # is to pass the decoded array, but for now, we use the simpler I/O path.
-    uploaded_file.seek(0) # Reset pointer again for the preprocess function
-    processed_face = preprocess_image_for_comparison(uploaded_file, is_file_path=False)
-    
-    if processed_face is None:
+    if not frame.has_face:
         raise ValueError("No face detected in the uploaded image. Please try again.")
 
-    # Encode the processed face back into a JPEG byte stream
-    is_success, buffer = cv2.imencode(".jpg", processed_face)
-    
-    if not is_success:
-        raise ValueError("Failed to encode processed face image.")
-        
-    # Create a Django ContentFile to be saved by the model
-    from django.core.files.base import ContentFile
-    content_file = ContentFile(buffer.tobytes(), name=f'template_{uploaded_file.name}.jpg')
-    
-    return content_file
+    # The LBPH histogram goes into the template once here, so payments never
+    # have to recompute it (or decode an image) for the stored side.
+    return encode_template(frame.face)
@@ -0,0 +1,118 @@
+# api/idempotency.py
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyInFlight(APIException):
+    """
+    An earlier request with the same key is still running and didn't finish
+    within IDEMPOTENCY_WAIT_TIMEOUT.
+    """
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed, please retry.'
+    default_code = 'idempotency_in_flight'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyStore:
+    """
+    Remembers the outcome of requests by (owner, Idempotency-Key) in Django's
+    cache framework (settings.IDEMPOTENCY_CACHE_ALIAS), so any cache backend
+    can hold the records; use a shared one (Redis, Memcached, the database
+    cache) when running more than one process.
+
+    The first request claims the key with an atomic cache add(). Duplicates
+    that arrive while it runs poll until its outcome is stored, then replay
+    it. Outcomes are kept for IDEMPOTENCY_TTL seconds; a claim whose process
+    died expires after IDEMPOTENCY_LOCK_TIMEOUT.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.IDEMPOTENCY_CACHE_ALIAS]
+
+    @staticmethod
+    def cache_key(owner_id, key):
+        # Client keys can hold anything; memcached keys can't
+        return f'idempotency:{owner_id}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def claim(self, owner_id, key, fingerprint):
+        """
+        Returns None once this request owns the key, or the stored outcome
+        ({'status': ..., 'data': ...}) of the request that used it first.
+        `fingerprint` identifies the request (e.g. the bill id); reusing a
+        key for a different one raises IdempotencyKeyReused.
+        """
+        cache_key = self.cache_key(owner_id, key)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        delay = 0.05
+        while True:
+            pending = {'fingerprint': fingerprint, 'pending': True}
+            if self.cache.add(cache_key, pending, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                return None
+            entry = self.cache.get(cache_key)
+            if entry is None:
+                continue  # released or expired in between; try to claim it again
+            if entry['fingerprint'] != fingerprint:
+                raise IdempotencyKeyReused()
+            if not entry['pending']:
+                return entry
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInFlight()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def complete(self, owner_id, key, fingerprint, status_code, data):
+        entry = {'fingerprint': fingerprint, 'pending': False, 'status': status_code, 'data': data}
+        self.cache.set(self.cache_key(owner_id, key), entry, settings.IDEMPOTENCY_TTL)
+
+    def release(self, owner_id, key):
+        # Nothing worth replaying; the next attempt runs for real
+        self.cache.delete(self.cache_key(owner_id, key))
+
+
+def get_idempotency_key(request):
+    """
+    Returns the request's Idempotency-Key header, or None if it has none.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({IDEMPOTENCY_HEADER: f"Must be at most {MAX_KEY_LENGTH} characters."})
+    return key
+
+
+def replay_response(entry):
+    return Response(entry['data'], status=entry['status'], headers={'Idempotent-Replayed': 'true'})
+
+
+_idempotency_store = None
+_idempotency_store_lock = threading.Lock()
+
+
+def get_idempotency_store():
+    """
+    Returns the process-wide IdempotencyStore, creating it on first use.
+    """
+    global _idempotency_store
+    with _idempotency_store_lock:
+        if _idempotency_store is None:
+            _idempotency_store = IdempotencyStore()
+        return _idempotency_store
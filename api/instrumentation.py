@@ -0,0 +1,137 @@
+# api/instrumentation.py
+#
+# Per-request stage timing. RequestTimingMiddleware gives every request a
+# StageTimer; views time their stages with it (stage_timer(request)), and on
+# the way out the middleware reports them as a Server-Timing header, in the
+# latency histograms of api.metrics and in a structured log record.
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Accumulates named stage durations (seconds) for one request, in the
+    order the stages first ran.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages):
+        for name, seconds in (stages or {}).items():
+            self.add(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.stages.items()]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def stage_timer(request):
+    """
+    Returns the request's StageTimer. Requests that did not pass through the
+    middleware (and views used without a request, as the ledger tests do)
+    get a throwaway one.
+    """
+    timer = getattr(request, 'stage_timer', None)
+    if timer is None:
+        timer = StageTimer()
+        if request is not None:
+            request.stage_timer = timer
+    return timer
+
+
+def _start(request):
+    request.stage_timer = StageTimer()
+
+
+def _finish(request, response):
+    timer = request.stage_timer
+    total = timer.elapsed()
+    response['Server-Timing'] = timer.server_timing(total)
+
+    match = getattr(request, 'resolver_match', None)
+    # The URL name, never the path, so ids don't blow up the label set
+    endpoint = (match.url_name or match.view_name) if match else 'unmatched'
+    metrics.REQUEST_DURATION.observe(
+        total, endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    for name, seconds in timer.stages.items():
+        metrics.STAGE_DURATION.observe(seconds, endpoint=endpoint, stage=name)
+    if response.status_code == 401:
+        metrics.AUTH_FAILURES.inc(kind='token')
+
+    logger.debug(
+        "request finished",
+        extra={
+            'endpoint': endpoint,
+            'method': request.method,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in timer.stages.items()},
+        },
+    )
+    return response
+
+
+@sync_and_async_middleware
+def RequestTimingMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            _start(request)
+            return _finish(request, await get_response(request))
+    else:
+        def middleware(request):
+            _start(request)
+            return _finish(request, get_response(request))
+    return middleware
+
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a log record as one JSON object per line: time, level, logger and
+    message, plus any fields passed with `extra=`.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
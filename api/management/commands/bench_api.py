@@ -0,0 +1,252 @@
+# api/management/commands/bench_api.py
+
+import json
+import math
+import platform
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.face_utils import process_and_validate_face_for_registration
+from api.models import BiometricData, Bill, LedgerEntry, Transaction, User, Wallet
+
+PASSWORD = 'bench-password'
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    """
+    Throughput and latency percentiles (ms) for one endpoint's samples, a
+    list of (seconds, status code) pairs.
+    """
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    statuses = Counter(str(status) for _, status in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith('2')),
+        "status_codes": dict(sorted(statuses.items())),
+        "wall_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": round(percentile(latencies, 0.50), 2) if latencies else None,
+            "p95": round(percentile(latencies, 0.95), 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99), 2) if latencies else None,
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+
+def summarize_stages(headers):
+    """
+    Per-stage latency percentiles (ms) from the Server-Timing headers of an
+    endpoint's responses.
+    """
+    stages = {}
+    for header in headers:
+        for entry in (header or '').split(','):
+            name, _, duration = entry.strip().partition(';dur=')
+            if duration:
+                stages.setdefault(name, []).append(float(duration))
+    return {
+        name: {
+            "p50": round(percentile(sorted(values), 0.50), 2),
+            "p95": round(percentile(sorted(values), 0.95), 2),
+            "p99": round(percentile(sorted(values), 0.99), 2),
+        }
+        for name, values in stages.items()
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end load test of the payment API. Seeds shops, customers, wallets and face templates, "
+        "then drives auth/login/, shop/bills/, pay/ and wallet/transactions/ through the full Django "
+        "stack at each concurrency level, and prints throughput and p50/p95/p99 latencies as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('face', help='Photo with one face: enrolled for every customer and sent as the live image.')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], help='Client threads per run.')
+        parser.add_argument('--shops', type=int, default=4)
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--payments', type=int, default=200, help='Bills created and paid per run.')
+        parser.add_argument('--history-reads', type=int, default=200, help='Transaction history requests per run.')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['face'], 'rb') as f:
+                self.image = f.read()
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            self.template = process_and_validate_face_for_registration(self.image)
+        except ValueError as e:
+            raise CommandError(f"{options['face']}: {e}")
+        self.options = options
+        # Every test user shares one hash; logins still verify it per request
+        self.password_hash = make_password(PASSWORD)
+        self.host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+
+        report = {
+            "config": {
+                "shops": options['shops'],
+                "customers": options['customers'],
+                "payments": options['payments'],
+                "history_reads": options['history_reads'],
+                "database": connection.vendor,
+                "python": platform.python_version(),
+            },
+            "runs": [],
+        }
+        for concurrency in options['concurrency']:
+            self.stderr.write(f"Running with {concurrency} client thread(s)...")
+            report["runs"].append({"concurrency": concurrency, "endpoints": self.run(concurrency)})
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def seed(self):
+        suffix = uuid.uuid4().hex[:8]
+        shops = User.objects.bulk_create(
+            User(username=f'bench_api_shop_{suffix}_{i}', password=self.password_hash, role='SHOP_OWNER')
+            for i in range(self.options['shops'])
+        )
+        customers = User.objects.bulk_create(
+            User(username=f'bench_api_customer_{suffix}_{i}', password=self.password_hash, role='CUSTOMER')
+            for i in range(self.options['customers'])
+        )
+        Wallet.objects.bulk_create(Wallet(owner=shop) for shop in shops)
+        Wallet.objects.bulk_create(Wallet(owner=customer, balance=Decimal('100000.00')) for customer in customers)
+        BiometricData.objects.bulk_create(BiometricData(owner=customer, template=self.template) for customer in customers)
+        return shops, customers
+
+    def cleanup(self, users):
+        bills = Bill.objects.filter(initiating_shop__in=users)
+        LedgerEntry.objects.filter(wallet__owner__in=users).delete()
+        Transaction.objects.filter(bill__in=bills).delete()
+        bills.delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def drive(self, concurrency, jobs):
+        """
+        Runs the jobs (callables returning (status code, result)) on
+        `concurrency` threads, each with its own client and connection.
+        Returns (samples, results, wall seconds), in job order.
+        """
+        pending = queue.Queue()
+        for index, job in enumerate(jobs):
+            pending.put((index, job))
+        samples = [None] * len(jobs)
+        results = [None] * len(jobs)
+
+        def work():
+            client = APIClient(SERVER_NAME=self.host)
+            try:
+                while True:
+                    try:
+                        index, job = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.perf_counter()
+                    status_code, result = job(client)
+                    samples[index] = (time.perf_counter() - start, status_code)
+                    results[index] = result
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, results, time.perf_counter() - start
+
+    def run(self, concurrency):
+        shops, customers = self.seed()
+        endpoints = {}
+        try:
+            # 1. Everyone logs in
+            def login(user):
+                def job(client):
+                    response = client.post(
+                        reverse('token_obtain_pair'), {'username': user.username, 'password': PASSWORD}, format='json'
+                    )
+                    return response.status_code, response.data.get('access')
+                return job
+
+            users = shops + customers
+            samples, tokens, elapsed = self.drive(concurrency, [login(user) for user in users])
+            endpoints["auth/login/"] = summarize(samples, elapsed)
+            tokens = {user.id: token for user, token in zip(users, tokens)}
+
+            # 2. Shops bill customers, round robin
+            def create_bill(shop, customer):
+                def job(client):
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[shop.id]}')
+                    response = client.post(
+                        reverse('bill-list-create'), {'customer': customer.id, 'amount': '1.00'}, format='json'
+                    )
+                    return response.status_code, (shop.id, response.data.get('id'))
+                return job
+
+            payments = self.options['payments']
+            samples, bills, elapsed = self.drive(concurrency, [
+                create_bill(shops[i % len(shops)], customers[i % len(customers)]) for i in range(payments)
+            ])
+            endpoints["shop/bills/"] = summarize(samples, elapsed)
+
+            # 3. Each bill is paid with the customer's face
+            def pay(shop_id, bill_id):
+                def job(client):
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[shop_id]}')
+                    live_image = SimpleUploadedFile('live.jpg', self.image, content_type='image/jpeg')
+                    response = client.post(
+                        reverse('process-payment'), {'bill_id': bill_id, 'live_image': live_image}, format='multipart'
+                    )
+                    return response.status_code, response.get('Server-Timing')
+                return job
+
+            samples, timings, elapsed = self.drive(concurrency, [
+                pay(shop_id, bill_id) for shop_id, bill_id in bills if bill_id is not None
+            ])
+            endpoints["pay/"] = summarize(samples, elapsed)
+            # Where the time goes: decode, detect, match, lock wait, commit...
+            endpoints["pay/"]["stages_ms"] = summarize_stages(timings)
+
+            # 4. Customers (and shops, whose histories are the long ones) read their transactions
+            def history(user):
+                def job(client):
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[user.id]}')
+                    return client.get(reverse('wallet-transactions')).status_code, None
+                return job
+
+            samples, _, elapsed = self.drive(concurrency, [
+                history(users[i % len(users)]) for i in range(self.options['history_reads'])
+            ])
+            endpoints["wallet/transactions/"] = summarize(samples, elapsed)
+        finally:
+            self.cleanup(shops + customers)
+        return endpoints
@@ -0,0 +1,133 @@
+# api/management/commands/bench_concurrency.py
+
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.async_views import AsyncPaymentView, AsyncWalletDetailView
+from api.face_utils import process_and_validate_face_for_registration
+from api.models import BiometricData, Bill, LedgerEntry, Transaction, User, Wallet
+from api.views import PaymentView, WalletDetailView
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares how wallet reads are served while biometric payments are in flight, "
+        "with sync views on a fixed WSGI-style thread pool versus the async views on one event loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', required=True, help='Face photo used for enrollment and every payment.')
+        parser.add_argument('--payments', type=int, default=8, help='Concurrent payments per mode.')
+        parser.add_argument('--reads', type=int, default=200, help='Wallet reads issued alongside the payments.')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Worker threads for the WSGI mode.')
+
+    def handle(self, *args, **options):
+        with open(options['image'], 'rb') as f:
+            self.image = f.read()
+        self.factory = APIRequestFactory()
+        self.seed(options['payments'])
+        try:
+            results = {
+                "wsgi": self.run_wsgi(options),
+                "asgi": asyncio.run(self.run_asgi(options)),
+            }
+        finally:
+            self.cleanup()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, payments):
+        suffix = uuid.uuid4().hex[:8]
+        self.shop = User.objects.create_user(username=f'bench_shop_{suffix}', password='x', role='SHOP_OWNER')
+        self.customer = User.objects.create_user(username=f'bench_customer_{suffix}', password='x', role='CUSTOMER')
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=10 ** 6)
+        BiometricData.objects.create(
+            owner=self.customer,
+            template=process_and_validate_face_for_registration(self.image),
+        )
+        self.bills = [
+            Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=1).id
+            for _ in range(payments * 2)
+        ]
+
+    def cleanup(self):
+        LedgerEntry.objects.filter(wallet__owner_id__in=[self.shop.id, self.customer.id]).delete()
+        Transaction.objects.filter(bill_id__in=self.bills).delete()
+        Bill.objects.filter(id__in=self.bills).delete()
+        User.objects.filter(id__in=[self.shop.id, self.customer.id]).delete()
+
+    def payment_request(self, bill_id):
+        upload = SimpleUploadedFile('live.jpg', self.image, content_type='image/jpeg')
+        request = self.factory.post('/api/pay/', {'bill_id': bill_id, 'live_image': upload}, format='multipart')
+        force_authenticate(request, user=self.shop)
+        return request
+
+    def wallet_request(self):
+        request = self.factory.get('/api/wallet/')
+        force_authenticate(request, user=self.customer)
+        return request
+
+    def run_wsgi(self, options):
+        pay_view = PaymentView.as_view()
+        wallet_view = WalletDetailView.as_view()
+        bills = self.bills[: options['payments']]
+        start = time.perf_counter()
+
+        def timed(view, request):
+            view(request).render()
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=options['wsgi_threads']) as pool:
+            payments = [pool.submit(timed, pay_view, self.payment_request(b)) for b in bills]
+            reads = [pool.submit(timed, wallet_view, self.wallet_request()) for _ in range(options['reads'])]
+            payment_latencies = [f.result() for f in payments]
+            read_latencies = [f.result() for f in reads]
+        return {
+            "payments": summarize(payment_latencies),
+            "wallet_reads": summarize(read_latencies),
+            "wall_s": round(time.perf_counter() - start, 3),
+        }
+
+    async def run_asgi(self, options):
+        pay_view = AsyncPaymentView.as_view()
+        wallet_view = AsyncWalletDetailView.as_view()
+        bills = self.bills[options['payments'] :]
+        start = time.perf_counter()
+
+        async def timed(view, request):
+            response = await view(request)
+            response.render()
+            return time.perf_counter() - start
+
+        payments = [asyncio.create_task(timed(pay_view, self.payment_request(b))) for b in bills]
+        reads = [asyncio.create_task(timed(wallet_view, self.wallet_request())) for _ in range(options['reads'])]
+        payment_latencies = await asyncio.gather(*payments)
+        read_latencies = await asyncio.gather(*reads)
+        return {
+            "payments": summarize(payment_latencies),
+            "wallet_reads": summarize(read_latencies),
+            "wall_s": round(time.perf_counter() - start, 3),
+        }
@@ -0,0 +1,78 @@
+# api/management/commands/bench_face_detection.py
+
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.face_utils import process_frame
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+MODES = ('accurate', 'fast')
+
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    overlap = overlap_w * overlap_h
+    return overlap / float(aw * ah + bw * bh - overlap)
+
+
+class Command(BaseCommand):
+    help = "Times accurate vs fast face detection over a directory of fixture images and compares detection rates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', help='Directory of face photos (e.g. POS camera captures).')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per image and mode; the median is kept.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        directory = options['fixtures']
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory.")
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not paths:
+            raise CommandError(f"No images found in {directory}.")
+
+        timings = {mode: [] for mode in MODES}
+        detected = {mode: 0 for mode in MODES}
+        ious = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            boxes = {}
+            for mode in MODES:
+                runs = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    frame = process_frame(data, mode=mode)
+                    runs.append(time.perf_counter() - start)
+                timings[mode].append(statistics.median(runs))
+                boxes[mode] = frame.face_box
+                detected[mode] += frame.face_box is not None
+            if boxes['accurate'] and boxes['fast']:
+                ious.append(box_iou(boxes['accurate'], boxes['fast']))
+
+        report = {
+            "images": len(paths),
+            "modes": {
+                mode: {
+                    "mean_ms": round(statistics.mean(timings[mode]) * 1000, 2),
+                    "median_ms": round(statistics.median(timings[mode]) * 1000, 2),
+                    "detection_rate": round(detected[mode] / len(paths), 4),
+                }
+                for mode in MODES
+            },
+            "speedup": round(sum(timings['accurate']) / sum(timings['fast']), 2),
+            "detection_rate_change": round((detected['fast'] - detected['accurate']) / len(paths), 4),
+            "mean_box_iou": round(statistics.mean(ious), 3) if ious else None,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
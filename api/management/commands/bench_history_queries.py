@@ -0,0 +1,180 @@
+# api/management/commands/bench_history_queries.py
+
+import json
+import statistics
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from api.models import Bill, Transaction, User, Wallet
+from api.pagination import TransactionPagination
+from api.views import TransactionHistoryView
+
+HISTORY_INDEXES = ('txn_source_time_idx', 'txn_destination_time_idx')
+BILL_INDEXES = ('bill_shop_status_created_idx', 'bill_shop_created_idx')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a large synthetic ledger (PostgreSQL only) and compares the old transaction-history "
+        "and bill-list queries, without the composite indexes, to the index-backed keyset/UNION ALL "
+        "queries the views now run. Prints timings and EXPLAIN ANALYZE plans as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=10_000_000, help='Paid bills (and transactions) to seed.')
+        parser.add_argument('--shops', type=int, default=50)
+        parser.add_argument('--customers', type=int, default=100_000)
+        parser.add_argument('--batch', type=int, default=50_000, help='Rows seeded per transaction.')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the median is kept.')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("This benchmark needs PostgreSQL.")
+        self.options = options
+
+        report = {
+            "transactions": options['transactions'],
+            "shops": options['shops'],
+            "customers": options['customers'],
+        }
+        self.shops, self.customers = [], []
+        try:
+            start = time.perf_counter()
+            self.seed()
+            report["seed_s"] = round(time.perf_counter() - start, 1)
+            # A shop is the worst case: it receives a share of every payment
+            shop = self.shops[0]
+            report["shop_history"] = self.compare_history(shop)
+            report["customer_history"] = self.compare_history(self.customers[0])
+            report["shop_bill_list"] = self.compare_bills(shop)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self):
+        suffix = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            self.shops = User.objects.bulk_create(
+                User(username=f'hist_shop_{suffix}_{i}', password='!', role='SHOP_OWNER')
+                for i in range(self.options['shops'])
+            )
+            self.customers = User.objects.bulk_create(
+                User(username=f'hist_customer_{suffix}_{i}', password='!', role='CUSTOMER')
+                for i in range(self.options['customers'])
+            )
+            Wallet.objects.bulk_create(Wallet(owner=user) for user in self.shops + self.customers)
+        shop_ids = [user.id for user in self.shops]
+        customer_ids = [user.id for user in self.customers]
+
+        # Paid bills and their transactions, spread over a year, in batches
+        # so each commit's foreign-key checks stay manageable
+        total = self.options['transactions']
+        for first in range(1, total + 1, self.options['batch']):
+            last = min(total, first + self.options['batch'] - 1)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    WITH new_bills AS (
+                        INSERT INTO {Bill._meta.db_table}
+                            (initiating_shop_id, customer_id, amount, status, created_at, updated_at)
+                        SELECT (%s::bigint[])[1 + g %% %s], (%s::bigint[])[1 + (g * 7919) %% %s],
+                               1 + g %% 100, 'PAID_WALLET', ts, ts
+                        FROM generate_series(%s::bigint, %s::bigint) AS g,
+                             LATERAL (SELECT now() - interval '365 days' * random() AS ts) AS t
+                        RETURNING id, initiating_shop_id, customer_id, amount, created_at
+                    )
+                    INSERT INTO {Transaction._meta.db_table}
+                        (bill_id, source_wallet_id, destination_wallet_id, amount, timestamp)
+                    SELECT b.id, cw.id, sw.id, b.amount, b.created_at
+                    FROM new_bills b
+                    JOIN {Wallet._meta.db_table} cw ON cw.owner_id = b.customer_id
+                    JOIN {Wallet._meta.db_table} sw ON sw.owner_id = b.initiating_shop_id
+                    """,
+                    [shop_ids, len(shop_ids), customer_ids, len(customer_ids), first, last],
+                )
+            self.stderr.write(f"Seeded {last}/{total} transactions")
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Bill._meta.db_table}")
+            cursor.execute(f"ANALYZE {Transaction._meta.db_table}")
+
+    def cleanup(self):
+        shop_ids = [user.id for user in self.shops]
+        user_ids = shop_ids + [user.id for user in self.customers]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {Transaction._meta.db_table} t USING {Bill._meta.db_table} b "
+                f"WHERE t.bill_id = b.id AND b.initiating_shop_id = ANY(%s)",
+                [shop_ids],
+            )
+            cursor.execute(f"DELETE FROM {Bill._meta.db_table} WHERE initiating_shop_id = ANY(%s)", [shop_ids])
+            Wallet.objects.filter(owner_id__in=user_ids).delete()
+            User.objects.filter(id__in=user_ids).delete()
+
+    def measure(self, queryset, drop_indexes=()):
+        """
+        Median wall time and the EXPLAIN ANALYZE plan of a queryset. With
+        drop_indexes, it runs in a transaction that drops those indexes and
+        is rolled back, which is how the table looked before this change.
+        """
+        runs = []
+        plan = None
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for name in drop_indexes:
+                    cursor.execute(f'DROP INDEX "{name}"')
+                list(queryset.all())  # warm the cache
+                for _ in range(self.options['repeat']):
+                    start = time.perf_counter()
+                    list(queryset.all())
+                    runs.append(time.perf_counter() - start)
+                plan = queryset.explain(analyze=True, buffers=True)
+                raise Rollback()
+        except Rollback:
+            pass
+        return {"median_ms": round(statistics.median(runs) * 1000, 2), "plan": plan.splitlines()}
+
+    def history_page(self, user, position):
+        # Exactly what TransactionHistoryView runs for one page
+        view = TransactionHistoryView()
+        view.request = SimpleNamespace(user=user)
+        return TransactionPagination().page_queryset(
+            view.get_queryset(), position, False, self.options['page_size'] + 1, view
+        )
+
+    def compare_history(self, user):
+        wallet = Wallet.objects.get(owner=user)
+        history = Transaction.objects.filter(Q(source_wallet=wallet) | Q(destination_wallet=wallet))
+        total = history.count()
+        middle = history.order_by('-timestamp', '-id').values_list('timestamp', 'id')[total // 2]
+        # The query the view ran before: one OR across both foreign keys
+        old = history.order_by('-timestamp')[: self.options['page_size'] + 1]
+        return {
+            "wallet_transactions": total,
+            "before_first_page": self.measure(old, drop_indexes=HISTORY_INDEXES),
+            "after_first_page": self.measure(self.history_page(user, None)),
+            "after_deep_page": self.measure(self.history_page(user, middle)),
+        }
+
+    def compare_bills(self, shop):
+        limit = self.options['page_size'] + 1
+        # The old view listed every shop's bills, so it had no shop filter at all
+        old = Bill.objects.all().order_by('-created_at')[:limit]
+        new = Bill.objects.filter(initiating_shop=shop).order_by('-created_at', '-id')[:limit]
+        pending = Bill.objects.filter(initiating_shop=shop, status='PENDING').order_by('-created_at', '-id')[:limit]
+        return {
+            "before_all_bills_first_page": self.measure(old, drop_indexes=BILL_INDEXES),
+            "after_shop_first_page": self.measure(new),
+            "after_shop_pending_first_page": self.measure(pending),
+        }
@@ -0,0 +1,91 @@
+# api/management/commands/bench_serialization.py
+
+import json
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Bill, Transaction, User, Wallet
+from api.serializers import (
+    BillCreationSerializer, BillListSerializer, TransactionListSerializer, TransactionSerializer,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Times serializing large transaction and bill lists with the ModelSerializers versus the "
+        "values()-based list serializers (query included). Seeded rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help='Rows per response.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the median is kept.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        try:
+            with transaction.atomic():
+                report = self.run()
+                raise Rollback()
+        except Rollback:
+            pass
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, rows):
+        suffix = uuid.uuid4().hex[:8]
+        shop = User.objects.create(username=f'ser_shop_{suffix}', password='!', role='SHOP_OWNER')
+        customer = User.objects.create(username=f'ser_customer_{suffix}', password='!', role='CUSTOMER')
+        shop_wallet = Wallet.objects.create(owner=shop)
+        customer_wallet = Wallet.objects.create(owner=customer)
+        bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=shop, customer=customer, amount=Decimal(i % 1000) / 4, status='PAID_WALLET')
+            for i in range(rows)
+        )
+        Transaction.objects.bulk_create(
+            Transaction(bill=bill, source_wallet=customer_wallet, destination_wallet=shop_wallet, amount=bill.amount)
+            for bill in bills
+        )
+        return shop, shop_wallet
+
+    def time_path(self, build):
+        build()  # warm up
+        runs = []
+        for _ in range(self.options['repeat']):
+            start = time.perf_counter()
+            data = build()
+            runs.append(time.perf_counter() - start)
+        median = statistics.median(runs)
+        return data, {"median_ms": round(median * 1000, 1), "rows_per_s": round(len(data) / median)}
+
+    def compare(self, queryset, model_serializer, values_serializer):
+        before_data, before = self.time_path(lambda: model_serializer(list(queryset.all()), many=True).data)
+        after_data, after = self.time_path(
+            lambda: values_serializer(list(queryset.values(*values_serializer.value_fields()))).data
+        )
+        # Both paths must produce the same JSON
+        assert [dict(row) for row in before_data] == after_data
+        return {"model_serializer": before, "values_serializer": after,
+                "speedup": round(before["median_ms"] / after["median_ms"], 2)}
+
+    def run(self):
+        rows = self.options['rows']
+        shop, shop_wallet = self.seed(rows)
+        return {
+            "rows": rows,
+            "transactions": self.compare(
+                Transaction.objects.filter(destination_wallet=shop_wallet).order_by('-timestamp', '-id')[:rows],
+                TransactionSerializer, TransactionListSerializer,
+            ),
+            "bills": self.compare(
+                Bill.objects.filter(initiating_shop=shop).order_by('-created_at', '-id')[:rows],
+                BillCreationSerializer, BillListSerializer,
+            ),
+        }
@@ -0,0 +1,88 @@
+# api/management/commands/bench_shop_throughput.py
+
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+
+from api.models import Bill, LedgerEntry, Transaction, User, Wallet, WalletShard
+from api.views import PaymentView
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures wallet payments per second into a single shop at increasing worker counts, "
+        "with the shop wallet unsharded and sharded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker thread counts to try.')
+        parser.add_argument('--payments', type=int, default=400, help='Payments per run.')
+        parser.add_argument('--shards', type=int, default=8, help='Shard count for the sharded runs.')
+
+    def handle(self, *args, **options):
+        results = {}
+        for shards in (0, options['shards']):
+            runs = {}
+            for workers in options['workers']:
+                runs[str(workers)] = self.run(shards, workers, options['payments'])
+            results[f"shards_{shards}"] = runs
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, shards, payments):
+        suffix = uuid.uuid4().hex[:8]
+        shop = User.objects.create(username=f'bench_shop_{suffix}', password='!', role='SHOP_OWNER')
+        wallet = Wallet.objects.create(owner=shop, shard_count=shards)
+        WalletShard.objects.bulk_create(WalletShard(wallet=wallet, index=i) for i in range(shards))
+        # One customer per payment, so the shop wallet is the only shared row
+        customers = User.objects.bulk_create(
+            User(username=f'bench_customer_{suffix}_{i}', password='!', role='CUSTOMER') for i in range(payments)
+        )
+        Wallet.objects.bulk_create(Wallet(owner=customer, balance=Decimal('10.00')) for customer in customers)
+        bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=shop, customer=customer, amount=Decimal('1.00')) for customer in customers
+        )
+        return shop, customers, [bill.id for bill in bills]
+
+    def cleanup(self, shop, customers, bill_ids):
+        LedgerEntry.objects.filter(bill_id__in=bill_ids).delete()
+        Transaction.objects.filter(bill_id__in=bill_ids).delete()
+        Bill.objects.filter(id__in=bill_ids).delete()
+        User.objects.filter(id__in=[shop.id] + [customer.id for customer in customers]).delete()
+
+    def run(self, shards, workers, payments):
+        shop, customers, bill_ids = self.seed(shards, payments)
+        failures = []
+
+        def work(chunk):
+            view = PaymentView()
+            try:
+                for bill_id in chunk:
+                    bill = view.get_bill_queryset().get(id=bill_id)
+                    if view.settle(bill).status_code != 200:
+                        failures.append(bill_id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(bill_ids[i::workers],)) for i in range(workers)]
+        try:
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            wallet = Wallet.objects.with_shard_balance().get(owner=shop)
+            return {
+                "payments_per_s": round(payments / elapsed, 1),
+                "wall_s": round(elapsed, 3),
+                "failures": len(failures),
+                "shop_balance": str(wallet.total_balance),
+            }
+        finally:
+            self.cleanup(shop, customers, bill_ids)
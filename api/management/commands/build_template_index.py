@@ -0,0 +1,24 @@
+# api/management/commands/build_template_index.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.template_index import TemplateIndex
+
+
+class Command(BaseCommand):
+    help = "Writes the packed face histogram matrix that the identification index memory-maps at startup."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=None,
+            help='Output directory (defaults to settings.TEMPLATE_INDEX_PATH).',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.TEMPLATE_INDEX_PATH
+        if not path:
+            raise CommandError("Set TEMPLATE_INDEX_PATH or pass --path.")
+
+        written = TemplateIndex().save(path)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {written} face template(s) in {path}."))
@@ -0,0 +1,25 @@
+# api/management/commands/consolidate_wallet_shards.py
+
+from django.core.management.base import BaseCommand
+from api.models import Wallet
+
+
+class Command(BaseCommand):
+    help = "Folds the shard balances of sharded wallets back into their wallet rows. Meant to run periodically (e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only consolidate this user\'s wallet.')
+
+    def handle(self, *args, **options):
+        wallets = Wallet.objects.filter(shard_count__gt=0).select_related('owner')
+        if options['username']:
+            wallets = wallets.filter(owner__username=options['username'])
+
+        consolidated = 0
+        for wallet in wallets.iterator():
+            amount = wallet.consolidate_shards()
+            if amount:
+                consolidated += 1
+                self.stdout.write(f"{wallet.owner.username}: moved {amount} into the wallet balance")
+
+        self.stdout.write(self.style.SUCCESS(f"Consolidated {consolidated} wallet(s)."))
@@ -0,0 +1,65 @@
+# api/management/commands/convert_face_templates.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.face_utils import template_from_file
+from api.models import BiometricData
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts face templates stored as JPEG files (with a float32 histogram column) into compact "
+        "binary templates, so payments never read the filesystem. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Templates updated per transaction.')
+        parser.add_argument(
+            '--delete-files',
+            action='store_true',
+            help='Delete each converted JPEG file and clear its face_template path.',
+        )
+
+    def handle(self, *args, **options):
+        templates = (
+            BiometricData.objects.filter(biometric_type='FACE', template__isnull=True)
+            .exclude(face_template='')
+            .only('id', 'face_template')
+            .order_by('id')
+        )
+
+        converted = 0
+        failed = 0
+        batch = []
+        for biometric_data in templates.iterator(chunk_size=options['batch_size']):
+            template = template_from_file(biometric_data.face_template.path)
+            if template is None:
+                failed += 1
+                self.stderr.write(f"Could not read template for BiometricData #{biometric_data.id}")
+                continue
+            biometric_data.template = template
+            # The template holds the histogram now
+            biometric_data.lbph_histogram = None
+            batch.append(biometric_data)
+            if len(batch) == options['batch_size']:
+                converted += self.save(batch, options['delete_files'])
+                batch = []
+        if batch:
+            converted += self.save(batch, options['delete_files'])
+
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} template(s), {failed} failure(s)."))
+
+    def save(self, batch, delete_files):
+        files = [biometric_data.face_template.name for biometric_data in batch]
+        if delete_files:
+            for biometric_data in batch:
+                biometric_data.face_template = ''
+        with transaction.atomic():
+            BiometricData.objects.bulk_update(batch, ['template', 'lbph_histogram', 'face_template'])
+        # Only once the templates that replace them are committed
+        if delete_files:
+            storage = BiometricData._meta.get_field('face_template').storage
+            for name in files:
+                storage.delete(name)
+        return len(batch)
@@ -0,0 +1,40 @@
+# api/management/commands/rebuild_revenue_rollups.py
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Wallet
+from api.revenue import rebuild_rollups
+
+
+def parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Not a YYYY-MM-DD date: {value}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily revenue rollups behind GET /api/shop/revenue/ from the transaction table. "
+        "Run it once after upgrading to backfill past payments. Payments made while it runs on the same "
+        "days may be counted twice or not at all, so rebuild past days or run it while shops are closed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_day, help='First day to rebuild (YYYY-MM-DD); default: the first payment.')
+        parser.add_argument('--until', type=parse_day, help='Last day to rebuild (YYYY-MM-DD); default: today.')
+        parser.add_argument('--username', help='Only rebuild this shop\'s rollups.')
+
+    def handle(self, *args, **options):
+        if options['since'] and options['until'] and options['since'] > options['until']:
+            raise CommandError("--since is after --until.")
+        wallet_ids = None
+        if options['username']:
+            wallet_ids = list(Wallet.objects.filter(owner__username=options['username']).values_list('id', flat=True))
+            if not wallet_ids:
+                raise CommandError(f"No wallet for user {options['username']}.")
+
+        rows = rebuild_rollups(options['since'], options['until'], wallet_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily revenue row(s)."))
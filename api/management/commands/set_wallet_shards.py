@@ -0,0 +1,43 @@
+# api/management/commands/set_wallet_shards.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.models import Wallet, WalletShard
+
+
+class Command(BaseCommand):
+    help = "Turns sharded balances on or off for a shop's wallet, or changes its number of shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='The shop owner whose wallet to shard.')
+        parser.add_argument('shards', type=int, help='Number of shard rows; 0 turns sharding off.')
+
+    def handle(self, *args, **options):
+        count = options['shards']
+        if not 0 <= count <= 256:
+            raise CommandError("The shard count must be between 0 and 256.")
+        try:
+            wallet = Wallet.objects.select_related('owner').get(owner__username=options['username'])
+        except Wallet.DoesNotExist:
+            raise CommandError(f"No wallet found for {options['username']}.")
+        # Only credits are spread over shards; a debit checks the wallet row alone
+        if count and wallet.owner.role != 'SHOP_OWNER':
+            raise CommandError("Only shop wallets can be sharded.")
+
+        with transaction.atomic():
+            WalletShard.objects.bulk_create(
+                [WalletShard(wallet=wallet, index=index) for index in range(count)],
+                ignore_conflicts=True,
+            )
+            Wallet.objects.filter(id=wallet.id).update(shard_count=count)
+
+        # Payments that read the old count and hit a removed shard fall back to
+        # the wallet row. The surplus shards stay locked from consolidation
+        # until they are deleted, so no credit can land on them in between.
+        with transaction.atomic():
+            moved = wallet.consolidate_shards(from_index=count)
+            WalletShard.objects.filter(wallet=wallet, index__gte=count).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{wallet.owner.username}'s wallet now has {count} shard(s); moved {moved} into the wallet balance."
+        ))
@@ -0,0 +1,41 @@
+# api/management/commands/snapshot_wallet_balances.py
+
+from django.core.management.base import BaseCommand
+from api.models import Wallet
+
+
+class Command(BaseCommand):
+    help = (
+        "Records a balance snapshot for every wallet with new ledger entries, so ledger balances stay "
+        "a snapshot plus a short tail of entries. Meant to run periodically (e.g. from cron); run it once "
+        "after upgrading to carry existing balances into the ledger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only snapshot this user\'s wallet.')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Also compare each wallet\'s ledger balance with its cached balance (best run while payments are quiet).',
+        )
+
+    def handle(self, *args, **options):
+        wallets = Wallet.objects.select_related('owner').with_shard_balance()
+        if options['username']:
+            wallets = wallets.filter(owner__username=options['username'])
+
+        taken = mismatched = 0
+        for wallet in wallets.iterator():
+            if wallet.take_balance_snapshot():
+                taken += 1
+            if options['verify']:
+                ledger = wallet.ledger_balance()
+                if ledger != wallet.total_balance:
+                    mismatched += 1
+                    self.stderr.write(f"{wallet.owner.username}: ledger {ledger}, wallet {wallet.total_balance}")
+
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {taken} wallet(s)."))
+        if options['verify']:
+            if mismatched:
+                self.stdout.write(self.style.ERROR(f"{mismatched} wallet(s) disagree with their ledger."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Every wallet matches its ledger."))
@@ -0,0 +1,157 @@
+# api/metrics.py
+#
+# Prometheus metrics without the prometheus_client dependency: a few counters
+# and histograms kept in process memory and rendered in the text exposition
+# format by metrics_view (/metrics). Each process keeps its own numbers, so
+# with several workers Prometheus sees one worker per scrape; run one scrape
+# target per worker (or a single-process server) for exact totals.
+
+import hmac
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Request latency buckets (seconds), the Prometheus client defaults
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Payment stages are mostly well under a millisecond or two
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # A counter without labels reports 0 until its first increment
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (not cumulative), sum, count]
+        self._values = {}
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = next(i for i, bound in enumerate(self.buckets) if seconds <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def count(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            return entry[2] if entry else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'veinpay_request_duration_seconds',
+    'API request latency by endpoint (URL name), method and status.',
+    ['endpoint', 'method', 'status'],
+)
+STAGE_DURATION = Histogram(
+    'veinpay_stage_duration_seconds',
+    'Time spent in each stage of a request (see Server-Timing), by endpoint.',
+    ['endpoint', 'stage'],
+    buckets=STAGE_BUCKETS,
+)
+AUTH_FAILURES = Counter(
+    'veinpay_auth_failures_total',
+    'Rejected authentication: "token" for 401 responses, "biometric" for payments whose face check failed.',
+    ['kind'],
+)
+INSUFFICIENT_FUNDS = Counter(
+    'veinpay_insufficient_funds_total',
+    'Payments refused because the customer wallet could not cover the bill.',
+)
+PAYMENTS = Counter(
+    'veinpay_payments_total',
+    'Settled biometric payments.',
+)
+WALLET_CACHE_LOOKUPS = Counter(
+    'veinpay_wallet_cache_lookups_total',
+    'Wallet endpoint cache lookups by result ("hit" or "miss").',
+    ['result'],
+)
+
+REGISTRY = [REQUEST_DURATION, STAGE_DURATION, AUTH_FAILURES, INSUFFICIENT_FUNDS, PAYMENTS, WALLET_CACHE_LOOKUPS]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Serves every metric in the Prometheus text format. When METRICS_TOKEN is
+    set, scrapers must send it as "Authorization: Bearer <token>".
+    """
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
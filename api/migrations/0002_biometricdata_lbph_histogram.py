@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biometricdata',
+            name='lbph_histogram',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
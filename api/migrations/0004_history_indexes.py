@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_wallet_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['initiating_shop', 'status', '-created_at', '-id'], name='bill_shop_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['initiating_shop', '-created_at', '-id'], name='bill_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['source_wallet', '-timestamp', '-id'], name='txn_source_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['destination_wallet', '-timestamp', '-id'], name='txn_destination_time_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biometricdata',
+            name='template',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='biometricdata',
+            name='face_template',
+            field=models.ImageField(blank=True, upload_to='face_templates/'),
+        ),
+    ]
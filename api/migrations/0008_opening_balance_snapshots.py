@@ -0,0 +1,54 @@
+import decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+BALANCE_KINDS = ('PAYMENT', 'TOP_UP', 'ADJUSTMENT')
+
+
+def seed_opening_snapshots(apps, schema_editor):
+    """
+    Gives every wallet without a snapshot one from its current balance, so
+    balances from before the ledger carry over into it without anyone
+    having to run snapshot_wallet_balances first.
+    """
+    Wallet = apps.get_model('api', 'Wallet')
+    WalletShard = apps.get_model('api', 'WalletShard')
+    LedgerEntry = apps.get_model('api', 'LedgerEntry')
+    BalanceSnapshot = apps.get_model('api', 'BalanceSnapshot')
+
+    shards = dict(
+        WalletShard.objects.values('wallet').annotate(total=models.Sum('balance')).values_list('wallet', 'total')
+    )
+    ledger = {
+        row['wallet']: row
+        for row in LedgerEntry.objects.values('wallet').annotate(
+            last=models.Max('id'), total=models.Sum('amount', filter=models.Q(kind__in=BALANCE_KINDS))
+        )
+    }
+    now = timezone.now()
+    snapshots = []
+    for wallet_id, balance in Wallet.objects.filter(balance_snapshots__isnull=True).values_list('id', 'balance').iterator():
+        balance += shards.get(wallet_id) or decimal.Decimal('0.00')
+        entries = ledger.get(wallet_id, {})
+        snapshots.append(BalanceSnapshot(
+            wallet_id=wallet_id, entry_id=entries.get('last') or 0, balance=balance, as_of=now,
+            opening=balance != (entries.get('total') or 0),
+        ))
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='opening',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(seed_opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 # api/models.py
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+import datetime
 import decimal
 
 # Our custom User model
@@ -14,17 +17,160 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='CUSTOMER')
 
+    @property
+    def wallet_id(self):
+        # Token users (api.authentication.ClaimsUser) carry this as a claim instead
+        return self.wallet.id
+
+class WalletQuerySet(models.QuerySet):
+    def with_shard_balance(self):
+        """
+        Annotates each wallet with the sum of its shard balances, so
+        total_balance doesn't need a query per wallet.
+        """
+        shards = (
+            WalletShard.objects.filter(wallet=models.OuterRef('pk'))
+            .values('wallet').annotate(total=models.Sum('balance')).values('total')
+        )
+        return self.annotate(shard_balance=Coalesce(
+            models.Subquery(shards), models.Value(decimal.Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ))
+
 # The Wallet model, with a one-to-one link to a user
 class Wallet(models.Model):
     owner = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wallet')
+    # A cached projection of the wallet's ledger (LedgerEntry), kept up to date
+    # in the same transaction as each entry: reads and the overdraft check
+    # stay a single row, and ledger_balance() recomputes it from the ledger
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=decimal.Decimal('0.00'))
+    # Number of WalletShard sub-balances credits are spread over (0 = not sharded)
+    shard_count = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = WalletQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.owner.username}'s Wallet"
 
+    @property
+    def total_balance(self):
+        """
+        The wallet row plus any not-yet-consolidated shards.
+        """
+        if not self.shard_count:
+            return self.balance
+        shards = getattr(self, 'shard_balance', None)
+        if shards is None:
+            shards = self.shards.aggregate(total=models.Sum('balance'))['total'] or decimal.Decimal('0.00')
+        return self.balance + shards
+
+    def consolidate_shards(self, from_index=0):
+        """
+        Moves the balance of shards numbered from_index and up into the wallet
+        row and returns the amount moved. The shards are locked only for the
+        length of this short transaction.
+        """
+        with transaction.atomic():
+            shards = list(self.shards.select_for_update().filter(index__gte=from_index).order_by('index'))
+            amount = sum((shard.balance for shard in shards), decimal.Decimal('0.00'))
+            if amount:
+                WalletShard.objects.filter(id__in=[shard.id for shard in shards]).update(
+                    balance=decimal.Decimal('0.00'), updated_at=timezone.now()
+                )
+                Wallet.objects.filter(id=self.id).update(
+                    balance=models.F('balance') + amount, updated_at=timezone.now()
+                )
+        return amount
+
+    def ledger_balance(self, as_of=None):
+        """
+        The balance according to the ledger: the latest BalanceSnapshot plus
+        the entries written since. With `as_of` (a datetime), the balance at
+        that moment, or None if that is before the wallet's opening snapshot.
+        Two queries however long the wallet's history.
+        """
+        snapshots = self.balance_snapshots.order_by('-entry_id')
+        entries = self.ledger_entries.filter(kind__in=LedgerEntry.BALANCE_KINDS)
+        if as_of is not None:
+            snapshots = snapshots.filter(as_of__lte=as_of)
+            entries = entries.filter(created_at__lte=as_of)
+        balance = decimal.Decimal('0.00')
+        snapshot = snapshots.first()
+        if snapshot is not None:
+            balance = snapshot.balance
+            entries = entries.filter(id__gt=snapshot.entry_id)
+        elif as_of is not None and self.balance_snapshots.filter(opening=True).exists():
+            return None  # the ledger doesn't go back that far
+        return balance + (entries.aggregate(total=models.Sum('amount'))['total'] or 0)
+
+    def take_balance_snapshot(self):
+        """
+        Records a BalanceSnapshot covering the ledger entries older than
+        LEDGER_SNAPSHOT_DELAY, and returns it (None if there was nothing new).
+
+        The wallet's first snapshot is taken from the projection instead, with
+        the wallet row and its shards locked for a moment. If that balance is
+        more than its entries account for (a wallet funded outside the ledger)
+        it is an opening snapshot. Wallets that predate the ledger got theirs
+        from migration 0008.
+        """
+        last = self.balance_snapshots.order_by('-entry_id').first()
+        if last is None:
+            with transaction.atomic():
+                shards = list(WalletShard.objects.select_for_update().filter(wallet_id=self.id))
+                wallet = Wallet.objects.select_for_update().get(id=self.id)
+                balance = wallet.balance + sum((shard.balance for shard in shards), decimal.Decimal('0.00'))
+                ledger = self.ledger_entries.aggregate(
+                    last=models.Max('id'),
+                    total=models.Sum('amount', filter=models.Q(kind__in=LedgerEntry.BALANCE_KINDS)),
+                )
+                return BalanceSnapshot.objects.create(
+                    wallet=self, entry_id=ledger['last'] or 0, balance=balance, as_of=timezone.now(),
+                    opening=balance != (ledger['total'] or 0),
+                )
+
+        cutoff = timezone.now() - datetime.timedelta(seconds=settings.LEDGER_SNAPSHOT_DELAY)
+        newest = (
+            self.ledger_entries.filter(id__gt=last.entry_id, created_at__lte=cutoff)
+            .order_by('-id').values('id', 'created_at').first()
+        )
+        if newest is None:
+            return None
+        delta = self.ledger_entries.filter(
+            id__gt=last.entry_id, id__lte=newest['id'], kind__in=LedgerEntry.BALANCE_KINDS
+        ).aggregate(total=models.Sum('amount'))['total'] or 0
+        return BalanceSnapshot.objects.create(
+            wallet=self, entry_id=newest['id'], balance=last.balance + delta, as_of=newest['created_at']
+        )
+
+# Sub-balances of a busy shop wallet. Payments credit one shard each instead of
+# all queueing on the wallet row's lock; consolidate_wallet_shards periodically
+# folds them back into Wallet.balance. Only credits are spread, so only wallets
+# that are never debited (shops) should be sharded.
+class WalletShard(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=decimal.Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'index'], name='unique_wallet_shard_index'),
+        ]
+
+    def __str__(self):
+        return f"Shard {self.index} of {self.wallet}"
+
 # The BiometricData model for storing face templates
+class BiometricDataQuerySet(models.QuerySet):
+    def enrolled_faces(self):
+        # Face enrollments that have something to compare with
+        return self.filter(biometric_type='FACE').filter(
+            models.Q(template__isnull=False) | models.Q(lbph_histogram__isnull=False)
+        )
+
 class BiometricData(models.Model):
     BIOMETRIC_CHOICES = (
         ('FACE', 'Face'),
@@ -32,12 +178,31 @@ class BiometricData(models.Model):
     )
     owner = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='biometric_data')
     biometric_type = models.CharField(max_length=4, choices=BIOMETRIC_CHOICES, default='FACE')
-    # 'upload_to' organizes uploaded files into subdirectories
-    face_template = models.ImageField(upload_to='face_templates/')
+    # Compact face template: a version byte, the raw 100x100 face and its
+    # packed LBPH histogram (face_utils.encode_template)
+    template = models.BinaryField(null=True, blank=True, editable=False)
+    # Legacy storage, only set for customers enrolled before templates and not
+    # yet converted (manage.py convert_face_templates): a JPEG of the face
+    # under media/face_templates/ and its float32 LBPH histogram
+    face_template = models.ImageField(upload_to='face_templates/', blank=True)
+    lbph_histogram = models.BinaryField(null=True, blank=True, editable=False)
+
+    objects = BiometricDataQuerySet.as_manager()
 
     def __str__(self):
         return f"Biometric Data for {self.owner.username}"
 
+    def stored_histogram(self):
+        """
+        The enrolled LBPH histogram, or None if there is nothing to compare with.
+        """
+        from .face_utils import stored_histogram
+
+        if self.template is not None:
+            # lbph_histogram may be deferred; don't load it for nothing
+            return stored_histogram(self.template)
+        return stored_histogram(None, self.lbph_histogram)
+
 # The Bill model, initiated by a shop for a customer
 class Bill(models.Model):
     STATUS_CHOICES = (
@@ -54,6 +219,13 @@ class Bill(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A shop's bill list, newest first, with or without a status filter
+            models.Index(fields=['initiating_shop', 'status', '-created_at', '-id'], name='bill_shop_status_created_idx'),
+            models.Index(fields=['initiating_shop', '-created_at', '-id'], name='bill_shop_created_idx'),
+        ]
+
     def __str__(self):
         return f"Bill of {self.amount} for {self.customer.username} from {self.initiating_shop.username}"
 
@@ -65,5 +237,106 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # One ordered stream per side of a wallet's history (see TransactionHistoryView)
+            models.Index(fields=['source_wallet', '-timestamp', '-id'], name='txn_source_time_idx'),
+            models.Index(fields=['destination_wallet', '-timestamp', '-id'], name='txn_destination_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} from {self.source_wallet.owner.username} to {self.destination_wallet.owner.username}"
+
+# The wallet ledger: one append-only row per change to a wallet's money,
+# written in the same transaction as the change. Entries are never updated or
+# deleted; a correction is a new ADJUSTMENT entry. Wallet.balance (and its
+# shards) is the projection of the entries, and BalanceSnapshot lets a balance
+# be recomputed from the ledger without summing its whole history.
+class LedgerEntry(models.Model):
+    KIND_CHOICES = (
+        ('PAYMENT', 'Wallet Payment'),
+        ('TOP_UP', 'Top-up'),
+        ('CASH', 'Cash Payment'),
+        ('ADJUSTMENT', 'Adjustment'),
+    )
+    # Cash payments are recorded on the shop's ledger for its books, but the
+    # money never passes through the wallet
+    BALANCE_KINDS = ('PAYMENT', 'TOP_UP', 'ADJUSTMENT')
+
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='ledger_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Signed: credits are positive, debits negative
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    bill = models.ForeignKey(Bill, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_entries')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Entries since a snapshot, and up to a point in time
+            models.Index(fields=['wallet', 'id'], name='ledger_wallet_id_idx'),
+            models.Index(fields=['wallet', 'created_at'], name='ledger_wallet_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.amount} on wallet #{self.wallet_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only; record an ADJUSTMENT instead.")
+        super().save(*args, **kwargs)
+
+# A wallet's ledger balance counting every entry up to entry_id, the newest of
+# which was written at as_of. Taken periodically by
+# `manage.py snapshot_wallet_balances`; they can all be dropped and retaken.
+class BalanceSnapshot(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='balance_snapshots')
+    entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    as_of = models.DateTimeField()
+    # Carries over a balance from before the ledger: there is no ledger history before it
+    opening = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', '-entry_id'], name='snapshot_wallet_entry_idx'),
+            models.Index(fields=['wallet', '-as_of'], name='snapshot_wallet_as_of_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet} at {self.as_of}: {self.balance}"
+
+# Daily revenue rollups for the shop dashboard (api/revenue.py). Each wallet
+# payment adds to them in the same transaction as its Transaction row; they
+# hold nothing that can't be rebuilt with `manage.py rebuild_revenue_rollups`.
+class DailyRevenue(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='daily_revenue')
+    day = models.DateField()
+    # Payments to a sharded wallet spread over this many rows per day as well,
+    # so they don't all queue on one rollup row (the summary adds them up)
+    shard = models.PositiveSmallIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=decimal.Decimal('0.00'))
+    payments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'day', 'shard'], name='unique_daily_revenue'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet} on {self.day}: {self.revenue}"
+
+class CustomerDailyRevenue(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='customer_daily_revenue')
+    day = models.DateField()
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=decimal.Decimal('0.00'))
+    payments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'day', 'customer'], name='unique_customer_daily_revenue'),
+        ]
+
     def __str__(self):
-        return f"{self.amount} from {self.source_wallet.owner.username} to {self.destination_wallet.owner.username}"
\ No newline at end of file
+        return f"{self.customer} at {self.wallet} on {self.day}: {self.revenue}"
@@ -0,0 +1,177 @@
+# api/pagination.py
+
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a (timestamp, id) key. Each page is fetched with a
+    "rows before this key" filter and a LIMIT, so it costs the same however
+    deep the client has scrolled, and the id tiebreaker keeps rows that share
+    a timestamp from being skipped or repeated.
+
+    The response has the same shape as DRF's CursorPagination:
+    {"next": url, "previous": url, "results": [...]}.
+    """
+    # Both fields must sort in the same direction
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = settings.API_PAGE_SIZE
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        if requested > 0:
+            page_size = min(requested, settings.API_MAX_PAGE_SIZE)
+        return page_size
+
+    @property
+    def key_fields(self):
+        return tuple(field.lstrip('-') for field in self.ordering)
+
+    def key_ordering(self, reverse):
+        descending = self.ordering[0].startswith('-') != reverse
+        prefix = '-' if descending else ''
+        return tuple(prefix + field for field in self.key_fields)
+
+    def apply_keyset(self, queryset, position, reverse):
+        """
+        Orders the queryset by the key and keeps only the rows after
+        `position` (a (timestamp, id) pair, or None for the first page).
+        """
+        ordering = self.key_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is None:
+            return queryset
+        primary, tiebreak = self.key_fields
+        value, pk = position
+        op = 'lt' if ordering[0].startswith('-') else 'gt'
+        # The inclusive bound on the timestamp alone gives the database an
+        # index range to start from; the OR then settles ties on the id.
+        return queryset.filter(**{f'{primary}__{op}e': value}).filter(
+            Q(**{f'{primary}__{op}': value}) | Q(**{f'{tiebreak}__{op}': pk})
+        )
+
+    def page_queryset(self, queryset, position, reverse, limit, view=None):
+        """
+        Returns a queryset of up to `limit` rows after `position`.
+
+        A view whose rows come from several index-friendly filters (e.g. "sent
+        OR received") can define get_keyset_branches(). Each branch is then
+        keyset-filtered and limited on its own, so the database walks one
+        index per branch, and the branches are merged with UNION ALL. The
+        branches must not overlap.
+        """
+        get_branches = getattr(view, 'get_keyset_branches', None)
+        # SQLite can't LIMIT the members of a UNION; use the plain queryset there
+        if get_branches is None or not connections[queryset.db].features.supports_slicing_ordering_in_compound:
+            return self.apply_keyset(queryset, position, reverse)[:limit]
+        branches = [self.apply_keyset(branch, position, reverse)[:limit] for branch in get_branches()]
+        merged = branches[0].union(*branches[1:], all=True)
+        return merged.order_by(*self.key_ordering(reverse))[:limit]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        rows = list(self.page_queryset(queryset, position, reverse, self.page_size + 1, view))
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Scrolled past the last row; start again from the newest page
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def key_of(self, row):
+        if isinstance(row, dict):
+            return tuple(row[field] for field in self.key_fields)
+        return tuple(getattr(row, field) for field in self.key_fields)
+
+    def encode_cursor(self, row, reverse):
+        value, pk = self.key_of(row)
+        tokens = {'p': value.isoformat() if hasattr(value, 'isoformat') else value, 'i': pk}
+        if reverse:
+            tokens['r'] = '1'
+        encoded = b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model):
+        """
+        Returns ((timestamp, id) or None, reverse) for the request's cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            primary, tiebreak = self.key_fields
+            value = model._meta.get_field(primary).to_python(tokens['p'][0])
+            pk = model._meta.get_field(tiebreak).to_python(tokens['i'][0])
+            reverse = tokens.get('r', ['0'])[0] == '1'
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (value, pk), reverse
+
+
+class TransactionPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class BillPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class CustomerPagination(KeysetPagination):
+    ordering = ('-date_joined', '-id')
@@ -0,0 +1,115 @@
+# api/revenue.py
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CustomerDailyRevenue, DailyRevenue, Transaction
+
+
+def _add(model, keys, amount, payments=1):
+    """
+    Adds to one rollup row, creating it for the first payment of the day.
+    Normally a single UPDATE; a concurrent first payment that wins the
+    INSERT makes ours fall back to the UPDATE.
+    """
+    increment = {'revenue': F('revenue') + amount, 'payments': F('payments') + payments}
+    if model.objects.filter(**keys).update(**increment):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, revenue=amount, payments=payments)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**increment)
+
+
+def record_payment(txn, customer_id, shard_count=0):
+    """
+    Adds a wallet payment to its shop's rollups. Call it inside the atomic
+    block that created the Transaction, so both commit or neither does.
+    """
+    day = timezone.localdate(txn.timestamp)
+    # Spread like the wallet's shards (keyed by bill, as the "hash" strategy is)
+    shard = txn.bill_id % shard_count if shard_count else 0
+    _add(DailyRevenue, {'wallet_id': txn.destination_wallet_id, 'day': day, 'shard': shard}, txn.amount)
+    _add(
+        CustomerDailyRevenue,
+        {'wallet_id': txn.destination_wallet_id, 'day': day, 'customer_id': customer_id},
+        txn.amount,
+    )
+
+
+def rebuild_rollups(start=None, end=None, wallet_ids=None):
+    """
+    Recomputes the rollups for the days from start to end (inclusive; open
+    ended when None) from the Transaction table. Returns the number of
+    (wallet, day) rows written.
+    """
+    transactions = Transaction.objects.annotate(day=TruncDate('timestamp'))
+    daily = DailyRevenue.objects.all()
+    by_customer = CustomerDailyRevenue.objects.all()
+    if start is not None:
+        transactions = transactions.filter(day__gte=start)
+        daily = daily.filter(day__gte=start)
+        by_customer = by_customer.filter(day__gte=start)
+    if end is not None:
+        transactions = transactions.filter(day__lte=end)
+        daily = daily.filter(day__lte=end)
+        by_customer = by_customer.filter(day__lte=end)
+    if wallet_ids is not None:
+        transactions = transactions.filter(destination_wallet_id__in=wallet_ids)
+        daily = daily.filter(wallet_id__in=wallet_ids)
+        by_customer = by_customer.filter(wallet_id__in=wallet_ids)
+
+    with transaction.atomic():
+        daily.delete()
+        by_customer.delete()
+        rows = DailyRevenue.objects.bulk_create(
+            (
+                DailyRevenue(wallet_id=row['destination_wallet_id'], day=row['day'], revenue=row['revenue'], payments=row['payments'])
+                for row in transactions.values('destination_wallet_id', 'day')
+                .annotate(revenue=Sum('amount'), payments=Count('id'))
+                .order_by()
+            ),
+            batch_size=1000,
+        )
+        CustomerDailyRevenue.objects.bulk_create(
+            (
+                CustomerDailyRevenue(
+                    wallet_id=row['destination_wallet_id'], day=row['day'], customer_id=row['source_wallet__owner_id'],
+                    revenue=row['revenue'], payments=row['payments'],
+                )
+                for row in transactions.values('destination_wallet_id', 'day', 'source_wallet__owner_id')
+                .annotate(revenue=Sum('amount'), payments=Count('id'))
+                .order_by()
+            ),
+            batch_size=1000,
+        )
+    return len(rows)
+
+
+def revenue_summary(wallet_id, start, end, top):
+    """
+    Daily revenue and payment counts for a wallet between two dates
+    (inclusive), the totals, and its `top` customers by revenue. Reads only
+    the rollup tables: two queries whatever the transaction volume.
+    """
+    days = list(
+        DailyRevenue.objects.filter(wallet_id=wallet_id, day__gte=start, day__lte=end)
+        .values('day')
+        .annotate(revenue=Sum('revenue'), payments=Sum('payments'))
+        .order_by('day')
+    )
+    top_customers = list(
+        CustomerDailyRevenue.objects.filter(wallet_id=wallet_id, day__gte=start, day__lte=end)
+        .values('customer_id', 'customer__username')
+        .annotate(revenue=Sum('revenue'), payments=Sum('payments'))
+        .order_by('-revenue', 'customer_id')[:top]
+    )
+    return {
+        'days': days,
+        'revenue': sum((day['revenue'] for day in days), 0),
+        'payments': sum(day['payments'] for day in days),
+        'top_customers': top_customers,
+    }
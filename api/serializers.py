@@ -1,19 +1,28 @@
 # api/serializers.py
 
+import datetime
 import decimal
-from rest_framework import serializers
+from django.conf import settings
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import Wallet, Transaction, User, Bill, BiometricData
-from .face_utils import process_and_validate_face_for_registration  # <--- NEW IMPORT
 from rest_framework.exceptions import ValidationError  # <--- NEW IMPORT
+from .biometric_worker import run_biometric_job
 from .face_utils import (
+    FACE_SIZE,
     process_and_validate_face_for_registration,
-    compare_faces,
+    process_face_crop,
+    read_upload,
     validate_face_present,
 )
 
 class WalletSerializer(serializers.ModelSerializer):
     # We add this to show the username instead of just the user's ID.
     owner_username = serializers.CharField(source='owner.username', read_only=True)
+    # Includes the shards of a sharded shop wallet
+    balance = serializers.DecimalField(max_digits=12, decimal_places=2, source='total_balance', read_only=True)
 
     class Meta:
         model = Wallet
@@ -24,6 +33,65 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = '__all__' # For now, we'll show all fields.
 
+class ValuesSerializer:
+    """
+    Read-only serializer for list endpoints that works on queryset.values()
+    rows instead of model instances, so no model objects or bound fields are
+    built per row. Values are formatted with the same DRF field classes the
+    ModelSerializer it stands in for uses, so the JSON is identical.
+    """
+    # Output name -> (values() lookup, DRF field that formats it, or None to pass it through)
+    fields = {}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def value_fields(cls):
+        return [source for source, _ in cls.fields.values()]
+
+    @staticmethod
+    def formatter(field):
+        if field is None:
+            return None
+        if (
+            isinstance(field, serializers.DateTimeField)
+            and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+            and settings.USE_TZ
+        ):
+            # DateTimeField.to_representation re-resolves the timezone and
+            # format for every value; this is the same conversion, done once.
+            tz = timezone.get_current_timezone()
+
+            def to_iso(value):
+                value = value.astimezone(tz).isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return to_iso
+        return field.to_representation
+
+    @property
+    def data(self):
+        fields = [(name, source, self.formatter(field)) for name, (source, field) in self.fields.items()]
+        return [
+            {
+                name: row[source] if to_representation is None or row[source] is None
+                else to_representation(row[source])
+                for name, source, to_representation in fields
+            }
+            for row in self.rows
+        ]
+
+class TransactionListSerializer(ValuesSerializer):
+    # Same output as TransactionSerializer
+    fields = {
+        'id': ('id', None),
+        'bill': ('bill_id', None),
+        'source_wallet': ('source_wallet_id', None),
+        'destination_wallet': ('destination_wallet_id', None),
+        'amount': ('amount', serializers.DecimalField(max_digits=12, decimal_places=2)),
+        'timestamp': ('timestamp', serializers.DateTimeField()),
+    }
+
 class AddMoneySerializer(serializers.Serializer):
     # This serializer is not based on a model. It's for validating the input
     # when the user wants to add money.
@@ -53,32 +121,185 @@ class CustomerRegistrationSerializer(serializers.ModelSerializer):
 
     def validate_face_template(self, value):
         """
-        Uses face_utils to detect, crop, resize the image, and return a ContentFile
-        to be saved in the model.
+        Uses face_utils (in the biometric worker pool) to detect, crop, resize
+        the image, and return the compact template to be saved in the model.
         """
         try:
             # Process the uploaded file (value is the uploaded file object)
-            processed_file = process_and_validate_face_for_registration(value)
-            return processed_file
+            return run_biometric_job(process_and_validate_face_for_registration, read_upload(value))
         except ValueError as e:
             # Catch the error from face_utils and raise a standard DRF validation error
             raise ValidationError(str(e))
 
 
+class CustomerListSerializer(ValuesSerializer):
+    # The readable fields of CustomerRegistrationSerializer
+    fields = {
+        'id': ('id', None),
+        'username': ('username', None),
+        'email': ('email', None),
+        'first_name': ('first_name', None),
+        'last_name': ('last_name', None),
+    }
+
+
+class BulkEnrollmentRowSerializer(serializers.Serializer):
+    # One manifest row of a bulk enrollment (api/enrollment.py). Username
+    # uniqueness is checked per chunk at insert time, not per row here.
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    password = serializers.CharField()
+    image = serializers.CharField()
+    email = serializers.EmailField(required=False, allow_blank=True, default='')
+    first_name = serializers.CharField(required=False, allow_blank=True, max_length=150, default='')
+    last_name = serializers.CharField(required=False, allow_blank=True, max_length=150, default='')
+    biometric_type = serializers.ChoiceField(choices=BiometricData.BIOMETRIC_CHOICES, default='FACE')
+
+
+class BulkEnrollmentSerializer(serializers.Serializer):
+    manifest = serializers.FileField()
+    images = serializers.FileField()
+
+
 class BillCreationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bill
         fields = ['id', 'customer', 'amount', 'status']
 
+
+class BulkBillItemSerializer(serializers.Serializer):
+    # Customers are checked all at once by BillBulkCreateView, not per item
+    customer = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class BillListSerializer(ValuesSerializer):
+    # Same output as BillCreationSerializer
+    fields = {
+        'id': ('id', None),
+        'customer': ('customer_id', None),
+        'amount': ('amount', serializers.DecimalField(max_digits=12, decimal_places=2)),
+        'status': ('status', None),
+    }
+
 # Add this new serializer at the end of the file
-class PaymentSerializer(serializers.Serializer):
+class PaymentBillSerializer(serializers.Serializer):
+    """
+    Just the bill_id of a payment, read before any image is processed.
+    """
     bill_id = serializers.IntegerField()
-    live_image = serializers.ImageField()
+
+
+class PaymentSerializer(PaymentBillSerializer):
+    """
+    Takes either a live_image (a camera photo; the server finds the face) or
+    a face_crop that the terminal already cut out: face_width x face_height
+    grayscale pixels as raw bytes or a PNG, per face_format. Either way
+    validated_data['live_image'] ends up as the ProcessedFrame to verify.
+    """
+    live_image = serializers.ImageField(required=False)
+    # A plain FileField: the crop is checked by process_face_crop, not Pillow
+    face_crop = serializers.FileField(required=False)
+    face_format = serializers.ChoiceField(choices=['raw', 'png'], required=False)
+    face_width = serializers.IntegerField(min_value=1, max_value=settings.FACE_CROP_MAX_DIMENSION, default=FACE_SIZE[0])
+    face_height = serializers.IntegerField(min_value=1, max_value=settings.FACE_CROP_MAX_DIMENSION, default=FACE_SIZE[1])
 
     def validate_live_image(self, value):
+        """
+        Decodes and scans the live image once; the resulting ProcessedFrame
+        replaces the upload in validated_data and is reused for verification.
+        """
         try:
-            validate_face_present(value)
-            return value
+            return run_biometric_job(validate_face_present, read_upload(value))
         except ValueError as e:
             # This turns the ValueError from face_utils into a DRF 400 response
             raise ValidationError(str(e))
+
+    def to_internal_value(self, data):
+        # Before any field is validated, so a request with both payloads (or
+        # neither) never takes a biometric worker slot to find that out
+        if ('live_image' in data) == ('face_crop' in data):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Send either live_image or face_crop."]})
+        return super().to_internal_value(data)
+
+    def validate_face_crop(self, value):
+        if value.size > settings.FACE_CROP_MAX_BYTES:
+            raise ValidationError(f"The face crop must be at most {settings.FACE_CROP_MAX_BYTES} bytes.")
+        return value
+
+    def validate(self, attrs):
+        face_crop = attrs.pop('face_crop', None)
+        if face_crop is not None:
+            if 'face_format' not in attrs:
+                raise ValidationError({'face_format': "This field is required with face_crop."})
+            # Small enough to check and equalize right here, without the worker pool
+            try:
+                attrs['live_image'] = process_face_crop(
+                    read_upload(face_crop), attrs['face_format'], attrs['face_width'], attrs['face_height']
+                )
+            except ValueError as e:
+                raise ValidationError({'face_crop': str(e)})
+        return attrs
+
+
+class IdentifySerializer(serializers.Serializer):
+    live_image = serializers.ImageField()
+    top_k = serializers.IntegerField(min_value=1, max_value=50, default=5)
+
+    def validate_live_image(self, value):
+        try:
+            return run_biometric_job(validate_face_present, read_upload(value))
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+
+class WalletBalanceQuerySerializer(serializers.Serializer):
+    """
+    ?as_of= (a date-time, default now) for the ledger balance.
+    """
+    as_of = serializers.DateTimeField(required=False)
+
+
+class WalletBalanceSerializer(serializers.Serializer):
+    as_of = serializers.DateTimeField()
+    balance = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class RevenueSummaryQuerySerializer(serializers.Serializer):
+    """
+    ?start=&end= (inclusive, default the last 30 days) and ?top= for the
+    revenue summary.
+    """
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    top = serializers.IntegerField(min_value=1, max_value=50, default=5)
+
+    def validate(self, attrs):
+        end = attrs.get('end') or timezone.localdate()
+        start = attrs.get('start') or end - datetime.timedelta(days=29)
+        if start > end:
+            raise ValidationError({'start': "Must not be after end."})
+        if (end - start).days >= settings.REVENUE_SUMMARY_MAX_DAYS:
+            raise ValidationError(f"At most {settings.REVENUE_SUMMARY_MAX_DAYS} days per summary.")
+        return {**attrs, 'start': start, 'end': end}
+
+
+class RevenueDaySerializer(serializers.Serializer):
+    day = serializers.DateField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments = serializers.IntegerField()
+
+
+class TopCustomerSerializer(serializers.Serializer):
+    customer = serializers.IntegerField(source='customer_id')
+    username = serializers.CharField(source='customer__username')
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments = serializers.IntegerField()
+
+
+class RevenueSummarySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    payments = serializers.IntegerField()
+    days = RevenueDaySerializer(many=True)
+    top_customers = TopCustomerSerializer(many=True)
@@ -0,0 +1,356 @@
+# api/template_index.py
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .face_utils import (
+    LBPH_CELL_PIXELS,
+    LBPH_GRID_X,
+    LBPH_GRID_Y,
+    LBPH_HISTOGRAM_SIZE,
+    chi_square_distances,
+    pack_histograms,
+    stored_histogram,
+    unpack_histograms,
+)
+
+# Sum of every packed histogram (each grid cell holds LBPH_CELL_PIXELS codes)
+HISTOGRAM_TOTAL = LBPH_GRID_X * LBPH_GRID_Y * LBPH_CELL_PIXELS
+
+# Templates scored per scan task, and histogram bins per vectorized step
+SCAN_TEMPLATES = 32768
+SCAN_BINS = 16
+
+# Candidates re-ranked with the float64 distance compare_faces uses
+RERANK_FACTOR = 4
+
+# refresh() re-reads this many ids below the highest one seen, so templates
+# whose enrollment committed out of id order are still picked up
+REFRESH_LOOKBACK = 1000
+# Templates fetched per query while catching up
+REFRESH_BATCH = 500
+
+INDEX_FILES = ('counts.npy', 'owners.npy', 'biometric_ids.npy')
+
+logger = logging.getLogger(__name__)
+
+
+def _overlap_scores(counts, bins, probe):
+    """
+    Sum of a*b/(a+b) over the probe's non-zero bins for every template column
+    of a bin-major (bins x templates) count matrix. Because every packed
+    histogram sums to HISTOGRAM_TOTAL, the chi-square distance follows from
+    this alone, and bins where the probe is zero are never read.
+    """
+    scores = np.zeros(counts.shape[1], dtype=np.float32)
+    for start in range(0, len(bins), SCAN_BINS):
+        rows = counts[bins[start : start + SCAN_BINS]].astype(np.float32)
+        weights = probe[start : start + SCAN_BINS, np.newaxis]
+        total = rows + weights
+        rows *= weights
+        rows /= total
+        scores += rows.sum(axis=0)
+    return scores
+
+
+class TemplateIndex:
+    """
+    In-memory 1:N search index over enrolled face histograms.
+
+    Histograms are held as one packed, contiguous uint8 matrix (optionally a
+    read-only memory-mapped base written by build_template_index) plus an
+    in-memory block for customers enrolled since. The matrices are bin-major
+    (one row per histogram bin, one column per template) so a search only
+    reads the bins where the probe is non-zero; the columns are scanned in
+    parallel and the best candidates re-ranked with the exact distance.
+
+    Enrollments made by this process are added as they commit; those made
+    by other processes are picked up by a refresh, at most every
+    `refresh_interval` seconds (TEMPLATE_INDEX_REFRESH_INTERVAL). A refresh
+    only sees new rows, so every `rebuild_interval` seconds
+    (TEMPLATE_INDEX_REBUILD_INTERVAL) the index is rebuilt, dropping deleted
+    customers and picking up templates replaced in place.
+    """
+
+    def __init__(self, path=None, threads=None, refresh_interval=None, rebuild_interval=None):
+        self.path = path
+        if refresh_interval is None:
+            refresh_interval = settings.TEMPLATE_INDEX_REFRESH_INTERVAL
+        if rebuild_interval is None:
+            rebuild_interval = settings.TEMPLATE_INDEX_REBUILD_INTERVAL
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._refreshed_at = None
+        self._rebuilt_at = None
+        self._base_counts = np.empty((LBPH_HISTOGRAM_SIZE, 0), dtype=np.uint8)
+        self._base_owners = np.empty(0, dtype=np.int64)
+        # Base columns whose template is still enrolled, or None for all of them
+        self._base_enrolled = None
+        self._delta_counts = np.empty((LBPH_HISTOGRAM_SIZE, 0), dtype=np.uint8)
+        self._delta_owners = np.empty(0, dtype=np.int64)
+        self._delta_size = 0
+        # BiometricData ids already in the index, and the highest of them
+        self._indexed_ids = set()
+        self._last_biometric_id = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1)
+
+    def __len__(self):
+        if self._base_enrolled is None:
+            base = self._base_owners.shape[0]
+        else:
+            base = int(self._base_enrolled.sum())
+        return base + self._delta_size
+
+    def load(self):
+        """
+        Loads the memory-mapped base (if one was built) and every template
+        enrolled outside it from the database.
+        """
+        self.rebuild()
+
+    def _read_base(self):
+        # The packed matrix build_template_index last wrote, if any
+        if not (self.path and all(os.path.exists(os.path.join(self.path, f)) for f in INDEX_FILES)):
+            return (
+                np.empty((LBPH_HISTOGRAM_SIZE, 0), dtype=np.uint8),
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64),
+            )
+        owners = np.load(os.path.join(self.path, 'owners.npy'))
+        counts = np.load(os.path.join(self.path, 'counts.npy'), mmap_mode='r')
+        # save() may have sized the matrix before a template was deleted
+        biometric_ids = np.load(os.path.join(self.path, 'biometric_ids.npy'))
+        return counts[:, : owners.shape[0]], owners, biometric_ids
+
+    def rebuild(self):
+        """
+        Re-reads the whole index: the base as build_template_index last wrote
+        it, minus templates deleted since, and every other enrolled template
+        from the database. Templates replaced in place inside the base stay
+        as they were until build_template_index runs again.
+        """
+        from .models import BiometricData
+
+        self._rebuilt_at = self._refreshed_at = time.monotonic()
+        base_counts, base_owners, base_ids = self._read_base()
+        templates = BiometricData.objects.enrolled_faces()
+        enrolled = set(templates.values_list('id', flat=True))
+        base_enrolled = np.fromiter(
+            (biometric_id in enrolled for biometric_id in base_ids.tolist()), dtype=bool, count=base_ids.shape[0]
+        )
+        missing = sorted(enrolled.difference(base_ids.tolist()))
+
+        # Built off to the side; searches keep using the old index meanwhile
+        delta_counts = np.empty((LBPH_HISTOGRAM_SIZE, len(missing)), dtype=np.uint8)
+        delta_owners = np.empty(len(missing), dtype=np.int64)
+        indexed_ids = set(base_ids[base_enrolled].tolist())
+        size = 0
+        for start in range(0, len(missing), REFRESH_BATCH):
+            batch = (
+                templates.filter(id__in=missing[start : start + REFRESH_BATCH])
+                .order_by('id')
+                .values_list('id', 'owner_id', 'template', 'lbph_histogram')
+            )
+            for biometric_id, owner_id, template, histogram in batch:
+                delta_counts[:, size] = pack_histograms(stored_histogram(template, histogram))[0]
+                delta_owners[size] = owner_id
+                indexed_ids.add(biometric_id)
+                size += 1
+
+        with self._lock:
+            self._base_counts, self._base_owners = base_counts, base_owners
+            self._base_enrolled = None if base_enrolled.all() else base_enrolled
+            self._delta_counts, self._delta_owners, self._delta_size = delta_counts, delta_owners, size
+            self._indexed_ids = indexed_ids
+            self._last_biometric_id = max(indexed_ids, default=0)
+            self._loaded = True
+
+    def refresh(self):
+        """
+        Adds templates enrolled (possibly by other worker processes) since the
+        last load or refresh. Only new rows are seen; changed and deleted
+        ones wait for the next rebuild().
+        """
+        from .models import BiometricData
+
+        self._refreshed_at = time.monotonic()
+        templates = BiometricData.objects.enrolled_faces()
+        recent_ids = templates.filter(
+            id__gt=self._last_biometric_id - REFRESH_LOOKBACK
+        ).values_list('id', flat=True)
+        missing = [biometric_id for biometric_id in recent_ids if biometric_id not in self._indexed_ids]
+        if not missing:
+            return
+
+        for start in range(0, len(missing), REFRESH_BATCH):
+            new_templates = (
+                templates.filter(id__in=missing[start : start + REFRESH_BATCH])
+                .order_by('id')
+                .values_list('id', 'owner_id', 'template', 'lbph_histogram')
+            )
+            for biometric_id, owner_id, template, histogram in new_templates:
+                self.add(biometric_id, owner_id, stored_histogram(template, histogram))
+
+    def add(self, biometric_id, owner_id, histogram):
+        """
+        Appends one enrolled template. Templates already indexed are ignored.
+        """
+        with self._lock:
+            if biometric_id in self._indexed_ids:
+                return
+            if self._delta_size == self._delta_counts.shape[1]:
+                # Grow geometrically so appends stay amortized O(1)
+                capacity = max(1024, 2 * self._delta_size)
+                counts = np.empty((LBPH_HISTOGRAM_SIZE, capacity), dtype=np.uint8)
+                owners = np.empty(capacity, dtype=np.int64)
+                counts[:, : self._delta_size] = self._delta_counts[:, : self._delta_size]
+                owners[: self._delta_size] = self._delta_owners[: self._delta_size]
+                self._delta_counts, self._delta_owners = counts, owners
+            self._delta_counts[:, self._delta_size] = pack_histograms(histogram)[0]
+            self._delta_owners[self._delta_size] = owner_id
+            self._delta_size += 1
+            self._indexed_ids.add(biometric_id)
+            self._last_biometric_id = max(self._last_biometric_id, biometric_id)
+
+    def search(self, histogram, top_k=5):
+        """
+        Returns up to top_k (owner_id, distance) pairs, closest first.
+        Distances are the same chi-square values compare_faces uses.
+        """
+        if not self._loaded or time.monotonic() - self._rebuilt_at >= self.rebuild_interval:
+            self.rebuild()
+        elif time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+        with self._lock:
+            blocks = [
+                (self._base_counts, self._base_owners),
+                (self._delta_counts[:, : self._delta_size], self._delta_owners[: self._delta_size]),
+            ]
+            base_enrolled = self._base_enrolled
+
+        probe_counts = pack_histograms(histogram)[0]
+        bins = np.flatnonzero(probe_counts)
+        probe = probe_counts[bins].astype(np.float32)
+
+        tasks = [
+            counts[:, start : start + SCAN_TEMPLATES]
+            for counts, _ in blocks
+            for start in range(0, counts.shape[1], SCAN_TEMPLATES)
+        ]
+        if not tasks:
+            return []
+
+        overlaps = np.concatenate(list(self._executor.map(
+            lambda counts: _overlap_scores(counts, bins, probe), tasks
+        )))
+        # sum (a-b)^2/(a+b) = sum(a+b) - 4 * sum ab/(a+b); doubled for CHI2_ALT, then normalized
+        approximate = (4.0 * HISTOGRAM_TOTAL - 8.0 * overlaps) / LBPH_CELL_PIXELS
+        if base_enrolled is not None:
+            # Deleted since the base was built
+            approximate[: base_enrolled.shape[0]][~base_enrolled] = np.inf
+
+        candidates = min(len(approximate), max(top_k * RERANK_FACTOR, 32))
+        nearest = np.sort(np.argpartition(approximate, candidates - 1)[:candidates])
+        nearest = nearest[np.isfinite(approximate[nearest])]
+        if not nearest.size:
+            return []
+
+        # Map flat positions back to their block columns for the re-rank
+        rows, owner_ids = [], []
+        offset = 0
+        for counts, owners in blocks:
+            size = counts.shape[1]
+            in_block = nearest[(nearest >= offset) & (nearest < offset + size)] - offset
+            rows.append(np.asarray(counts[:, in_block]).T)
+            owner_ids.append(owners[in_block])
+            offset += size
+        rows = np.concatenate(rows)
+        owner_ids = np.concatenate(owner_ids)
+
+        exact = chi_square_distances(histogram, unpack_histograms(rows))[0]
+        order = np.argsort(exact)[:top_k]
+        return [(int(owner_ids[i]), float(exact[i])) for i in order]
+
+    def save(self, path):
+        """
+        Writes every enrolled face template as the packed matrix that load()
+        memory-maps. Returns the number of templates written.
+        """
+        from .models import BiometricData
+
+        os.makedirs(path, exist_ok=True)
+        templates = (
+            BiometricData.objects.enrolled_faces()
+            .order_by('id')
+            .values_list('id', 'owner_id', 'template', 'lbph_histogram')
+        )
+        count = templates.count()
+        counts = np.lib.format.open_memmap(
+            os.path.join(path, 'counts.npy'), mode='w+', dtype=np.uint8,
+            shape=(LBPH_HISTOGRAM_SIZE, count),
+        )
+        owners = np.empty(count, dtype=np.int64)
+        biometric_ids = np.empty(count, dtype=np.int64)
+        # Pack a slab of templates at a time so each bin row is written in contiguous runs
+        slab = np.empty((SCAN_TEMPLATES, LBPH_HISTOGRAM_SIZE), dtype=np.uint8)
+        row = filled = 0
+        for biometric_id, owner_id, template, histogram in templates.iterator(chunk_size=2000):
+            if row + filled == count:
+                break  # enrolled after count(); picked up by refresh()
+            slab[filled] = pack_histograms(stored_histogram(template, histogram))[0]
+            owners[row + filled] = owner_id
+            biometric_ids[row + filled] = biometric_id
+            filled += 1
+            if filled == SCAN_TEMPLATES:
+                counts[:, row : row + filled] = slab.T
+                row, filled = row + filled, 0
+        counts[:, row : row + filled] = slab[:filled].T
+        row += filled
+        counts.flush()
+        np.save(os.path.join(path, 'owners.npy'), owners[:row])
+        np.save(os.path.join(path, 'biometric_ids.npy'), biometric_ids[:row])
+        return row
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_template_index():
+    """
+    Returns the process-wide TemplateIndex, creating it on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = TemplateIndex(
+                path=getattr(settings, 'TEMPLATE_INDEX_PATH', None),
+                threads=getattr(settings, 'TEMPLATE_INDEX_THREADS', None),
+            )
+        return _index
+
+
+def warm_up_template_index():
+    """
+    Loads the process-wide index before the first identify request has to.
+    Called by core/wsgi.py and core/asgi.py when TEMPLATE_INDEX_PRELOAD is on.
+    A database that can't be read yet (e.g. not migrated) only postpones the
+    load to the first search.
+    """
+    try:
+        get_template_index().load()
+    except DatabaseError:
+        logger.warning("Could not preload the template index; it will load on the first search", exc_info=True)
+    finally:
+        # Servers that fork workers after loading the app must not share this connection
+        connections.close_all()
@@ -1,3 +1,1726 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.contrib import admin
+from django.db import connection, transaction
+from django.db.models import Q
+from django.forms import modelform_factory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import ClaimsTokenObtainPairSerializer, get_cached_claims
+from .async_views import AsyncBillEventStreamView, AsyncBillListCreateView, AsyncPaymentView, AsyncWalletDetailView
+from .bill_events import InProcessBillEventBroker
+from .biometric_worker import BiometricWorker, BiometricWorkerBusy, BiometricWorkerTimeout
+from . import enrollment as enrollment_module
+from .enrollment import BulkEnrollment, enroll_from_request, open_images, read_manifest
+from .idempotency import IdempotencyKeyInFlight, IdempotencyStore
+from . import metrics
+from .instrumentation import JsonFormatter
+from .face_utils import (
+    FACE_SIZE,
+    ProcessedFrame,
+    chi_square_distances,
+    compute_lbph_histogram,
+    decode_template,
+    detect_face_box,
+    encode_template,
+    histogram_to_bytes,
+    lbph_histograms,
+    process_frame,
+    stored_histogram,
+    verify_batch,
+)
+from .models import (
+    BalanceSnapshot, BiometricData, Bill, CustomerDailyRevenue, DailyRevenue, LedgerEntry, Transaction, User,
+    Wallet, WalletShard,
+)
+from .serializers import (
+    BillCreationSerializer, BillListSerializer, CustomerListSerializer, CustomerRegistrationSerializer,
+    TransactionListSerializer, TransactionSerializer,
+)
+from .admin import WalletAdmin
+from .views import (
+    AddMoneyView, BillListCreateView, BillPayCashView, PaymentView, TransactionHistoryView, WalletDetailView,
+)
+from .template_index import TemplateIndex, warm_up_template_index
+from .wallet_cache import get_wallet_cache
+
+
+def make_faces(count, seed=0):
+    """Random 100x100 grayscale stand-ins for preprocessed face crops."""
+    rng = np.random.default_rng(seed)
+    faces = rng.integers(0, 256, (count, FACE_SIZE[1], FACE_SIZE[0]), dtype=np.uint8)
+    # Flat and gradient crops exercise the equal-to-center branch of the LBP operator.
+    faces[0] = 128
+    faces[1] = (np.arange(FACE_SIZE[0]) * 2).astype(np.uint8)
+    return faces
+
+
+class LBPHEngineTests(SimpleTestCase):
+    def test_stack_matches_single_face(self):
+        faces = make_faces(4)
+        stacked = lbph_histograms(faces)
+        self.assertEqual(stacked.shape, (4, 8 * 8 * 256))
+        for face, histogram in zip(faces, stacked):
+            np.testing.assert_array_equal(compute_lbph_histogram(face), histogram)
+
+    def test_distance_matrix_and_verify_batch(self):
+        faces = make_faces(5, seed=1)
+        histograms = lbph_histograms(faces)
+        matrix = chi_square_distances(histograms, histograms)
+        self.assertEqual(matrix.shape, (5, 5))
+        np.testing.assert_allclose(np.diag(matrix), 0.0)
+        np.testing.assert_allclose(matrix, matrix.T)
+
+        distances, matches = verify_batch(faces, histograms[::-1])
+        np.testing.assert_allclose(distances, np.diag(matrix[:, ::-1]))
+        self.assertEqual(matches.dtype, bool)
+
+    @unittest.skipUnless(hasattr(cv2, "face"), "requires opencv-contrib (cv2.face)")
+    def test_parity_with_opencv_lbph(self):
+        faces = make_faces(6, seed=2)
+        histograms = lbph_histograms(faces)
+        for i, face in enumerate(faces):
+            recognizer = cv2.face.LBPHFaceRecognizer_create(
+                radius=1, neighbors=8, grid_x=8, grid_y=8
+            )
+            recognizer.train([face], np.array([1]))
+            np.testing.assert_allclose(
+                recognizer.getHistograms()[0].ravel(), histograms[i], atol=1e-7
+            )
+            expected = [recognizer.predict(probe)[1] for probe in faces]
+            np.testing.assert_allclose(
+                chi_square_distances(histograms, histograms[i])[:, 0], expected, rtol=1e-6
+            )
+
+
+class CompactTemplateTests(TestCase):
+    def test_round_trip(self):
+        face = make_faces(3, seed=4)[2]
+        template = encode_template(face)
+        self.assertEqual(len(template), 1 + 100 * 100 + 8 * 8 * 256)
+        stored_face, counts = decode_template(template)
+        np.testing.assert_array_equal(stored_face, face)
+        # The packed histogram is lossless
+        np.testing.assert_array_equal(stored_histogram(template), compute_lbph_histogram(face))
+        with self.assertRaises(ValueError):
+            decode_template(b"\x02" + template[1:])
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_convert_command(self):
+        faces = make_faces(3, seed=5)
+        customers = []
+        for i in range(3):
+            customer = User.objects.create_user(username=f"legacy{i}", password="pass", role="CUSTOMER")
+            biometric_data = BiometricData(owner=customer, lbph_histogram=histogram_to_bytes(lbph_histograms(faces[i])[0]))
+            # What enrollment used to store: a lossless PNG here, so the result is exact
+            biometric_data.face_template.save(f"template_{i}.png", ContentFile(cv2.imencode(".png", faces[i])[1].tobytes()))
+            customers.append(biometric_data)
+        os.remove(customers[2].face_template.path)
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command("convert_face_templates", delete_files=True, batch_size=1, stdout=out, stderr=err)
+        self.assertIn("Converted 2 template(s), 1 failure(s)", out.getvalue())
+        self.assertIn(f"BiometricData #{customers[2].id}", err.getvalue())
+        for i, biometric_data in enumerate(customers[:2]):
+            path = biometric_data.face_template.path
+            biometric_data.refresh_from_db()
+            self.assertEqual(bytes(biometric_data.template), encode_template(faces[i]))
+            self.assertIsNone(biometric_data.lbph_histogram)
+            self.assertFalse(biometric_data.face_template)
+            self.assertFalse(os.path.exists(path))
+        # The unreadable one keeps its legacy histogram
+        customers[2].refresh_from_db()
+        np.testing.assert_array_equal(customers[2].stored_histogram(), lbph_histograms(faces[2])[0])
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_payment_converts_an_unconverted_template(self):
+        shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        face = make_faces(3, seed=7)[2]
+        # Enrolled before histograms and templates were stored: only the file
+        biometric_data = BiometricData(owner=customer)
+        biometric_data.face_template.save("legacy.png", ContentFile(cv2.imencode(".png", face)[1].tobytes()))
+        bill = Bill.objects.create(initiating_shop=shop, customer=customer, amount=Decimal("1.00"))
+
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        index = mock.Mock()
+        with mock.patch("api.views.get_template_index", return_value=index), \
+                self.captureOnCommitCallbacks(execute=True):
+            PaymentView().prepare_biometrics(bill)
+        # Identify can find the customer from now on
+        (biometric_id, owner_id, histogram), _ = index.add.call_args
+        self.assertEqual((biometric_id, owner_id), (biometric_data.id, customer.id))
+        np.testing.assert_array_equal(histogram, compute_lbph_histogram(face))
+        # The conversion is written before the check, which runs no queries
+        with self.assertNumQueries(0):
+            self.assertIsNone(PaymentView().check_biometrics(bill, mock.Mock(face=face)))
+        biometric_data.refresh_from_db()
+        self.assertEqual(bytes(biometric_data.template), encode_template(face))
+        # From then on it is read like any other template
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        with mock.patch("api.face_utils.cv2.imread", side_effect=AssertionError("file read")):
+            PaymentView().prepare_biometrics(bill)
+            self.assertIsNone(PaymentView().check_biometrics(bill, mock.Mock(face=face)))
+
+    def test_legacy_histogram_is_loaded_before_the_check(self):
+        shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        face = make_faces(3, seed=8)[2]
+        BiometricData.objects.create(owner=customer, lbph_histogram=histogram_to_bytes(compute_lbph_histogram(face)))
+        bill = Bill.objects.create(initiating_shop=shop, customer=customer, amount=Decimal("1.00"))
+
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        with self.assertNumQueries(1):
+            PaymentView().prepare_biometrics(bill)
+        with self.assertNumQueries(0):
+            self.assertIsNone(PaymentView().check_biometrics(bill, mock.Mock(face=face)))
+
+    def test_payment_reads_no_files(self):
+        shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        face = make_faces(3, seed=6)[2]
+        BiometricData.objects.create(owner=customer, template=encode_template(face))
+        bill = Bill.objects.create(initiating_shop=shop, customer=customer, amount=Decimal("1.00"))
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        with mock.patch("api.face_utils.cv2.imread", side_effect=AssertionError("file read")), \
+                mock.patch("api.face_utils.cv2.imdecode", side_effect=AssertionError("image decode")), \
+                self.assertNumQueries(0):
+            self.assertIsNone(PaymentView().check_biometrics(bill, mock.Mock(face=face)))
+            response = PaymentView().check_biometrics(bill, mock.Mock(face=make_faces(2)[0]))
+        self.assertEqual(response.status_code, 400)
+
+
+def run_inline(fn, *args):
+    """Stands in for run_biometric_job so patches reach the face processing."""
+    return fn(*args)
+
+
+@mock.patch("api.serializers.run_biometric_job", run_inline)
+@mock.patch("api.face_utils.detect_face_box", return_value=(40, 30, 120, 120))
+class FacePipelineTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.client.force_authenticate(self.shop)
+        # A grayscale PNG decodes to the same pixels in either detection mode
+        self.frame = np.random.default_rng(8).integers(0, 256, (240, 200), dtype=np.uint8)
+        self.face = cv2.resize(cv2.equalizeHist(self.frame)[30:150, 40:160], FACE_SIZE)
+
+    def image(self):
+        return SimpleUploadedFile("face.png", cv2.imencode(".png", self.frame)[1].tobytes(), content_type="image/png")
+
+    def test_enrollment_stores_the_histogram(self, _):
+        response = self.client.post(reverse("shop-customer-list-create"), {
+            "username": "newcomer", "password": "pass", "biometric_type": "FACE", "face_template": self.image(),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        biometric_data = BiometricData.objects.get(owner__username="newcomer")
+        self.assertEqual(bytes(biometric_data.template), encode_template(self.face))
+        np.testing.assert_array_equal(biometric_data.stored_histogram(), compute_lbph_histogram(self.face))
+        self.assertFalse(biometric_data.face_template)
+
+    def test_payment_decodes_the_image_once(self, detect_face_box):
+        customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=customer, balance=Decimal("10.00"))
+        BiometricData.objects.create(owner=customer, template=encode_template(self.face))
+        bill = Bill.objects.create(initiating_shop=self.shop, customer=customer, amount=Decimal("1.00"))
+
+        with mock.patch("api.face_utils.cv2.imdecode", wraps=cv2.imdecode) as imdecode:
+            response = self.client.post(reverse("process-payment"), {"bill_id": bill.id, "live_image": self.image()})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Bill.objects.get(id=bill.id).status, "PAID_WALLET")
+        # Validation decodes and scans the frame; verification reuses it
+        self.assertEqual(imdecode.call_count, 1)
+        self.assertEqual(detect_face_box.call_count, 1)
+
+
+@override_settings(FACE_DETECTION_MAX_DIMENSION=640, FACE_DETECTION_MIN_FACE_RATIO=0.15, FACE_DETECTION_MAX_FACE_RATIO=0.95)
+class FaceDetectionModeTests(SimpleTestCase):
+    def detect(self, mode, box):
+        frame = np.zeros((960, 1280), dtype=np.uint8)
+        with mock.patch("api.face_utils.face_cascade") as cascade:
+            cascade.detectMultiScale.return_value = np.array([box])
+            found = detect_face_box(frame, mode)
+        (image,), kwargs = cascade.detectMultiScale.call_args
+        return found, image.shape, kwargs
+
+    def test_accurate_mode_scans_the_full_frame(self):
+        found, shape, kwargs = self.detect("accurate", [100, 50, 200, 200])
+        self.assertEqual(found, (100, 50, 200, 200))
+        self.assertEqual(shape, (960, 1280))
+        self.assertNotIn("minSize", kwargs)
+
+    def test_fast_mode_scans_a_bounded_downscaled_copy(self):
+        found, shape, kwargs = self.detect("fast", [100, 50, 200, 200])
+        self.assertEqual(shape, (480, 640))
+        self.assertEqual(kwargs["minSize"], (72, 72))
+        self.assertEqual(kwargs["maxSize"], (456, 456))
+        # The box is mapped back to full resolution for the crop
+        self.assertEqual(found, (200, 100, 400, 400))
+
+    def test_bench_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cv2.imwrite(os.path.join(directory, "face.png"), make_faces(2)[0])
+            with self.assertRaisesMessage(CommandError, "--repeat must be at least 1."):
+                call_command("bench_face_detection", directory, repeat=0, stdout=io.StringIO())
+            out = io.StringIO()
+            call_command("bench_face_detection", directory, repeat=1, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["images"], 1)
+        self.assertEqual(set(report["modes"]), {"accurate", "fast"})
+
+
+class TemplateIndexTests(TestCase):
+    def setUp(self):
+        self.faces = make_faces(6, seed=3)
+        self.histograms = lbph_histograms(self.faces)
+        self.customers = [self.enroll(f"customer{i}", i) for i in range(5)]
+
+    def enroll(self, username, i):
+        # Odd customers were enrolled before compact templates and not converted
+        user = User.objects.create_user(username=username, password="pass", role="CUSTOMER")
+        if i % 2:
+            BiometricData.objects.create(
+                owner=user,
+                face_template="face_templates/unused.jpg",
+                lbph_histogram=histogram_to_bytes(self.histograms[i]),
+            )
+        else:
+            BiometricData.objects.create(owner=user, template=encode_template(self.faces[i]))
+        return user
+
+    def test_search_matches_brute_force(self):
+        results = TemplateIndex(threads=2).search(self.histograms[2], top_k=3)
+        expected = chi_square_distances(self.histograms[2], self.histograms[:5])[0]
+        order = np.argsort(expected)[:3]
+        self.assertEqual([owner for owner, _ in results], [self.customers[i].id for i in order])
+        np.testing.assert_allclose([d for _, d in results], expected[order])
+
+    def test_new_enrollments_are_picked_up(self):
+        index = TemplateIndex(threads=1, refresh_interval=0)
+        self.assertEqual(len(index.search(self.histograms[5], top_k=10)), 5)
+        newcomer = self.enroll("newcomer", 5)
+        owner, distance = index.search(self.histograms[5], top_k=1)[0]
+        self.assertEqual((owner, distance), (newcomer.id, 0.0))
+
+    def test_refreshes_at_most_once_per_interval(self):
+        index = TemplateIndex(threads=1, refresh_interval=60)
+        index.load()
+        newcomer = self.enroll("newcomer", 5)
+        with self.assertNumQueries(0):
+            self.assertNotEqual(index.search(self.histograms[5], top_k=1)[0][0], newcomer.id)
+        with mock.patch("api.template_index.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertEqual(index.search(self.histograms[5], top_k=1)[0][0], newcomer.id)
+
+    def test_rebuild_sees_deletions_and_replacements(self):
+        index = TemplateIndex(threads=1, refresh_interval=0, rebuild_interval=60)
+        index.load()
+        deleted_id = self.customers[0].id
+        self.customers[0].delete()
+        # Re-enrolled in place with another face
+        BiometricData.objects.filter(owner=self.customers[2]).update(template=encode_template(self.faces[5]))
+        self.assertEqual(index.search(self.histograms[0], top_k=1)[0], (deleted_id, 0.0))
+        self.assertNotEqual(index.search(self.histograms[5], top_k=1)[0][0], self.customers[2].id)
+
+        with mock.patch("api.template_index.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertEqual(len(index.search(self.histograms[0], top_k=10)), 4)
+            self.assertNotEqual(index.search(self.histograms[0], top_k=1)[0][0], deleted_id)
+            self.assertEqual(index.search(self.histograms[5], top_k=1)[0], (self.customers[2].id, 0.0))
+
+    def test_warm_up_loads_the_index(self):
+        index = TemplateIndex(threads=1)
+        with mock.patch("api.template_index.get_template_index", return_value=index), \
+                mock.patch("api.template_index.connections.close_all"):
+            warm_up_template_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(index.search(self.histograms[1], top_k=10)), 5)
+
+    def test_memory_mapped_base(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.assertEqual(TemplateIndex().save(path), 5)
+            index = TemplateIndex(path=path, threads=1)
+            owner, distance = index.search(self.histograms[4], top_k=1)[0]
+            self.assertEqual((owner, distance), (self.customers[4].id, 0.0))
+            self.assertEqual(len(index), 5)
+
+            # Deleted after the base was built
+            self.customers[4].delete()
+            index.rebuild()
+            self.assertEqual(len(index), 4)
+            owners = [owner for owner, _ in index.search(self.histograms[4], top_k=10)]
+            self.assertEqual(sorted(owners), sorted(customer.id for customer in self.customers[:4]))
+
+
+def django_apps_ready():
+    """Runs in a worker process."""
+    return django_apps.ready
+
+
+class BiometricWorkerTests(SimpleTestCase):
+    def test_inline_when_pool_size_is_zero(self):
+        worker = BiometricWorker(pool_size=0, queue_depth=0, timeout=1)
+        self.assertEqual(worker.run(sum, [1, 2, 3]), 6)
+
+    def test_rejects_when_queue_is_full(self):
+        worker = BiometricWorker(pool_size=1, queue_depth=0, timeout=5)
+        running = threading.Thread(target=worker.run, args=(time.sleep, 1))
+        running.start()
+        time.sleep(0.1)
+        with self.assertRaises(BiometricWorkerBusy):
+            worker.run(sum, [1])
+        running.join()
+        self.assertEqual(worker.run(sum, [1, 2]), 3)
+
+    def test_timeout(self):
+        worker = BiometricWorker(pool_size=1, queue_depth=0, timeout=0.1)
+        with self.assertRaises(BiometricWorkerTimeout):
+            worker.run(time.sleep, 1)
+
+    def test_workers_are_spawned_with_django_set_up(self):
+        worker = BiometricWorker(pool_size=1, queue_depth=0, timeout=60)
+        self.assertEqual(worker._get_executor()._mp_context.get_start_method(), "spawn")
+        # Unpickling this job imports api.tests, which needs the app registry
+        self.assertTrue(worker.run(django_apps_ready))
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.customer, balance="25.00")
+
+    async def test_wallet_detail(self):
+        request = self.factory.get("/api/wallet/")
+        force_authenticate(request, user=self.customer)
+        response = await AsyncWalletDetailView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["balance"], "25.00")
+        self.assertEqual(response.data["owner_username"], "customer")
+
+    async def test_wallet_detail_without_a_wallet(self):
+        request = self.factory.get("/api/wallet/")
+        force_authenticate(request, user=self.shop)
+        response = await AsyncWalletDetailView.as_view()(request)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_bill_create_and_list(self):
+        view = AsyncBillListCreateView.as_view()
+        request = self.factory.post("/api/shop/bills/", {"customer": self.customer.id, "amount": "9.99"}, format="json")
+        force_authenticate(request, user=self.shop)
+        response = await view(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Bill.objects.filter(initiating_shop=self.shop, amount="9.99").aexists())
+
+        request = self.factory.get("/api/shop/bills/")
+        force_authenticate(request, user=self.shop)
+        response = await view(request)
+        self.assertEqual([bill["amount"] for bill in response.data["results"]], ["9.99"])
+
+    async def test_payment_with_idempotency_key(self):
+        await Wallet.objects.acreate(owner=self.shop)
+        bill = await Bill.objects.acreate(initiating_shop=self.shop, customer=self.customer, amount="5.00")
+        await BiometricData.objects.acreate(owner=self.customer, template=encode_template(make_faces(2)[0]))
+        face_job = mock.Mock(return_value=ProcessedFrame(None, None, None))
+        statuses = []
+        with mock.patch("api.serializers.run_biometric_job", face_job), \
+                mock.patch("api.views.compare_faces", return_value=True):
+            for _ in range(2):
+                image = SimpleUploadedFile("face.png", cv2.imencode(".png", make_faces(2)[0])[1].tobytes(), content_type="image/png")
+                request = self.factory.post(
+                    "/api/pay/", {"bill_id": bill.id, "live_image": image}, format="multipart", HTTP_IDEMPOTENCY_KEY="async-1"
+                )
+                force_authenticate(request, user=self.shop)
+                statuses.append((await AsyncPaymentView.as_view()(request)).status_code)
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(face_job.call_count, 1)
+        self.assertEqual(await Transaction.objects.acount(), 1)
+
+    async def test_permissions_are_enforced(self):
+        request = self.factory.get("/api/shop/bills/")
+        force_authenticate(request, user=self.customer)
+        response = await AsyncBillListCreateView.as_view()(request)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_sync_handlers(self):
+        views = [AsyncWalletDetailView, AsyncBillListCreateView, AsyncPaymentView, AsyncBillEventStreamView]
+        for view in views:
+            with self.subTest(view=view.__name__):
+                request = self.factory.options("/")
+                force_authenticate(request, user=self.shop)
+                response = await view.as_view()(request)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["name"], view().get_view_name())
+
+                request = self.factory.delete("/")
+                force_authenticate(request, user=self.shop)
+                self.assertEqual((await view.as_view()(request)).status_code, 405)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal(i)) for i in range(1, 12)
+        )
+        # Ties on created_at must be broken by id, not skipped or repeated
+        first_ids = list(Bill.objects.order_by("id").values_list("id", flat=True)[:6])
+        Bill.objects.filter(id__in=first_ids).update(created_at=Bill.objects.get(id=first_ids[0]).created_at)
+        self.expected = list(Bill.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+    def get(self, url):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.shop)
+        response = BillListCreateView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walk_forward_and_back(self):
+        pages = []
+        data = self.get("/api/shop/bills/?page_size=4")
+        self.assertIsNone(data["previous"])
+        while True:
+            pages.append([bill["id"] for bill in data["results"]])
+            if data["next"] is None:
+                break
+            data = self.get(data["next"])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+
+        for page in reversed(pages[:-1]):
+            data = self.get(data["previous"])
+            self.assertEqual([bill["id"] for bill in data["results"]], page)
+        self.assertIsNone(data["previous"])
+
+    def test_page_size_is_capped_and_bad_cursors_rejected(self):
+        with self.settings(API_MAX_PAGE_SIZE=5):
+            self.assertEqual(len(self.get("/api/shop/bills/?page_size=100")["results"]), 5)
+        request = self.factory.get("/api/shop/bills/?cursor=bogus")
+        force_authenticate(request, user=self.shop)
+        self.assertEqual(BillListCreateView.as_view()(request).status_code, 404)
+
+    def test_bill_list_is_per_shop_and_filterable(self):
+        other = User.objects.create_user(username="other", password="pass", role="SHOP_OWNER")
+        Bill.objects.create(initiating_shop=other, customer=self.customer, amount=Decimal("1.00"))
+        Bill.objects.filter(id=self.expected[0]).update(status="PAID_CASH")
+        self.assertEqual([bill["id"] for bill in self.get("/api/shop/bills/?page_size=50")["results"]], self.expected)
+        self.assertEqual(
+            [bill["id"] for bill in self.get("/api/shop/bills/?status=PENDING")["results"]], self.expected[1:]
+        )
+
+    def test_transaction_history_covers_both_sides(self):
+        shop_wallet = Wallet.objects.create(owner=self.shop)
+        customer_wallet = Wallet.objects.create(owner=self.customer)
+        for i, bill in enumerate(Bill.objects.order_by("id")):
+            source, destination = (customer_wallet, shop_wallet) if i % 3 else (shop_wallet, customer_wallet)
+            Transaction.objects.create(
+                bill=bill, source_wallet=source, destination_wallet=destination, amount=bill.amount
+            )
+        expected = list(
+            Transaction.objects.filter(Q(source_wallet=customer_wallet) | Q(destination_wallet=customer_wallet))
+            .order_by("-timestamp", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(len(expected), 11)
+
+        seen = []
+        url = "/api/wallet/transactions/?page_size=4"
+        while url:
+            request = self.factory.get(url)
+            force_authenticate(request, user=self.customer)
+            data = TransactionHistoryView.as_view()(request).data
+            seen += [transaction["id"] for transaction in data["results"]]
+            url = data["next"]
+        self.assertEqual(seen, expected)
+
+
+class ValuesSerializerTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(
+            username="customer", password="pass", role="CUSTOMER", email="c@example.com", first_name="Ada"
+        )
+        shop_wallet = Wallet.objects.create(owner=self.shop)
+        customer_wallet = Wallet.objects.create(owner=self.customer)
+        for amount in ("1.50", "20", "0.05"):
+            bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal(amount))
+            Transaction.objects.create(
+                bill=bill, source_wallet=customer_wallet, destination_wallet=shop_wallet, amount=bill.amount
+            )
+
+    def assertSameOutput(self, fast_serializer, model_serializer, queryset):
+        fast = fast_serializer(queryset.values(*fast_serializer.value_fields())).data
+        self.assertEqual(fast, model_serializer(queryset, many=True).data)
+
+    def test_matches_model_serializers(self):
+        self.assertSameOutput(TransactionListSerializer, TransactionSerializer, Transaction.objects.order_by("id"))
+        self.assertSameOutput(BillListSerializer, BillCreationSerializer, Bill.objects.order_by("id"))
+        self.assertSameOutput(
+            CustomerListSerializer, CustomerRegistrationSerializer, User.objects.filter(role="CUSTOMER")
+        )
+        with self.settings(TIME_ZONE="UTC"):  # "Z" suffix instead of an offset
+            self.assertSameOutput(TransactionListSerializer, TransactionSerializer, Transaction.objects.order_by("id"))
+
+
+# Maximum queries each endpoint may run (authentication excluded). Raising one
+# of these should be a deliberate decision, not a side effect.
+QUERY_BUDGETS = {
+    ("get", "wallet-detail"): 1,
+    ("post", "wallet-add-money"): 3,
+    ("get", "wallet-transactions"): 1,
+    ("get", "shop-customer-list-create"): 1,
+    ("post", "shop-customer-list-create"): 4,
+    ("get", "bill-list-create"): 1,
+    ("post", "bill-list-create"): 2,
+    ("post", "bill-bulk-create"): 2,
+    ("put", "shop-bill-pay-cash"): 3,
+    # The first payment of the day creates its two rollup rows; later ones run 8
+    ("post", "process-payment"): 10,
+    ("patch", "shop-bill-pay-cash"): 3,
+    ("get", "wallet-balance"): 2,
+    ("get", "shop-revenue-summary"): 2,
+    # With the template index loaded (at startup) and not due for a refresh
+    ("post", "shop-identify-customer"): 1,
+    # A two-row manifest: one enrollment chunk
+    ("post", "shop-customer-bulk-enroll"): 4,
+    ("post", "token_obtain_pair"): 2,
+    ("post", "token_refresh"): 3,
+}
+
+# Routes without a budget, and why. Every other route in api.urls needs one.
+QUERY_BUDGET_EXEMPT = {
+    # Long-lived: it reads nothing from the database after authentication
+    ("get", "bill-event-stream"): "server-sent event stream",
+}
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.wallet = Wallet.objects.create(owner=self.shop, balance=Decimal("7.00"))
+
+    def login(self):
+        response = self.client.post(reverse("token_obtain_pair"), {"username": "shop", "password": "pass"})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_login_token_carries_claims(self):
+        access = AccessToken(self.login()["access"])
+        self.assertEqual((access["role"], access["wallet_id"], access["username"]), ("SHOP_OWNER", self.wallet.id, "shop"))
+
+    def test_requests_skip_the_user_lookup(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login()['access']}")
+        self.client.get(reverse("wallet-detail"))
+        # The wallet is cached and the user comes from the token: no queries at all
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("wallet-detail"))
+        self.assertEqual(response.data["balance"], "7.00")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 200)
+
+    def test_role_claim_is_enforced_and_refreshed(self):
+        tokens = self.login()
+        self.shop.role = "CUSTOMER"
+        self.shop.save()
+        # The old access token still says SHOP_OWNER; a refreshed one doesn't
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 200)
+        access = self.client.post(reverse("token_refresh"), {"refresh": tokens["refresh"]}).data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 403)
+
+    def test_tokens_without_claims_use_the_user_cache(self):
+        access = AccessToken.for_user(self.shop)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        # One user lookup shared by both requests, plus each one's page
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 200)
+            self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 200)
+        # Only what a token's claims would hold is cached, not the password hash
+        self.assertEqual(
+            get_cached_claims(self.shop.id),
+            {"username": "shop", "role": "SHOP_OWNER", "is_active": True, "wallet_id": self.wallet.id},
+        )
+
+        self.shop.is_active = False
+        self.shop.save()
+        cache.clear()
+        self.assertEqual(self.client.get(reverse("bill-list-create")).status_code, 401)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+        BiometricData.objects.create(owner=self.customer, template=encode_template(make_faces(2)[0]))
+        self.bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("1.00")) for _ in range(5)
+        )
+        for bill in self.bills[:3]:
+            Transaction.objects.create(
+                bill=bill, source_wallet=self.customer.wallet, destination_wallet=self.shop.wallet, amount=bill.amount
+            )
+
+    def image(self, name="face.png"):
+        return SimpleUploadedFile(name, cv2.imencode(".png", make_faces(2)[0])[1].tobytes(), content_type="image/png")
+
+    def request(self, user, method, name, *args, **kwargs):
+        """Calls an endpoint and fails if it ran more queries than its budget."""
+        if user is None:
+            self.client.credentials()
+        else:
+            # A real login token, so authentication is part of what gets counted
+            token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(reverse(name, args=args), **kwargs)
+        self.assertLess(response.status_code, 300, response.content)
+        # TestCase turns every atomic block into a savepoint; outside tests they're free
+        queries = [q["sql"] for q in captured.captured_queries if "SAVEPOINT" not in q["sql"]]
+        budget = QUERY_BUDGETS[method, name]
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{method.upper()} {name} ran {len(queries)} queries (budget {budget}):\n" + "\n".join(queries),
+        )
+        return response
+
+    def test_every_route_has_a_budget(self):
+        from . import urls
+
+        routes = set()
+        for pattern in urls.urlpatterns:
+            view_class = pattern.callback.view_class
+            for method in view_class.http_method_names:
+                if method not in ("head", "options") and hasattr(view_class, method):
+                    routes.add((method, pattern.name))
+        missing = routes - set(QUERY_BUDGETS) - set(QUERY_BUDGET_EXEMPT)
+        self.assertFalse(missing, f"Routes without a query budget (add one to QUERY_BUDGETS): {sorted(missing)}")
+        self.assertFalse(set(QUERY_BUDGETS) - routes, "Budgets for routes that no longer exist")
+
+    def test_customer_endpoints(self):
+        self.request(self.customer, "get", "wallet-detail")
+        self.request(self.customer, "post", "wallet-add-money", data={"amount": "5.00"}, format="json")
+        self.request(self.customer, "get", "wallet-transactions")
+        self.request(self.customer, "get", "wallet-balance")
+
+    def test_auth_endpoints(self):
+        tokens = self.request(None, "post", "token_obtain_pair", data={"username": "customer", "password": "pass"}).data
+        self.request(None, "post", "token_refresh", data={"refresh": tokens["refresh"]})
+
+    def test_shop_endpoints(self):
+        self.request(self.shop, "get", "shop-customer-list-create")
+        self.request(self.shop, "get", "bill-list-create")
+        self.request(self.shop, "post", "bill-list-create", data={"customer": self.customer.id, "amount": "2.00"}, format="json")
+        self.request(self.shop, "put", "shop-bill-pay-cash", self.bills[3].id)
+        self.request(self.shop, "patch", "shop-bill-pay-cash", self.bills[4].id)
+        self.request(self.shop, "get", "shop-revenue-summary")
+
+    def test_identify(self):
+        index = TemplateIndex(threads=1, refresh_interval=60)
+        index.load()
+        frame = ProcessedFrame.from_face(make_faces(2)[0])
+        with mock.patch("api.views.get_template_index", return_value=index), \
+                mock.patch("api.serializers.run_biometric_job", return_value=frame):
+            matches = self.request(self.shop, "post", "shop-identify-customer", data={"live_image": self.image()}).data["matches"]
+        self.assertEqual(matches[0]["customer"], self.customer.id)
+
+    @override_settings(BULK_ENROLL_WORKERS=0)
+    def test_bulk_enroll(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as images:
+            images.writestr("face.jpg", b"face")
+        with mock.patch("api.enrollment.process_and_validate_face_for_registration", fake_registration), \
+                mock.patch("api.enrollment.get_template_index"):
+            data = self.request(self.shop, "post", "shop-customer-bulk-enroll", data={
+                "manifest": SimpleUploadedFile("customers.csv", b"username,password,image\nann,pw-a,face.jpg\nben,pw-b,face.jpg\n"),
+                "images": SimpleUploadedFile("faces.zip", archive.getvalue()),
+            }).data
+        self.assertEqual(data["enrolled"], 2)
+
+    def test_bulk_bill_create(self):
+        items = [{"customer": self.customer.id, "amount": f"{i}.25"} for i in range(1, 51)]
+        items[3] = {"customer": 10 ** 6, "amount": "1.00"}
+        items[7] = {"customer": self.customer.id, "amount": "not money"}
+        data = self.request(self.shop, "post", "bill-bulk-create", data=items, format="json").data
+        self.assertEqual((data["created"], data["failed"]), (48, 2))
+        self.assertIn("customer", data["results"][3]["errors"])
+        self.assertIn("amount", data["results"][7]["errors"])
+        self.assertEqual(data["results"][0]["amount"], "1.25")
+        self.assertEqual(Bill.objects.get(id=data["results"][0]["id"]).initiating_shop, self.shop)
+        self.assertEqual(Bill.objects.filter(initiating_shop=self.shop).count(), 5 + 48)
+
+        # Thousands per request; nothing is created when every item is invalid
+        self.client.force_authenticate(self.shop)
+        items = [{"customer": self.customer.id, "amount": "3.00"}] * 3000
+        response = self.client.post(reverse("bill-bulk-create"), items, format="json")
+        self.assertEqual(response.data["created"], 3000)
+        response = self.client.post(reverse("bill-bulk-create"), [{"customer": 10 ** 6, "amount": "1"}], format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_customer_create(self):
+        template = encode_template(make_faces(2)[0])
+        with mock.patch("api.serializers.run_biometric_job", return_value=template):
+            self.request(self.shop, "post", "shop-customer-list-create", data={
+                "username": "newcomer", "password": "pass", "biometric_type": "FACE", "face_template": self.image(),
+            })
+
+    def test_payment(self):
+        with mock.patch("api.serializers.run_biometric_job", return_value=ProcessedFrame(None, None, None)), \
+                mock.patch("api.views.compare_faces", return_value=True):
+            self.request(self.shop, "post", "process-payment", data={
+                "bill_id": self.bills[4].id, "live_image": self.image(),
+            })
+        self.assertEqual(Bill.objects.get(id=self.bills[4].id).status, "PAID_WALLET")
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=Decimal("1.50"))
+        BiometricData.objects.create(owner=self.customer, template=encode_template(make_faces(2)[0]))
+        self.bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("1.00")) for _ in range(3)
+        )
+        self.client.force_authenticate(self.shop)
+
+    def pay(self, bill, matched=True):
+        frame = ProcessedFrame(None, None, None, timings={"decode": 0.002, "equalize": 0.001, "detect": 0.01})
+        image = SimpleUploadedFile("face.png", cv2.imencode(".png", make_faces(2)[0])[1].tobytes(), content_type="image/png")
+        with mock.patch("api.serializers.run_biometric_job", return_value=frame), \
+                mock.patch("api.views.compare_faces", return_value=matched):
+            return self.client.post(reverse("process-payment"), {"bill_id": bill.id, "live_image": image})
+
+    def test_frame_timings(self):
+        frame = process_frame(cv2.imencode(".png", make_faces(2)[0])[1].tobytes())
+        self.assertEqual(list(frame.compact().timings), ["decode", "equalize", "detect"])
+
+    def test_payment_stages_and_counters(self):
+        payments = metrics.PAYMENTS.value()
+        biometric_failures = metrics.AUTH_FAILURES.value(kind="biometric")
+        insufficient = metrics.INSUFFICIENT_FUNDS.value()
+        stage_count = metrics.STAGE_DURATION.count(endpoint="process-payment", stage="lock")
+
+        response = self.pay(self.bills[0])
+        self.assertEqual(response.status_code, 200)
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(
+            stages, ["fetch", "validate", "decode", "equalize", "detect", "match", "write", "lock", "commit", "total"]
+        )
+        self.assertIn("decode;dur=2.00", response["Server-Timing"])
+
+        self.assertEqual(self.pay(self.bills[1], matched=False).status_code, 400)
+        self.assertEqual(self.pay(self.bills[2]).data, {"error": "Insufficient funds."})
+        self.assertEqual(metrics.PAYMENTS.value(), payments + 1)
+        self.assertEqual(metrics.AUTH_FAILURES.value(kind="biometric"), biometric_failures + 1)
+        self.assertEqual(metrics.INSUFFICIENT_FUNDS.value(), insufficient + 1)
+        self.assertEqual(metrics.STAGE_DURATION.count(endpoint="process-payment", stage="lock"), stage_count + 2)
+
+    def test_metrics_endpoint(self):
+        tokens = metrics.AUTH_FAILURES.value(kind="token")
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse("wallet-detail")).status_code, 401)
+        self.assertEqual(metrics.AUTH_FAILURES.value(kind="token"), tokens + 1)
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn("# TYPE veinpay_request_duration_seconds histogram", text)
+        self.assertIn('veinpay_request_duration_seconds_bucket{endpoint="wallet-detail",method="GET",status="401",le="+Inf"}', text)
+        self.assertIn(f'veinpay_auth_failures_total{{kind="token"}} {tokens + 1}', text)
+        self.assertIn("veinpay_insufficient_funds_total ", text)
+
+        with override_settings(METRICS_TOKEN="scrape-secret"):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-secret")
+            self.assertEqual(response.status_code, 200)
+
+    def test_json_log_records(self):
+        record = logging.LogRecord("api.views", logging.INFO, __file__, 1, "Payment settled", (), None)
+        record.bill_id = 7
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(
+            (entry["level"], entry["logger"], entry["message"], entry["bill_id"]),
+            ("INFO", "api.views", "Payment settled", 7),
+        )
+
+
+@mock.patch("api.serializers.run_biometric_job", side_effect=AssertionError("full frame processed"))
+class FaceCropPaymentTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+        # An enrolled face is a crop of an equalized frame
+        self.face = cv2.equalizeHist(make_faces(3, seed=7)[2])
+        BiometricData.objects.create(owner=self.customer, template=encode_template(self.face))
+        self.bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal("1.00"))
+        self.client.force_authenticate(self.shop)
+
+    def pay(self, data, crop_format, **extra):
+        crop = SimpleUploadedFile("face", data, content_type="application/octet-stream")
+        return self.client.post(
+            reverse("process-payment"), {"bill_id": self.bill.id, "face_crop": crop, "face_format": crop_format, **extra}
+        )
+
+    def test_raw_crop(self, _):
+        response = self.pay(self.face.tobytes(), "raw")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertIn("decode;dur=", response["Server-Timing"])
+        self.assertNotIn("detect", response["Server-Timing"])
+        self.assertEqual(Bill.objects.get(id=self.bill.id).status, "PAID_WALLET")
+
+    def test_png_crop_of_another_size(self, _):
+        png = cv2.imencode(".png", cv2.resize(self.face, (120, 120)))[1].tobytes()
+        response = self.pay(png, "png", face_width=120, face_height=120)
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_someone_else(self, _):
+        response = self.pay(make_faces(2)[0].tobytes(), "raw")
+        self.assertEqual(response.data, {"error": "Biometric authentication failed."})
+
+    def test_invalid_payloads(self, run_biometric_job):
+        png = cv2.imencode(".png", self.face)[1].tobytes()
+        for data, crop_format, extra, field in [
+            (self.face.tobytes()[:-1], "raw", {}, "face_crop"),
+            (png, "png", {"face_width": 99}, "face_crop"),
+            (self.face.tobytes(), "png", {}, "face_crop"),
+            (self.face.tobytes(), "jpeg", {}, "face_format"),
+            (self.face.tobytes(), "raw", {"face_width": 4000}, "face_width"),
+        ]:
+            response = self.pay(data, crop_format, **extra)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.data)
+
+        # Exactly one of the two payloads, checked before any image is processed
+        response = self.client.post(reverse("process-payment"), {"bill_id": self.bill.id})
+        self.assertEqual(response.status_code, 400)
+        image = SimpleUploadedFile("face.png", cv2.imencode(".png", self.face)[1].tobytes(), content_type="image/png")
+        response = self.pay(self.face.tobytes(), "raw", live_image=image)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"non_field_errors": ["Send either live_image or face_crop."]})
+        run_biometric_job.assert_not_called()
+        self.assertEqual(Bill.objects.get(id=self.bill.id).status, "PENDING")
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+        BiometricData.objects.create(owner=self.customer, template=encode_template(make_faces(2)[0]))
+        self.bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("1.00")) for _ in range(2)
+        )
+        self.client.force_authenticate(self.shop)
+        self.face_job = mock.Mock(return_value=ProcessedFrame(None, None, None))
+
+    def pay(self, bill, key=None, matched=True):
+        image = SimpleUploadedFile("face.png", cv2.imencode(".png", make_faces(2)[0])[1].tobytes(), content_type="image/png")
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        with mock.patch("api.serializers.run_biometric_job", self.face_job), \
+                mock.patch("api.views.compare_faces", return_value=matched):
+            return self.client.post(reverse("process-payment"), {"bill_id": bill.id, "live_image": image}, **headers)
+
+    def test_retry_replays_the_outcome(self):
+        first = self.pay(self.bills[0], key="checkout-1")
+        self.assertEqual(first.status_code, 200)
+        retry = self.pay(self.bills[0], key="checkout-1")
+        self.assertEqual((retry.status_code, retry.data), (200, first.data))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(self.face_job.call_count, 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # Rejections are replayed too, and keys are per request
+        self.assertEqual(self.pay(self.bills[1], key="checkout-2", matched=False).status_code, 400)
+        self.assertEqual(self.pay(self.bills[1], key="checkout-2").status_code, 400)
+        self.assertEqual(self.pay(self.bills[1], key="checkout-3").status_code, 200)
+        self.assertEqual(self.pay(self.bills[1], key="checkout-1").status_code, 422)
+
+    def test_server_errors_are_not_remembered(self):
+        self.face_job.side_effect = [BiometricWorkerBusy(), ProcessedFrame(None, None, None)]
+        self.assertEqual(self.pay(self.bills[0], key="checkout-1").status_code, 503)
+        self.assertEqual(self.pay(self.bills[0], key="checkout-1").status_code, 200)
+
+    def test_paid_bill_skips_image_processing(self):
+        self.assertEqual(self.pay(self.bills[0]).status_code, 200)
+        self.assertEqual(self.pay(self.bills[0]).status_code, 404)
+        self.assertEqual(self.face_job.call_count, 1)
+
+    def test_duplicate_waits_for_the_first_attempt(self):
+        store = IdempotencyStore()
+        self.assertIsNone(store.claim(self.shop.id, "checkout-1", 7))
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(store.claim, self.shop.id, "checkout-1", 7)
+            time.sleep(0.2)
+            self.assertFalse(waiting.done())
+            store.complete(self.shop.id, "checkout-1", 7, 200, {"success": "paid"})
+            self.assertEqual(waiting.result(timeout=5)["data"], {"success": "paid"})
+
+        self.assertIsNone(store.claim(self.shop.id, "checkout-2", 7))
+        with override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1), self.assertRaises(IdempotencyKeyInFlight):
+            store.claim(self.shop.id, "checkout-2", 7)
+        store.release(self.shop.id, "checkout-2")
+        self.assertIsNone(store.claim(self.shop.id, "checkout-2", 7))
+
+
+class BillEventTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.other_shop = User.objects.create_user(username="other", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        self.broker = InProcessBillEventBroker(buffer_size=3)
+        patcher = mock.patch("api.bill_events._broker", self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_broker_resume_and_gaps(self):
+        start = self.broker.latest_id()
+        ids = [self.broker.publish(self.shop.id, "bill.created", {"id": i})["id"] for i in range(3)]
+        self.broker.publish(self.other_shop.id, "bill.created", {"id": 99})
+        events, cursor, complete = self.broker.read(self.shop.id, ids[0])
+        self.assertEqual(([event["data"]["id"] for event in events], complete), ([1, 2], True))
+        self.assertEqual(self.broker.read(self.shop.id, cursor), ([], cursor, True))
+
+        # A fourth event pushes the first out of the buffer
+        self.broker.publish(self.shop.id, "bill.paid", {"id": 0})
+        self.assertEqual(len(self.broker.read(self.shop.id, ids[0])[0]), 3)
+        self.assertFalse(self.broker.read(self.shop.id, start)[2])
+        # Cursors from before this process started, or from another one
+        self.assertFalse(self.broker.read(self.shop.id, start - 5)[2])
+        self.assertFalse(self.broker.read(self.shop.id, cursor + 100)[2])
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(self.broker.wait, self.shop.id, self.broker.latest_id(), 5)
+            time.sleep(0.1)
+            self.broker.publish(self.other_shop.id, "bill.created", {"id": 100})
+            time.sleep(0.1)
+            self.assertFalse(waiting.done())
+            self.broker.publish(self.shop.id, "bill.cancelled", {"id": 1})
+            self.assertEqual(waiting.result(timeout=5)[0][0]["type"], "bill.cancelled")
+
+    def read_stream(self, response):
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        return [
+            dict(line.split(": ", 1) for line in block.splitlines())
+            for block in body.split("\n\n") if block.startswith("id:")
+        ]
+
+    @override_settings(BILL_EVENT_STREAM_TIMEOUT=0.3, BILL_EVENT_HEARTBEAT=0.1)
+    def test_stream_resumes_from_last_event_id(self):
+        cursor = self.broker.latest_id()
+        self.client.force_authenticate(self.shop)
+        with self.captureOnCommitCallbacks(execute=True):
+            bill_id = self.client.post(
+                reverse("bill-list-create"), {"customer": self.customer.id, "amount": "4.50"}, format="json"
+            ).data["id"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse("shop-bill-pay-cash", args=[bill_id]))
+
+        # EventSource can't send headers: the token goes in the query string
+        self.client.force_authenticate(None)
+        token = ClaimsTokenObtainPairSerializer.get_token(self.shop).access_token
+        response = self.client.get(
+            reverse("bill-event-stream"), {"access_token": str(token)},
+            HTTP_ACCEPT="text/event-stream", HTTP_LAST_EVENT_ID=str(cursor),
+        )
+        events = self.read_stream(response)
+        self.assertEqual([event["event"] for event in events], ["bill.created", "bill.paid"])
+        self.assertEqual(
+            json.loads(events[1]["data"]),
+            {"id": bill_id, "customer": self.customer.id, "amount": "4.50", "status": "PAID_CASH"},
+        )
+
+        # Too old a cursor: the client is told to reload
+        response = self.client.get(
+            reverse("bill-event-stream"), {"access_token": str(token), "last_event_id": cursor - 10}
+        )
+        self.assertEqual([event["event"] for event in self.read_stream(response)], ["reset"])
+
+    def test_stream_is_for_shops(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.customer).access_token
+        response = self.client.get(
+            reverse("bill-event-stream"), {"access_token": str(token)}, HTTP_ACCEPT="text/event-stream"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(reverse("bill-event-stream")).status_code, 401)
+
+    @override_settings(BILL_EVENT_STREAM_TIMEOUT=5, BILL_EVENT_HEARTBEAT=5)
+    async def test_async_stream(self):
+        request = APIRequestFactory().get("/api/shop/bills/events/")
+        force_authenticate(request, user=self.shop)
+        response = await AsyncBillEventStreamView.as_view()(request)
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b"retry:"))
+        # Published from another thread, as a sync view's on_commit would
+        threading.Timer(0.1, self.broker.publish, (self.shop.id, "bill.paid", {"id": 5})).start()
+        chunk = await asyncio.wait_for(anext(stream), 5)
+        self.assertIn(b"event: bill.paid", chunk)
+        await stream.aclose()
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.shop_wallet = Wallet.objects.create(owner=self.shop)
+        self.customers = []
+        for name in ("alice", "bob"):
+            customer = User.objects.create_user(username=name, password="pass", role="CUSTOMER")
+            Wallet.objects.create(owner=customer, balance=Decimal("100.00"))
+            self.customers.append(customer)
+        alice, bob = self.customers
+        for customer, amount in [(alice, "1.50"), (bob, "7.00"), (alice, "2.25"), (bob, "0.75")]:
+            bill = Bill.objects.create(initiating_shop=self.shop, customer=customer, amount=Decimal(amount))
+            PaymentView().settle(PaymentView().get_bill_queryset().get(id=bill.id))
+        # Move the first two payments to yesterday, as a rebuild would see them
+        self.today = timezone.localdate()
+        self.yesterday = self.today - datetime.timedelta(days=1)
+        first_two = Transaction.objects.order_by("id").values_list("id", flat=True)[:2]
+        Transaction.objects.filter(id__in=list(first_two)).update(timestamp=timezone.now() - datetime.timedelta(days=1))
+
+        token = ClaimsTokenObtainPairSerializer.get_token(self.shop).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def summary(self, **params):
+        return self.client.get(reverse("shop-revenue-summary"), params)
+
+    def test_payments_update_rollups(self):
+        row = DailyRevenue.objects.get(wallet=self.shop_wallet)
+        self.assertEqual((row.day, row.revenue, row.payments), (self.today, Decimal("11.50"), 4))
+        self.assertEqual(
+            dict(CustomerDailyRevenue.objects.values_list("customer__username", "revenue")),
+            {"alice": Decimal("3.75"), "bob": Decimal("7.75")},
+        )
+
+    def test_rebuild_and_summary(self):
+        out = io.StringIO()
+        call_command("rebuild_revenue_rollups", stdout=out)
+        self.assertIn("Rebuilt 2 daily revenue row(s)", out.getvalue())
+
+        with self.assertNumQueries(2):
+            response = self.summary(start=self.yesterday.isoformat(), top=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["revenue"], "11.50")
+        self.assertEqual(response.data["payments"], 4)
+        self.assertEqual(
+            [(day["day"], day["revenue"], day["payments"]) for day in response.data["days"]],
+            [(self.yesterday.isoformat(), "8.50", 2), (self.today.isoformat(), "3.00", 2)],
+        )
+        self.assertEqual(
+            response.data["top_customers"],
+            [{"customer": self.customers[1].id, "username": "bob", "revenue": "7.75", "payments": 2}],
+        )
+
+        # Only the rollups are read: a rebuild limited to today leaves yesterday alone
+        DailyRevenue.objects.filter(day=self.yesterday).update(revenue=Decimal("1.00"))
+        call_command("rebuild_revenue_rollups", since=self.today, stdout=io.StringIO())
+        self.assertEqual(self.summary(start=self.yesterday.isoformat()).data["revenue"], "4.00")
+        # The default range is the last 30 days, ending today
+        self.assertEqual(self.summary().data["start"], (self.today - datetime.timedelta(days=29)).isoformat())
+
+    def test_sharded_wallet_rows_add_up(self):
+        self.shop_wallet.shard_count = 4
+        self.shop_wallet.save()
+        for _ in range(3):
+            bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customers[0], amount=Decimal("1.00"))
+            PaymentView().settle(PaymentView().get_bill_queryset().get(id=bill.id))
+        self.assertGreater(DailyRevenue.objects.filter(wallet=self.shop_wallet, day=self.today).count(), 1)
+        self.assertEqual(self.summary(start=self.today.isoformat()).data["revenue"], "14.50")
+
+    def test_bad_ranges(self):
+        self.assertEqual(self.summary(start=self.today.isoformat(), end=self.yesterday.isoformat()).status_code, 400)
+        self.assertEqual(self.summary(start="2020-01-01", end="2024-01-01").status_code, 400)
+        self.client.force_authenticate(self.customers[0])
+        self.assertEqual(self.client.get(reverse("shop-revenue-summary")).status_code, 403)
+
+
+@override_settings(LEDGER_SNAPSHOT_DELAY=0)
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.shop_wallet = Wallet.objects.create(owner=self.shop)
+        self.customer = User.objects.create_user(username="alice", password="pass", role="CUSTOMER")
+        # A balance from before the ledger: no entries behind it
+        self.customer_wallet = Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+
+    def pay(self, amount):
+        bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal(amount))
+        PaymentView().settle(PaymentView().get_bill_queryset().get(id=bill.id))
+        return bill
+
+    def add_money(self, user, amount):
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse("wallet-add-money"), {"amount": amount}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_append_entries(self):
+        bill = self.pay("30.00")
+        self.add_money(self.customer, "5.00")
+        cash_bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal("8.00"))
+        self.client.force_authenticate(self.shop)
+        self.client.put(reverse("shop-bill-pay-cash", args=[cash_bill.id]))
+
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by("id").values_list("wallet__owner__username", "kind", "amount", "bill")),
+            [
+                ("alice", "PAYMENT", Decimal("-30.00"), bill.id),
+                ("shop", "PAYMENT", Decimal("30.00"), bill.id),
+                ("alice", "TOP_UP", Decimal("5.00"), None),
+                ("shop", "CASH", Decimal("8.00"), cash_bill.id),
+            ],
+        )
+        # The shop's wallet is entirely ledger-made; cash never reached it
+        self.assertEqual(self.shop_wallet.ledger_balance(), Decimal("30.00"))
+        with self.assertRaises(ValueError):
+            entry = LedgerEntry.objects.first()
+            entry.amount = 0
+            entry.save()
+
+    def test_cash_payment_cannot_overwrite_a_wallet_payment(self):
+        bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal("8.00"))
+        stale = Bill.objects.select_related("initiating_shop__wallet").get(id=bill.id)
+        # The wallet payment settles after the cash request has read the bill as pending
+        PaymentView().settle(PaymentView().get_bill_queryset().get(id=bill.id))
+        self.client.force_authenticate(self.shop)
+        with mock.patch.object(BillPayCashView, "get_object", return_value=stale):
+            response = self.client.put(reverse("shop-bill-pay-cash", args=[bill.id]))
+
+        self.assertEqual(response.status_code, 400)
+        bill.refresh_from_db()
+        self.assertEqual(bill.status, "PAID_WALLET")
+        self.assertFalse(LedgerEntry.objects.filter(kind="CASH").exists())
+
+    def test_snapshot_plus_delta(self):
+        self.pay("30.00")
+        # Before its first snapshot the ledger can't know the old balance
+        self.assertEqual(self.customer_wallet.ledger_balance(), Decimal("-30.00"))
+        first = self.customer_wallet.take_balance_snapshot()
+        self.assertEqual(first.balance, Decimal("70.00"))
+        self.assertIsNone(self.customer_wallet.take_balance_snapshot())
+
+        self.pay("20.00")
+        self.add_money(self.customer, "1.50")
+        with self.assertNumQueries(2):
+            self.assertEqual(self.customer_wallet.ledger_balance(), Decimal("51.50"))
+        second = self.customer_wallet.take_balance_snapshot()
+        self.assertEqual((second.balance, second.entry_id), (Decimal("51.50"), LedgerEntry.objects.latest("id").id))
+        self.customer_wallet.refresh_from_db()
+        self.assertEqual(self.customer_wallet.ledger_balance(), self.customer_wallet.balance)
+
+    @override_settings(LEDGER_SNAPSHOT_DELAY=60)
+    def test_recent_entries_wait_for_the_next_snapshot(self):
+        self.customer_wallet.take_balance_snapshot()
+        self.pay("30.00")
+        self.assertIsNone(self.customer_wallet.take_balance_snapshot())
+        self.assertEqual(self.customer_wallet.ledger_balance(), Decimal("70.00"))
+
+    def test_balance_as_of(self):
+        self.customer_wallet.take_balance_snapshot()
+        self.pay("30.00")
+        self.pay("20.00")
+        # Spread the entries over the past three days
+        entries = list(LedgerEntry.objects.filter(wallet=self.customer_wallet).order_by("id"))
+        now = timezone.now()
+        for entry, days_ago in zip(entries, (2, 1)):
+            LedgerEntry.objects.filter(id=entry.id).update(created_at=now - datetime.timedelta(days=days_ago))
+        BalanceSnapshot.objects.update(as_of=now - datetime.timedelta(days=3))
+        self.customer_wallet.take_balance_snapshot()
+
+        def balance_at(days_ago):
+            self.client.force_authenticate(self.customer)
+            as_of = (now - datetime.timedelta(days=days_ago, hours=12)).isoformat()
+            response = self.client.get(reverse("wallet-balance"), {"as_of": as_of})
+            self.assertEqual(response.status_code, 200)
+            return response.data["balance"]
+
+        self.assertEqual([balance_at(days) for days in (2, 1, 0)], ["100.00", "70.00", "50.00"])
+        self.assertEqual(self.client.get(reverse("wallet-balance")).data["balance"], "50.00")
+        self.assertEqual(self.client.get(reverse("wallet-balance"), {"as_of": "yesterday"}).status_code, 400)
+
+    def test_admin_edit_keeps_concurrent_writes(self):
+        form = modelform_factory(Wallet, fields=["balance"])({"balance": "42.00"}, instance=self.customer_wallet)
+        self.assertTrue(form.is_valid())
+        # A top-up lands while the admin has the form open
+        self.add_money(self.customer, "10.00")
+        WalletAdmin(Wallet, admin.site).save_model(mock.Mock(), form.save(commit=False), form, True)
+
+        self.customer_wallet.refresh_from_db()
+        self.assertEqual(self.customer_wallet.balance, Decimal("52.00"))
+        adjustment = LedgerEntry.objects.get(kind="ADJUSTMENT")
+        self.assertEqual(adjustment.amount, Decimal("-58.00"))
+        # Everything since the opening balance of 100.00 is on the ledger
+        self.assertEqual(self.customer_wallet.ledger_balance(), Decimal("-48.00"))
+
+    def test_legacy_wallets_get_an_opening_snapshot(self):
+        migration = importlib.import_module("api.migrations.0008_opening_balance_snapshots")
+        migration.seed_opening_snapshots(django_apps, None)
+        opening = BalanceSnapshot.objects.get(wallet=self.customer_wallet)
+        self.assertEqual((opening.balance, opening.opening), (Decimal("100.00"), True))
+        # The shop's empty wallet has no history the ledger can't account for
+        self.assertFalse(BalanceSnapshot.objects.get(wallet=self.shop_wallet).opening)
+
+        self.pay("30.00")
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(reverse("wallet-balance")).data["balance"], "70.00")
+        # Before the opening snapshot the balance is unknown, not zero
+        earlier = (opening.as_of - datetime.timedelta(days=1)).isoformat()
+        response = self.client.get(reverse("wallet-balance"), {"as_of": earlier})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("as_of", response.data)
+        # The shop's balance back then is known: nothing
+        self.client.force_authenticate(self.shop)
+        self.assertEqual(self.client.get(reverse("wallet-balance"), {"as_of": earlier}).data["balance"], "0.00")
+
+    def test_balance_without_a_wallet(self):
+        nobody = User.objects.create_user(username="nobody", password="pass", role="CUSTOMER")
+        token = ClaimsTokenObtainPairSerializer.get_token(nobody).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.client.get(reverse("wallet-balance")).status_code, 404)
+        self.client.credentials()
+        self.client.force_authenticate(nobody)
+        self.assertEqual(self.client.get(reverse("wallet-balance")).status_code, 404)
+
+    def test_snapshot_command(self):
+        self.pay("30.00")
+        out = io.StringIO()
+        call_command("snapshot_wallet_balances", verify=True, stdout=out)
+        self.assertIn("Snapshotted 2 wallet(s).", out.getvalue())
+        self.assertIn("Every wallet matches its ledger.", out.getvalue())
+
+        # An edit that bypassed the ledger shows up
+        Wallet.objects.filter(id=self.shop_wallet.id).update(balance=Decimal("31.00"))
+        out, err = io.StringIO(), io.StringIO()
+        call_command("snapshot_wallet_balances", verify=True, stdout=out, stderr=err)
+        self.assertIn("Snapshotted 0 wallet(s).", out.getvalue())
+        self.assertIn("shop: ledger 30.00, wallet 31.00", err.getvalue())
+
+
+def fake_registration(image_bytes):
+    """Stands in for face processing: any image but b"no face" is a face."""
+    if image_bytes == b"no face":
+        raise ValueError("No face detected in the uploaded image. Please try again.")
+    return encode_template(make_faces(2)[0])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BULK_ENROLL_WORKERS=0)
+@mock.patch("api.enrollment.process_and_validate_face_for_registration", fake_registration)
+class BulkEnrollmentTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        User.objects.create_user(username="taken", password="pass", role="CUSTOMER")
+        self.manifest = (
+            "username,password,image,email\n"
+            "alice,secret-a,alice.jpg,alice@example.com\n"
+            "bob,secret-b,bob.jpg,\n"
+            "alice,secret-c,bob.jpg,\n"
+            "taken,secret-d,bob.jpg,\n"
+            "carol,secret-e,carol.jpg,\n"
+            "dave,secret-f,missing.jpg,\n"
+            "bad name!,secret-g,bob.jpg,\n"
+            "erin,secret-h,erin.jpg,\n"
+        )
+        self.images = {"alice.jpg": b"face", "bob.jpg": b"face", "carol.jpg": b"no face", "erin.jpg": b"face"}
+
+    def archive(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, data in self.images.items():
+                archive.writestr(name, data)
+        buffer.seek(0)
+        return buffer
+
+    def assert_enrolled(self, results):
+        self.assertEqual([result["row"] for result in results], list(range(1, 9)))
+        enrolled = [result["username"] for result in results if "id" in result]
+        self.assertEqual(enrolled, ["alice", "bob", "erin"])
+        errors = {result["row"]: result["error"] for result in results if "error" in result}
+        self.assertIn("Duplicate", errors[3])
+        self.assertIn("already exists", errors[4])
+        self.assertIn("No face", errors[5])
+        self.assertIn("not found", errors[6])
+        self.assertIn("username", errors[7])
+
+        alice = User.objects.get(username="alice")
+        self.assertEqual((alice.role, alice.email), ("CUSTOMER", "alice@example.com"))
+        self.assertTrue(alice.check_password("secret-a"))
+        self.assertEqual(Wallet.objects.filter(owner__username__in=enrolled).count(), 3)
+        biometric_data = BiometricData.objects.get(owner=alice)
+        self.assertEqual(bytes(biometric_data.template), encode_template(make_faces(2)[0]))
+        self.assertFalse(biometric_data.face_template)
+
+    def test_chunked_enrollment(self):
+        index = mock.Mock()
+        with mock.patch("api.enrollment.get_template_index", return_value=index), \
+                self.captureOnCommitCallbacks(execute=True):
+            results = BulkEnrollment(workers=0, chunk_size=2).run(
+                read_manifest(io.BytesIO(self.manifest.encode())), open_images(self.archive())
+            )
+        self.assert_enrolled(results)
+        # Each committed chunk adds its customers to the template index
+        self.assertEqual(sorted(c.args[1] for c in index.add.call_args_list), sorted(
+            User.objects.filter(username__in=["alice", "bob", "erin"]).values_list("id", flat=True)
+        ))
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.shop)
+        url = reverse("shop-customer-bulk-enroll")
+        response = client.post(url, {
+            "manifest": SimpleUploadedFile("customers.csv", self.manifest.encode()),
+            "images": SimpleUploadedFile("faces.zip", self.archive().read()),
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.data["enrolled"], response.data["failed"]), (3, 5))
+        self.assert_enrolled(response.data["results"])
+
+        response = client.post(url, {
+            "manifest": SimpleUploadedFile("customers.csv", b"username,image\nzed,zed.jpg\n"),
+            "images": SimpleUploadedFile("faces.zip", self.archive().read()),
+        })
+        self.assertEqual(response.status_code, 400)
+        with override_settings(BULK_ENROLL_MAX_ROWS=2):
+            response = client.post(url, {
+                "manifest": SimpleUploadedFile("customers.csv", self.manifest.encode()),
+                "images": SimpleUploadedFile("faces.zip", self.archive().read()),
+            })
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_with_directory(self):
+        with tempfile.TemporaryDirectory() as path:
+            for name, data in self.images.items():
+                with open(os.path.join(path, name), "wb") as f:
+                    f.write(data)
+            manifest = os.path.join(path, "customers.csv")
+            with open(manifest, "w") as f:
+                f.write(self.manifest + "mallory,secret,../outside.jpg,\n")
+            out, err = io.StringIO(), io.StringIO()
+            call_command("enroll_customers", manifest, images=path, workers=0, stdout=out, stderr=err)
+        self.assertIn("Enrolled 3 of 9", out.getvalue())
+        self.assertIn("Row 9 (mallory): Image ../outside.jpg is outside", err.getvalue())
+        self.assertTrue(User.objects.filter(username="erin").exists())
+
+
+class BulkEnrollmentPoolTests(TestCase):
+    def test_worker_failures_are_per_row(self):
+        # Real face processing in a worker process; noise has no face to find
+        images = {"noise.png": cv2.imencode(".png", make_faces(3)[2])[1].tobytes()}
+        rows = [
+            {"username": "noise", "password": "pass", "image": "noise.png"},
+            {"username": "nobody", "password": "pass", "image": "absent.png"},
+        ]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, data in images.items():
+                archive.writestr(name, data)
+        results = BulkEnrollment(workers=1).run(rows, open_images(buffer))
+        self.assertIn("No face", results[0]["error"])
+        self.assertIn("not found", results[1]["error"])
+        self.assertFalse(User.objects.filter(username__in=["noise", "nobody"]).exists())
+
+    @override_settings(BULK_ENROLL_WORKERS=1)
+    @mock.patch("api.enrollment._pool", None)
+    def test_requests_share_one_pool(self):
+        rows = [{"username": "nobody", "password": "pass", "image": "absent.png"}]
+        enroll_from_request(rows, open_images(io.BytesIO(self.empty_zip())))
+        pool = enrollment_module._pool
+        self.addCleanup(pool.shutdown)
+        enroll_from_request(rows, open_images(io.BytesIO(self.empty_zip())))
+        self.assertIs(enrollment_module._pool, pool)
+
+        # A dead worker breaks the pool; the next request gets a fresh one
+        with mock.patch.object(pool, "submit", side_effect=BrokenProcessPool("A worker died")):
+            results = enroll_from_request(
+                [{"username": "x", "password": "pass", "image": "x.png"}],
+                open_images(io.BytesIO(self.empty_zip(["x.png"]))),
+            )
+        self.assertIn("A worker died", results[0]["error"])
+        self.assertIsNone(enrollment_module._pool)
+
+    def test_concurrent_requests_are_turned_away(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()  # another bulk enrollment is running
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER"))
+        with mock.patch("api.enrollment._slots", slots):
+            response = client.post(reverse("shop-customer-bulk-enroll"), {
+                "manifest": SimpleUploadedFile("customers.csv", b"username,password,image\nzed,pass,zed.jpg\n"),
+                "images": SimpleUploadedFile("faces.zip", self.empty_zip()),
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertFalse(User.objects.filter(username="zed").exists())
+
+    @staticmethod
+    def empty_zip(names=()):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name in names:
+                archive.writestr(name, b"")
+        return buffer.getvalue()
+
+
+class WalletShardTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        self.wallet = Wallet.objects.create(owner=self.shop, balance=Decimal("5.00"))
+        Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+        call_command("set_wallet_shards", "shop", "4", stdout=io.StringIO())
+
+    def pay(self, amount):
+        bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=amount)
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        self.assertEqual(PaymentView().settle(bill).status_code, 200)
+
+    def shop_balance(self):
+        request = APIRequestFactory().get("/api/wallet/")
+        force_authenticate(request, user=self.shop)
+        return WalletDetailView.as_view()(request).data["balance"]
+
+    def test_credits_are_spread_and_summed(self):
+        for amount in ("1.00", "2.00", "3.00", "4.00"):
+            self.pay(Decimal(amount))
+        self.assertEqual(Wallet.objects.get(id=self.wallet.id).balance, Decimal("5.00"))
+        self.assertEqual(WalletShard.objects.filter(wallet=self.wallet, balance__gt=0).count(), 4)
+        self.assertEqual(self.shop_balance(), "15.00")
+
+        call_command("consolidate_wallet_shards", stdout=io.StringIO())
+        self.assertEqual(Wallet.objects.get(id=self.wallet.id).balance, Decimal("15.00"))
+        self.assertEqual(self.shop_balance(), "15.00")
+
+    def test_shrinking_keeps_the_balance(self):
+        self.pay(Decimal("1.00"))
+        bill = Bill.objects.create(initiating_shop=self.shop, customer=self.customer, amount=Decimal("2.00"))
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)  # still sees 4 shards
+        call_command("set_wallet_shards", "shop", "0", stdout=io.StringIO())
+        self.assertFalse(WalletShard.objects.exists())
+        PaymentView().settle(bill)
+        self.assertEqual(Wallet.objects.get(id=self.wallet.id).balance, Decimal("8.00"))
+
+    def test_admin_cannot_change_shards(self):
+        wallet_admin = WalletAdmin(Wallet, admin.site)
+        request = mock.Mock(user=mock.Mock(is_superuser=True))
+        self.assertNotIn("shard_count", wallet_admin.get_form(request, self.wallet).base_fields)
+        (inline,) = wallet_admin.get_inline_instances(request, self.wallet)
+        self.assertFalse(inline.can_delete)
+        self.assertFalse(inline.has_add_permission(request, self.wallet))
+
+
+class WalletCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        Wallet.objects.create(owner=self.shop)
+        Wallet.objects.create(owner=self.customer, balance=Decimal("100.00"))
+        self.bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("10.00")) for _ in range(3)
+        )
+        self.stats = get_wallet_cache().stats()
+
+    def balance(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get(reverse("wallet-detail")).data["balance"]
+
+    def counted(self):
+        stats = get_wallet_cache().stats()
+        return stats["hits"] - self.stats["hits"], stats["misses"] - self.stats["misses"]
+
+    def pay(self, bill):
+        bill = PaymentView().get_bill_queryset().get(id=bill.id)
+        return PaymentView().settle(bill).status_code
+
+    def test_balance_is_fresh_after_each_committed_write(self):
+        self.assertEqual(self.balance(self.customer), "100.00")
+        self.assertEqual(self.balance(self.customer), "100.00")
+        self.assertEqual(self.counted(), (1, 1))
+        # The hit rate is scraped from /metrics
+        hits = metrics.WALLET_CACHE_LOOKUPS.value(result="hit")
+        self.assertIn(f'veinpay_wallet_cache_lookups_total{{result="hit"}} {hits}', metrics.render_metrics())
+
+        for paid, bill in enumerate(self.bills, start=1):
+            self.assertEqual(self.pay(bill), 200)
+            self.assertEqual(self.balance(self.customer), f"{100 - 10 * paid}.00")
+            self.assertEqual(self.balance(self.shop), f"{10 * paid}.00")
+        # A payment that rolls back keeps the cached wallets
+        self.assertEqual(self.pay(self.bills[0]), 400)
+        hits, misses = self.counted()
+        self.balance(self.customer)
+        self.assertEqual(self.counted(), (hits + 1, misses))
+
+        # Top-ups write the new wallet through, so the next read is a hit
+        self.client.force_authenticate(self.customer)
+        self.client.post(reverse("wallet-add-money"), {"amount": "5.00"}, format="json")
+        self.assertEqual(self.balance(self.customer), "75.00")
+        self.assertEqual(self.counted(), (hits + 2, misses))
+
+    def test_read_racing_a_payment_is_not_cached(self):
+        wallet_cache = get_wallet_cache()
+        # A reader takes its version and reads the wallet, then a payment commits...
+        _, version = wallet_cache.get(self.customer.id)
+        stale = WalletDetailView(request=mock.Mock(user=self.customer), format_kwarg=None).get_object()
+        self.pay(self.bills[0])
+        # ...before the reader stores what it read
+        wallet_cache.set(self.customer.id, version, {"balance": str(stale.balance)})
+        self.assertEqual(self.balance(self.customer), "90.00")
+
+    def test_admin_edit_invalidates(self):
+        self.assertEqual(self.balance(self.customer), "100.00")
+        form = modelform_factory(Wallet, fields=["balance"])(
+            {"balance": "42.00"}, instance=Wallet.objects.get(owner=self.customer)
+        )
+        self.assertTrue(form.is_valid())
+        with transaction.atomic():
+            WalletAdmin(Wallet, admin.site).save_model(mock.Mock(), form.save(commit=False), form, True)
+            # Not before the admin's transaction commits
+            self.assertEqual(self.balance(self.customer), "100.00")
+        self.assertEqual(self.balance(self.customer), "42.00")
+        # The edit is on the ledger too
+        entry = LedgerEntry.objects.get(wallet__owner=self.customer)
+        self.assertEqual((entry.kind, entry.amount), ("ADJUSTMENT", Decimal("-58.00")))
+
+    @unittest.skipIf(connection.vendor == "sqlite", "needs a database with concurrent writers")
+    def test_concurrent_polling_never_outlives_a_payment(self):
+        stop = threading.Event()
+
+        def poll(_):
+            try:
+                client = APIClient()
+                client.force_authenticate(self.customer)
+                while not stop.is_set():
+                    client.get(reverse("wallet-detail"))
+            finally:
+                connection.close()
+
+        def pay(bill):
+            try:
+                return self.pay(bill)
+            finally:
+                connection.close()
+
+        bills = Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("0.10")) for _ in range(50)
+        )
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            pollers = [pool.submit(poll, i) for i in range(3)]
+            results = list(pool.map(pay, bills))
+            stop.set()
+            for poller in pollers:
+                poller.result()
+        self.assertEqual(set(results), {200})
+        self.assertEqual(self.balance(self.customer), "95.00")
+        self.assertEqual(self.balance(self.shop), "5.00")
+
+
+@unittest.skipIf(connection.vendor == "sqlite", "needs a database with concurrent writers")
+class ConcurrentLedgerTests(TransactionTestCase):
+    """
+    Concurrent payments and top-ups must neither lose updates nor overdraw.
+    Payments per second are measured by `manage.py bench_shop_throughput`,
+    not here.
+    """
+
+    THREADS = 8
+    BILLS = 200
+
+    SHOP_SHARDS = 0
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.shop = User.objects.create_user(username="shop", password="pass", role="SHOP_OWNER")
+        self.customer = User.objects.create_user(username="customer", password="pass", role="CUSTOMER")
+        shop_wallet = Wallet.objects.create(owner=self.shop, shard_count=self.SHOP_SHARDS)
+        WalletShard.objects.bulk_create(WalletShard(wallet=shop_wallet, index=i) for i in range(self.SHOP_SHARDS))
+        # Enough for only part of the bills, so some payments must fail cleanly
+        Wallet.objects.create(owner=self.customer, balance=Decimal("150.00"))
+        Bill.objects.bulk_create(
+            Bill(initiating_shop=self.shop, customer=self.customer, amount=Decimal("1.00"))
+            for _ in range(self.BILLS)
+        )
+
+    def pay(self, bill_id):
+        try:
+            bill = PaymentView().get_bill_queryset().get(id=bill_id)
+            return PaymentView().settle(bill).status_code
+        finally:
+            connection.close()
+
+    def top_up(self, _):
+        try:
+            request = self.factory.post("/api/wallet/add/", {"amount": "0.50"}, format="json")
+            force_authenticate(request, user=User.objects.get(id=self.customer.id))
+            return AddMoneyView.as_view()(request).status_code
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        bill_ids = list(Bill.objects.values_list("id", flat=True))
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            top_ups = pool.map(self.top_up, range(100))
+            results = list(pool.map(self.pay, bill_ids + bill_ids[:50]))  # some bills paid twice
+            self.assertEqual(set(top_ups), {200})
+
+        paid = Transaction.objects.count()
+        self.assertEqual(results.count(200), paid)
+        self.assertEqual(Bill.objects.filter(status="PAID_WALLET").count(), paid)
+        customer_balance = Wallet.objects.get(owner=self.customer).balance
+        shop_balance = Wallet.objects.with_shard_balance().get(owner=self.shop).total_balance
+        self.assertEqual(shop_balance, Decimal(paid))
+        self.assertEqual(customer_balance, Decimal("150.00") + Decimal("50.00") - paid)
+        self.assertGreaterEqual(customer_balance, 0)
+        self.assertGreaterEqual(paid, 150)
+
+
+class ShardedConcurrentLedgerTests(ConcurrentLedgerTests):
+    SHOP_SHARDS = 4
@@ -1,5 +1,6 @@
 # api/urls.py
 
+from django.conf import settings
 from django.urls import path
 from . import views
 from rest_framework_simplejwt.views import (
@@ -7,14 +8,28 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 
+if settings.API_ASYNC_VIEWS:
+    # ASGI deployments serve the hot endpoints with their async versions
+    from . import async_views
+    wallet_detail_view = async_views.AsyncWalletDetailView
+    bill_list_create_view = async_views.AsyncBillListCreateView
+    payment_view = async_views.AsyncPaymentView
+    bill_event_stream_view = async_views.AsyncBillEventStreamView
+else:
+    wallet_detail_view = views.WalletDetailView
+    bill_list_create_view = views.BillListCreateView
+    payment_view = views.PaymentView
+    bill_event_stream_view = views.BillEventStreamView
+
 urlpatterns = [
     # Auth endpoints
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # Wallet endpoints
-    path('wallet/', views.WalletDetailView.as_view(), name='wallet-detail'),
+    path('wallet/', wallet_detail_view.as_view(), name='wallet-detail'),
     path('wallet/add/', views.AddMoneyView.as_view(), name='wallet-add-money'),
+    path('wallet/balance/', views.WalletBalanceView.as_view(), name='wallet-balance'),
     path('wallet/transactions/', views.TransactionHistoryView.as_view(), name='wallet-transactions'),
 ]
 
@@ -25,11 +40,20 @@ urlpatterns += [
         views.CustomerListCreateView.as_view(),
         name="shop-customer-list-create",
     ),
-    path("shop/bills/", views.BillListCreateView.as_view(), name="bill-list-create"),
+    path(
+        "shop/customers/bulk/",
+        views.CustomerBulkEnrollView.as_view(),
+        name="shop-customer-bulk-enroll",
+    ),
+    path("shop/bills/", bill_list_create_view.as_view(), name="bill-list-create"),
+    path("shop/bills/bulk/", views.BillBulkCreateView.as_view(), name="bill-bulk-create"),
+    path("shop/bills/events/", bill_event_stream_view.as_view(), name="bill-event-stream"),
     path(
         "shop/bills/<int:pk>/pay-cash/",
         views.BillPayCashView.as_view(),
         name="shop-bill-pay-cash",
     ),
-    path("pay/", views.PaymentView.as_view(), name="process-payment"),
+    path("shop/revenue/", views.RevenueSummaryView.as_view(), name="shop-revenue-summary"),
+    path("shop/identify/", views.IdentifyCustomerView.as_view(), name="shop-identify-customer"),
+    path("pay/", payment_view.as_view(), name="process-payment"),
 ]
@@ -1,17 +1,66 @@
 # api/views.py
 
+import itertools
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .face_utils import compare_faces
+from .face_utils import (
+    LBPH_DISTANCE_THRESHOLD, compare_faces, compute_lbph_histogram, template_from_file,
+)
+from . import metrics
+from .authentication import QueryTokenJWTAuthentication
+from .bill_events import EventStreamRenderer, parse_cursor, publish_bill_event_on_commit, stream_bill_events
+from .idempotency import get_idempotency_key, get_idempotency_store, replay_response
+from .instrumentation import stage_timer
+from .template_index import get_template_index
+from .wallet_cache import get_wallet_cache
 from django.shortcuts import get_object_or_404
-from .models import Wallet, Transaction, BiometricData, Bill, User
+from .models import Wallet, WalletShard, Transaction, BiometricData, Bill, User, LedgerEntry
+from .pagination import BillPagination, CustomerPagination, TransactionPagination
 from .permissions import IsShopOwner
+from .revenue import record_payment, revenue_summary
 from .serializers import (
     WalletSerializer, TransactionSerializer, AddMoneySerializer,
     CustomerRegistrationSerializer, BillCreationSerializer,
-    PaymentSerializer # ADD THIS LINE
+    PaymentBillSerializer, PaymentSerializer, IdentifySerializer,
+    TransactionListSerializer, CustomerListSerializer, BillListSerializer,
+    BulkBillItemSerializer, BulkEnrollmentSerializer,
+    RevenueSummaryQuerySerializer, RevenueSummarySerializer,
+    WalletBalanceQuerySerializer, WalletBalanceSerializer
 )
+from .enrollment import enroll_from_request, open_images, read_manifest
+
+logger = logging.getLogger(__name__)
+
+_shard_round_robin = itertools.count()
+
+def credit_wallet(wallet, amount, now, key):
+    """
+    Adds amount to a wallet with a single UPDATE. Sharded wallets are credited
+    on one of their shard rows, picked from `key` (e.g. the bill id) or
+    round-robin depending on WALLET_SHARD_STRATEGY.
+    """
+    if wallet.shard_count:
+        if settings.WALLET_SHARD_STRATEGY == 'round_robin':
+            index = next(_shard_round_robin) % wallet.shard_count
+        else:
+            index = key % wallet.shard_count
+        if WalletShard.objects.filter(wallet_id=wallet.id, index=index).update(
+            balance=F('balance') + amount, updated_at=now
+        ):
+            return
+        # The shard was removed since the wallet was read (set_wallet_shards); credit the wallet row
+    Wallet.objects.filter(id=wallet.id).update(balance=F('balance') + amount, updated_at=now)
 
 class WalletDetailView(generics.RetrieveAPIView):
     """
@@ -22,7 +71,18 @@ class WalletDetailView(generics.RetrieveAPIView):
 
     def get_object(self):
         # We override this method to ensure a user only ever gets their own wallet.
-        return self.request.user.wallet
+        return get_object_or_404(
+            Wallet.objects.select_related('owner').with_shard_balance(), owner_id=self.request.user.id
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # Polled constantly by the app; served from the wallet cache until a ledger write commits
+        wallet_cache = get_wallet_cache()
+        data, version = wallet_cache.get(request.user.id)
+        if data is None:
+            data = self.get_serializer(self.get_object()).data
+            wallet_cache.set(request.user.id, version, data)
+        return Response(data)
 
 class AddMoneyView(generics.GenericAPIView):
     """
@@ -36,73 +96,242 @@ class AddMoneyView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         amount = serializer.validated_data['amount']
 
-        wallet = request.user.wallet
-        wallet.balance += amount
-        wallet.save()
-
-        # Return the updated wallet details
+        wallet_id = request.user.wallet_id
+        wallet_cache = get_wallet_cache()
+        now = timezone.now()
+        with transaction.atomic():
+            # Credit in the database (not in Python) so concurrent top-ups and payments don't lose updates
+            Wallet.objects.filter(id=wallet_id).update(balance=F('balance') + amount, updated_at=now)
+            LedgerEntry.objects.create(wallet_id=wallet_id, kind='TOP_UP', amount=amount, created_at=now)
+        wallet_cache.invalidate_on_commit(request.user.id)
+        version = wallet_cache.version(request.user.id)
+        wallet = Wallet.objects.select_related('owner').get(id=wallet_id)
+
+        # Return the updated wallet details, and write them through to the cache
         updated_wallet_serializer = WalletSerializer(wallet)
+        wallet_cache.set(request.user.id, version, updated_wallet_serializer.data)
         return Response(updated_wallet_serializer.data, status=status.HTTP_200_OK)
 
-class TransactionHistoryView(generics.ListAPIView):
+class WalletBalanceView(generics.GenericAPIView):
+    """
+    An endpoint for the logged-in user to see their balance according to the
+    ledger, now or at a past moment (?as_of=). It is the latest snapshot
+    before then plus the entries since, so it stays fast however long the
+    wallet's history.
+    """
+    serializer_class = WalletBalanceQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        as_of = serializer.validated_data.get('as_of')
+        # Only the id is needed, and the token already carries it
+        wallet_id = getattr(request.user, 'wallet_id', None)
+        if wallet_id is None:
+            raise NotFound("You don't have a wallet.")
+        balance = Wallet(id=wallet_id).ledger_balance(as_of)
+        if balance is None:
+            raise ValidationError({'as_of': "The wallet's ledger doesn't go back that far."})
+        return Response(WalletBalanceSerializer({'as_of': as_of or timezone.now(), 'balance': balance}).data)
+
+class ValuesListMixin:
+    """
+    Serves GET lists from queryset.values() rows through
+    `list_serializer_class` (a ValuesSerializer) instead of building a model
+    instance and a ModelSerializer per row. serializer_class still handles
+    everything else (POST, OPTIONS, schemas).
+    """
+    list_serializer_class = None
+
+    def as_values(self, queryset):
+        # The paginator's key columns are needed for the cursor even if not shown
+        columns = self.list_serializer_class.value_fields() + list(getattr(self.paginator, 'key_fields', ()))
+        return queryset.values(*dict.fromkeys(columns))
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.as_values(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(self.list_serializer_class(page).data)
+
+class TransactionHistoryView(ValuesListMixin, generics.ListAPIView):
     """
     An endpoint for the user to see their transaction history (both sent and received).
     """
     serializer_class = TransactionSerializer
+    list_serializer_class = TransactionListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TransactionPagination
 
     def get_queryset(self):
         # We override this to filter transactions for the current user's wallet.
-        user_wallet = self.request.user.wallet
+        user_wallet = self.request.user.wallet_id
         # The Q object allows for complex queries, in this case: OR
         from django.db.models import Q
         return Transaction.objects.filter(
-            Q(source_wallet=user_wallet) | Q(destination_wallet=user_wallet)
-        ).order_by('-timestamp')
-
-class CustomerListCreateView(generics.ListCreateAPIView):
+            Q(source_wallet_id=user_wallet) | Q(destination_wallet_id=user_wallet)
+        ).order_by('-timestamp', '-id')
+
+    def get_keyset_branches(self):
+        # The same rows as get_queryset(), split so each half is an ordered walk
+        # of one (wallet, -timestamp, -id) index; the paginator merges the two
+        # pages with UNION ALL instead of sorting every row the OR matches.
+        user_wallet = self.request.user.wallet_id
+        return [
+            self.as_values(Transaction.objects.filter(source_wallet_id=user_wallet)),
+            self.as_values(
+                Transaction.objects.filter(destination_wallet_id=user_wallet).exclude(source_wallet_id=user_wallet)
+            ),
+        ]
+
+class CustomerListCreateView(ValuesListMixin, generics.ListCreateAPIView):
     """
     An endpoint for the Shop Owner to LIST all their customers (GET)
     or CREATE a new customer (POST).
     """
-    queryset = User.objects.filter(role='CUSTOMER')
+    queryset = User.objects.filter(role='CUSTOMER').order_by('-date_joined', '-id')
     serializer_class = CustomerRegistrationSerializer
+    list_serializer_class = CustomerListSerializer
     permission_classes = [IsShopOwner]
+    pagination_class = CustomerPagination
 
     def perform_create(self, serializer):
         # This is the same logic from before, it hasn't changed.
         biometric_type = serializer.validated_data.pop('biometric_type')
-        face_template = serializer.validated_data.pop('face_template')
+        template = serializer.validated_data.pop('face_template')
 
         with transaction.atomic():
-            user = serializer.save(role='CUSTOMER')
-            user.set_password(serializer.validated_data['password'])
-            user.save()
+            # Hash the password before the INSERT instead of saving twice
+            user = serializer.save(role='CUSTOMER', password=make_password(serializer.validated_data['password']))
             Wallet.objects.create(owner=user)
-            BiometricData.objects.create(
+            biometric_data = BiometricData.objects.create(
                 owner=user,
                 biometric_type=biometric_type,
-                face_template=face_template
+                template=template,
             )
+            if biometric_type == 'FACE':
+                # Make the new customer identifiable without waiting for an index refresh
+                transaction.on_commit(lambda: get_template_index().add(
+                    biometric_data.id, user.id, biometric_data.stored_histogram()
+                ))
 
 # Replace the old BillCreateView with this new BillListCreateView
 
 
-class BillListCreateView(generics.ListCreateAPIView):
+class CustomerBulkEnrollView(generics.GenericAPIView):
+    """
+    An endpoint for the Shop Owner to REGISTER many customers in one request.
+    Takes a CSV `manifest` and a zip of face photos (`images`) as multipart
+    form data and reports a result per manifest row; bad rows don't stop the
+    good ones being enrolled.
+    """
+    serializer_class = BulkEnrollmentSerializer
+    permission_classes = [IsShopOwner]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            rows = read_manifest(serializer.validated_data['manifest'])
+            images = open_images(serializer.validated_data['images'])
+        except (ValueError, UnicodeError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not rows:
+            return Response({"error": "The manifest has no rows."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.BULK_ENROLL_MAX_ROWS:
+            return Response(
+                {"error": f"At most {settings.BULK_ENROLL_MAX_ROWS} customers per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = enroll_from_request(rows, images)
+        enrolled = sum('id' in result for result in results)
+        return Response(
+            {"enrolled": enrolled, "failed": len(results) - enrolled, "results": results},
+            status=status.HTTP_201_CREATED if enrolled else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class BillListCreateView(ValuesListMixin, generics.ListCreateAPIView):
     """
-    An endpoint for the Shop Owner to LIST all bills (GET)
+    An endpoint for the Shop Owner to LIST their bills (GET)
     or CREATE a new bill for a customer (POST).
     """
 
-    queryset = Bill.objects.all().order_by(
-        "-created_at"
-    )  # Add this line to fetch all bills
     serializer_class = BillCreationSerializer
+    list_serializer_class = BillListSerializer
     permission_classes = [IsShopOwner]
+    pagination_class = BillPagination
+
+    def get_queryset(self):
+        # Only this shop's bills, optionally narrowed with ?status=PENDING etc.
+        # Both forms are served by the (initiating_shop, ...) indexes on Bill.
+        queryset = Bill.objects.filter(initiating_shop_id=self.request.user.id)
+        bill_status = self.request.query_params.get('status')
+        if bill_status:
+            queryset = queryset.filter(status=bill_status)
+        return queryset.order_by("-created_at", "-id")
 
     def perform_create(self, serializer):
-        # This method stays exactly the same as before
-        serializer.save(initiating_shop=self.request.user)
+        bill = serializer.save(initiating_shop_id=self.request.user.id)
+        publish_bill_event_on_commit(bill)
+
+
+class BillBulkCreateView(generics.GenericAPIView):
+    """
+    An endpoint for the Shop Owner to CREATE many bills in one request.
+    Takes a JSON array of {"customer": id, "amount": "9.99"} items and reports
+    a result per item; invalid items don't stop the valid ones being created.
+    """
+    serializer_class = BulkBillItemSerializer
+    permission_classes = [IsShopOwner]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Expected a non-empty JSON array of bills."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_BILLS_MAX:
+            return Response(
+                {"error": f"At most {settings.BULK_BILLS_MAX} bills per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {"index": index, "errors": serializer.errors}
+
+        # One query checks every referenced customer
+        known = set(User.objects.filter(
+            id__in={data['customer'] for _, data in valid}
+        ).values_list('id', flat=True))
+        bills = []
+        for index, data in valid:
+            if data['customer'] not in known:
+                error = f'Invalid pk "{data["customer"]}" - object does not exist.'
+                results[index] = {"index": index, "errors": {"customer": [error]}}
+                continue
+            bill = Bill(initiating_shop_id=request.user.id, customer_id=data['customer'], amount=data['amount'])
+            bills.append((index, bill))
+
+        # Batches of a large request are inserted in one transaction
+        Bill.objects.bulk_create([bill for _, bill in bills], batch_size=1000)
+        for _, bill in bills:
+            publish_bill_event_on_commit(bill)
+        created = BillListSerializer(
+            {'id': bill.id, 'customer_id': bill.customer_id, 'amount': bill.amount, 'status': bill.status}
+            for _, bill in bills
+        ).data
+        for (index, _), row in zip(bills, created):
+            results[index] = {"index": index, **row}
+
+        return Response(
+            {"created": len(bills), "failed": len(items) - len(bills), "results": results},
+            status=status.HTTP_201_CREATED if bills else status.HTTP_400_BAD_REQUEST,
+        )
 
 
 # Add this new view at the end of the file
@@ -117,82 +346,319 @@ class PaymentView(generics.GenericAPIView):
     ]  # Only the shop owner can trigger a payment
 
     def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        bill_id = serializer.validated_data['bill_id']
-        live_image = serializer.validated_data['live_image']
+        bill_id = self.get_bill_id(request.data)
+        key = get_idempotency_key(request)
+        if key is None:
+            return self.pay(request.data, bill_id)
+
+        # A retried request replays the first attempt's outcome (waiting for
+        # it if it is still running) instead of redoing the face check
+        entry = get_idempotency_store().claim(request.user.id, key, bill_id)
+        if entry is not None:
+            return replay_response(entry)
+        try:
+            outcome = self.pay(request.data, bill_id)
+        except Exception as exc:
+            outcome = exc
+        return self.remember(key, bill_id, outcome)
 
-        # Get the objects from the database
-        bill = get_object_or_404(Bill, id=bill_id, status='PENDING')
+    def get_bill_id(self, data):
+        serializer = PaymentBillSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['bill_id']
+
+    def pay(self, data, bill_id):
+        timer = stage_timer(self.request)
+        # The bill must still be pending before any image work is done
+        with timer.stage('fetch'):
+            bill = get_object_or_404(self.get_bill_queryset(), id=bill_id, status='PENDING')
+
+        serializer = self.get_serializer(data=data)
+        with timer.stage('validate'):
+            serializer.is_valid(raise_exception=True)
+        live_frame = serializer.validated_data['live_image']
+        # Decode, equalize and detect, as timed wherever the frame was processed
+        timer.merge(live_frame.timings)
+
+        self.prepare_biometrics(bill)
+        error_response = self.check_biometrics(bill, live_frame)
+        if error_response is not None:
+            return error_response
+        return self.settle(bill)
+
+    def remember(self, key, bill_id, outcome):
+        """
+        Stores a payment's outcome under its Idempotency-Key and returns it as
+        a Response. `outcome` is the Response, or the exception the attempt
+        raised, which becomes its error response here. Server errors (such as
+        a busy biometric pool) release the key so that a retry runs again.
+        """
+        store = get_idempotency_store()
+        owner_id = self.request.user.id
+        try:
+            response = self.handle_exception(outcome) if isinstance(outcome, Exception) else outcome
+        except Exception:
+            store.release(owner_id, key)
+            raise
+        if response.status_code >= 500:
+            store.release(owner_id, key)
+        else:
+            store.complete(owner_id, key, bill_id, response.status_code, response.data)
+        return response
+
+    def get_bill_queryset(self):
+        # Everything check_biometrics and settle touch, in one query. No FOR
+        # UPDATE: the rows are not held across the biometric check, and settle's
+        # conditional UPDATEs lock each row only for its own statement.
+        return Bill.objects.select_related(
+            'customer__biometric_data', 'customer__wallet', 'initiating_shop__wallet'
+        ).defer('customer__biometric_data__lbph_histogram')  # only read for unconverted templates
+
+    def prepare_biometrics(self, bill):
+        """
+        Does the database work the customer's biometrics may still need, so
+        that check_biometrics itself is only CPU work.
+        """
+        try:
+            biometric_data = bill.customer.biometric_data
+        except BiometricData.DoesNotExist:
+            return
+        if biometric_data.biometric_type != 'FACE' or biometric_data.template is not None:
+            return
+        if biometric_data.face_template:
+            # Enrolled before templates and not converted yet (convert_face_templates):
+            # convert it from the file now, once, so the customer can still pay
+            template = template_from_file(biometric_data.face_template.path)
+            if template is not None:
+                biometric_data.template = template
+                biometric_data.lbph_histogram = None
+                biometric_data.save(update_fields=['template', 'lbph_histogram'])
+                # Unconverted files had no histogram, so identify couldn't find them until now
+                transaction.on_commit(lambda: get_template_index().add(
+                    biometric_data.id, biometric_data.owner_id, biometric_data.stored_histogram()
+                ))
+                return
+        # Not converted: load the legacy histogram deferred by get_bill_queryset
+        biometric_data.refresh_from_db(fields=['lbph_histogram'])
+
+    def check_biometrics(self, bill, live_frame):
+        """
+        Verifies the live frame against the customer's enrolled biometrics.
+        Returns None if the customer is authenticated, or an error Response.
+        Call prepare_biometrics first; this runs no queries.
+        """
         customer = bill.customer
-        shop = bill.initiating_shop
 
         # --- Authentication Hub ---
         is_authenticated = False
         try:
             biometric_data = customer.biometric_data
             if biometric_data.biometric_type == 'FACE':
-                live_image.seek(0)
-                # Call our face comparison logic
-                is_authenticated = compare_faces(
-                    stored_template_path=biometric_data.face_template.path,
-                    live_image_data=live_image
-                )
+                # Read straight from the template column: no file, no image decode
+                try:
+                    stored_histogram = biometric_data.stored_histogram()
+                except ValueError:
+                    stored_histogram = None  # a template format this build can't read
+                if stored_histogram is None:
+                    logger.error("Unreadable face template", extra={'bill_id': bill.id, 'customer_id': customer.id})
+                    return Response({"error": "Stored face template could not be read."}, status=status.HTTP_400_BAD_REQUEST)
+                # Call our face comparison logic against the histogram stored at enrollment
+                with stage_timer(getattr(self, 'request', None)).stage('match'):
+                    is_authenticated = compare_faces(
+                        stored_histogram=stored_histogram,
+                        live_frame=live_frame
+                    )
             elif biometric_data.biometric_type == 'VEIN':
                 # This is the stub for the future. It will always fail for now.
                 is_authenticated = False
-                print("Vein authentication is not yet implemented.")
+                logger.warning("Vein authentication is not yet implemented.", extra={'customer_id': customer.id})
 
         except BiometricData.DoesNotExist:
             return Response({"error": "Customer has no registered biometric data."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # --- Process Payment if Authenticated ---
-        if is_authenticated:
-            customer_wallet = customer.wallet
-            shop_wallet = shop.wallet
-            amount = bill.amount
+        if not is_authenticated:
+            metrics.AUTH_FAILURES.inc(kind='biometric')
+            logger.info("Biometric authentication failed", extra={'bill_id': bill.id, 'customer_id': customer.id})
+            return Response(
+                {"error": "Biometric authentication failed."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return None
+
+    def settle(self, bill):
+        """
+        Moves the bill amount from the customer's wallet to the shop's wallet.
+
+        Every write is a single conditional UPDATE, so concurrent payments and
+        top-ups never overwrite each other's balances and no row is locked for
+        longer than its own statement. The ledger gets a debit and a credit
+        entry, both inserted at once.
+
+        Timed stages: "lock" is the two wallet UPDATEs, where concurrent
+        payments queue for the same row lock; "write" is the bill claim and
+        the inserts; "commit" includes the on-commit callbacks.
+        """
+        timer = stage_timer(getattr(self, 'request', None))
+        customer_wallet = bill.customer.wallet
+        shop_wallet = bill.initiating_shop.wallet
+        amount = bill.amount
+        now = timezone.now()
+
+        # Use an atomic transaction for the money transfer
+        with transaction.atomic():
+            # Claim the bill first so a concurrent retry cannot pay it twice
+            with timer.stage('write'):
+                claimed = Bill.objects.filter(id=bill.id, status='PENDING').update(
+                    status='PAID_WALLET', updated_at=now
+                )
+            if not claimed:
+                return Response({"error": "This bill is not pending."}, status=status.HTTP_400_BAD_REQUEST)
 
-            if customer_wallet.balance < amount:
+            # Debit only if the balance covers the amount; no row updated means insufficient funds
+            with timer.stage('lock'):
+                debited = Wallet.objects.filter(id=customer_wallet.id, balance__gte=amount).update(
+                    balance=F('balance') - amount, updated_at=now
+                )
+            if not debited:
+                transaction.set_rollback(True)
+                metrics.INSUFFICIENT_FUNDS.inc()
+                logger.info("Insufficient funds", extra={'bill_id': bill.id, 'customer_id': bill.customer_id})
                 return Response({"error": "Insufficient funds."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Use an atomic transaction for the money transfer
-            with transaction.atomic():
-                customer_wallet.balance -= amount
-                shop_wallet.balance += amount
-                bill.status = 'PAID_WALLET'
+            with timer.stage('lock'):
+                credit_wallet(shop_wallet, amount, now, key=bill.id)
 
-                # Create a transaction record
-                Transaction.objects.create(
+            # Create a transaction record and its ledger entries, and count it in the shop's daily revenue
+            with timer.stage('write'):
+                txn = Transaction.objects.create(
                     bill=bill,
                     source_wallet=customer_wallet,
                     destination_wallet=shop_wallet,
                     amount=amount
                 )
-
-                customer_wallet.save()
-                shop_wallet.save()
-                bill.save()
-
-            return Response({"success": f"Payment of {amount} for Bill #{bill.id} successful."}, status=status.HTTP_200_OK)
-        else:
-            return Response(
-                {"error": "Biometric authentication failed."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+                LedgerEntry.objects.bulk_create([
+                    LedgerEntry(wallet=customer_wallet, kind='PAYMENT', amount=-amount, bill=bill, created_at=now),
+                    LedgerEntry(wallet=shop_wallet, kind='PAYMENT', amount=amount, bill=bill, created_at=now),
+                ])
+                record_payment(txn, bill.customer_id, shop_wallet.shard_count)
+            # Both balances changed; cached wallets go once the money has moved
+            get_wallet_cache().invalidate_on_commit(bill.customer_id, bill.initiating_shop_id)
+            bill.status = 'PAID_WALLET'
+            publish_bill_event_on_commit(bill)
+            commit_started = time.perf_counter()
+        timer.add('commit', time.perf_counter() - commit_started)
+
+        metrics.PAYMENTS.inc()
+        logger.debug(
+            "Payment settled",
+            extra={'bill_id': bill.id, 'customer_id': bill.customer_id, 'shop_id': bill.initiating_shop_id, 'amount': str(amount)},
+        )
+        return Response({"success": f"Payment of {amount} for Bill #{bill.id} successful."}, status=status.HTTP_200_OK)
 
 class BillPayCashView(generics.UpdateAPIView):
     """
     An endpoint for the Shop Owner to mark a bill as paid in cash.
     """
-    queryset = Bill.objects.all()
+    # The shop's wallet id comes along for the ledger entry
+    queryset = Bill.objects.select_related('initiating_shop__wallet')
     permission_classes = [IsShopOwner]
 
     def update(self, request, *args, **kwargs):
         bill = self.get_object()
-        if bill.status != 'PENDING':
-            return Response({"error": "This bill is not pending."}, status=status.HTTP_400_BAD_REQUEST)
-        
+        # A shop that never took wallet payments may not have a wallet (nor a ledger)
+        shop_wallet = getattr(bill.initiating_shop, 'wallet', None)
+        with transaction.atomic():
+            # Claim the bill as settle() does, so a wallet payment racing this one can't be overwritten
+            claimed = Bill.objects.filter(id=bill.id, status='PENDING').update(
+                status='PAID_CASH', updated_at=timezone.now()
+            )
+            if not claimed:
+                return Response({"error": "This bill is not pending."}, status=status.HTTP_400_BAD_REQUEST)
+            if shop_wallet is not None:
+                # For the shop's books only: cash never reaches its wallet balance
+                LedgerEntry.objects.create(wallet=shop_wallet, kind='CASH', amount=bill.amount, bill=bill)
         bill.status = 'PAID_CASH'
-        bill.save()
+        publish_bill_event_on_commit(bill)
         return Response({"success": f"Bill #{bill.id} has been marked as PAID_CASH."}, status=status.HTTP_200_OK)
+
+
+class BillEventStreamView(generics.GenericAPIView):
+    """
+    Streams this shop's bill events (bill.created, bill.paid, bill.cancelled)
+    as server-sent events, so the dashboard needn't poll shop/bills/.
+    A reconnecting EventSource sends Last-Event-ID and gets the events it
+    missed; a "reset" event means some were lost and the list should be
+    reloaded. Under WSGI every open stream holds a worker thread, so serve
+    it from the ASGI app (core/asgi.py), which uses the async version.
+    """
+    permission_classes = [IsShopOwner]
+    authentication_classes = [QueryTokenJWTAuthentication]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request, *args, **kwargs):
+        return self.event_stream(stream_bill_events(request.user.id, self.get_cursor(request)))
+
+    def get_cursor(self, request):
+        return parse_cursor(request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id'))
+
+    @staticmethod
+    def event_stream(events):
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class RevenueSummaryView(generics.GenericAPIView):
+    """
+    An endpoint for the Shop Owner to see daily revenue, payment counts and
+    top customers for a date range (?start=&end=, ?top=). Served from the
+    daily rollups, so it costs the same however many payments there were.
+    """
+    serializer_class = RevenueSummaryQuerySerializer
+    permission_classes = [IsShopOwner]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start, end = serializer.validated_data['start'], serializer.validated_data['end']
+        summary = revenue_summary(request.user.wallet_id, start, end, serializer.validated_data['top'])
+        return Response(RevenueSummarySerializer({'start': start, 'end': end, **summary}).data)
+
+
+class IdentifyCustomerView(generics.GenericAPIView):
+    """
+    An endpoint for the Shop Owner to identify a walk-in customer (1:N).
+    Compares a live image against every enrolled face template and returns
+    the closest customers with their LBPH distances.
+    """
+    serializer_class = IdentifySerializer
+    permission_classes = [IsShopOwner]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        live_frame = serializer.validated_data['live_image']
+        top_k = serializer.validated_data['top_k']
+
+        histogram = compute_lbph_histogram(live_frame.face)
+        nearest = get_template_index().search(histogram, top_k=top_k)
+
+        # Customers deleted since they were indexed simply drop out here
+        usernames = dict(
+            User.objects.filter(id__in=[owner_id for owner_id, _ in nearest], role='CUSTOMER')
+            .values_list('id', 'username')
+        )
+        matches = [
+            {
+                "customer": owner_id,
+                "username": usernames[owner_id],
+                "distance": round(distance, 2),
+                "is_match": distance < LBPH_DISTANCE_THRESHOLD,
+            }
+            for owner_id, distance in nearest
+            if owner_id in usernames
+        ]
+        return Response({"matches": matches}, status=status.HTTP_200_OK)
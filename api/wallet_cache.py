@@ -0,0 +1,118 @@
+# api/wallet_cache.py
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+
+
+class WalletCache:
+    """
+    Read cache for the wallet endpoint, keyed by owner, on top of Django's
+    cache framework (settings.WALLET_CACHE_ALIAS).
+
+    Each owner has a version number next to the cached wallet. Ledger writes
+    bump it once their transaction commits (invalidate_on_commit), and an
+    entry only counts if it was stored under the current version. A reader
+    takes the version *before* it reads the database, so a wallet read just
+    before a payment commits is stored under the old version and never served.
+
+    Invalidation only reaches other processes through a shared backend (Redis,
+    Memcached); the local-memory default suits a single-process deployment.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.WALLET_CACHE_ALIAS]
+
+    @staticmethod
+    def keys(owner_id):
+        return f'wallet:{owner_id}', f'wallet:{owner_id}:version'
+
+    def _lookup(self, owner_id, found):
+        data_key, version_key = self.keys(owner_id)
+        version = found.get(version_key)
+        entry = found.get(data_key)
+        if entry is not None and version is not None and entry[0] == version:
+            metrics.WALLET_CACHE_LOOKUPS.inc(result='hit')
+            return entry[1], version
+        metrics.WALLET_CACHE_LOOKUPS.inc(result='miss')
+        return None, version
+
+    def get(self, owner_id):
+        """
+        Returns (data, version). data is None on a miss; pass the version
+        back to set() along with the freshly read wallet.
+        """
+        data, version = self._lookup(owner_id, self.cache.get_many(self.keys(owner_id)))
+        if version is None:
+            version = self._new_version(owner_id)
+        return data, version
+
+    async def aget(self, owner_id):
+        data, version = self._lookup(owner_id, await self.cache.aget_many(self.keys(owner_id)))
+        if version is None:
+            version = await self._anew_version(owner_id)
+        return data, version
+
+    def version(self, owner_id):
+        return self.cache.get(self.keys(owner_id)[1]) or self._new_version(owner_id)
+
+    def set(self, owner_id, version, data):
+        self.cache.set(self.keys(owner_id)[0], (version, dict(data)), settings.WALLET_CACHE_TIMEOUT)
+
+    async def aset(self, owner_id, version, data):
+        await self.cache.aset(self.keys(owner_id)[0], (version, dict(data)), settings.WALLET_CACHE_TIMEOUT)
+
+    def _new_version(self, owner_id):
+        # No version yet (or it was evicted): start from the clock, which no
+        # entry stored under an earlier version can match
+        version_key = self.keys(owner_id)[1]
+        self.cache.add(version_key, time.time_ns(), None)
+        return self.cache.get(version_key)
+
+    async def _anew_version(self, owner_id):
+        version_key = self.keys(owner_id)[1]
+        await self.cache.aadd(version_key, time.time_ns(), None)
+        return await self.cache.aget(version_key)
+
+    def invalidate(self, *owner_ids):
+        for owner_id in owner_ids:
+            version_key = self.keys(owner_id)[1]
+            try:
+                self.cache.incr(version_key)
+            except ValueError:
+                self.cache.set(version_key, time.time_ns(), None)
+
+    def invalidate_on_commit(self, *owner_ids, using=None):
+        """
+        Invalidates once the current transaction commits (at once outside
+        one). A rolled-back write leaves the cache alone.
+        """
+        transaction.on_commit(lambda: self.invalidate(*owner_ids), using=using)
+
+    def stats(self):
+        # The same numbers /metrics reports as veinpay_wallet_cache_lookups_total
+        return {
+            'hits': metrics.WALLET_CACHE_LOOKUPS.value(result='hit'),
+            'misses': metrics.WALLET_CACHE_LOOKUPS.value(result='miss'),
+        }
+
+
+_wallet_cache = None
+_wallet_cache_lock = threading.Lock()
+
+
+def get_wallet_cache():
+    """
+    Returns the process-wide WalletCache, creating it on first use.
+    """
+    global _wallet_cache
+    with _wallet_cache_lock:
+        if _wallet_cache is None:
+            _wallet_cache = WalletCache()
+        return _wallet_cache
@@ -12,5 +12,14 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Use the async payment, bill and wallet views (see api/async_views.py)
+os.environ.setdefault('API_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the settings configured above)
+
+if settings.TEMPLATE_INDEX_PRELOAD:
+    from api.template_index import warm_up_template_index
+
+    warm_up_template_index()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
+from corsheaders.defaults import default_headers
 from decouple import config
 from pathlib import Path
 
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole request (api/instrumentation.py)
+    'api.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -142,12 +146,156 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ClaimsJWTAuthentication",
     )
 }
 
+# Login tokens carry the user's role and wallet id, so API requests are
+# authenticated without loading the user (api/authentication.py). Claims are
+# re-read at login and on refresh only, so keep access tokens short-lived.
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
+    "TOKEN_OBTAIN_SERIALIZER": "api.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "api.authentication.ClaimsTokenRefreshSerializer",
+}
+
+# Local memory by default. Set CACHE_BACKEND/CACHE_LOCATION to a shared cache
+# (e.g. django.core.cache.backends.redis.RedisCache, redis://127.0.0.1:6379)
+# when running more than one process, so cache invalidations reach them all.
+CACHES = {
+    "default": {
+        "BACKEND": config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": config('CACHE_LOCATION', default=''),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# GET /api/wallet/ is served from this cache (api/wallet_cache.py); payments,
+# top-ups and admin edits invalidate an owner's entry when they commit.
+WALLET_CACHE_ALIAS = 'default'
+WALLET_CACHE_TIMEOUT = config('WALLET_CACHE_TIMEOUT', default=300, cast=int)
+
+# Outcomes of POST /api/pay/ requests sent with an Idempotency-Key header
+# (api/idempotency.py), kept for IDEMPOTENCY_TTL seconds. Any cache backend
+# works; it must be shared between processes to catch retries that land on
+# another worker. A duplicate of a request still running waits up to
+# IDEMPOTENCY_WAIT_TIMEOUT seconds for its outcome, and a claim left by a
+# crashed process expires after IDEMPOTENCY_LOCK_TIMEOUT.
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=24 * 60 * 60, cast=int)
+IDEMPOTENCY_WAIT_TIMEOUT = 15
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Longest date range GET /api/shop/revenue/ summarizes at once
+REVENUE_SUMMARY_MAX_DAYS = 366
+
+# Bill event stream (GET /api/shop/bills/events/, api/bill_events.py). The
+# in-process broker keeps each shop's last BUFFER_SIZE events for reconnecting
+# clients; it only reaches streams in the same process. Streams close after
+# STREAM_TIMEOUT seconds (the browser reconnects, with a fresh token if need
+# be) and send a comment every HEARTBEAT seconds to keep proxies from timing out.
+BILL_EVENT_BROKER = 'api.bill_events.InProcessBillEventBroker'
+BILL_EVENT_BUFFER_SIZE = 1000
+BILL_EVENT_STREAM_TIMEOUT = 300
+BILL_EVENT_HEARTBEAT = 15
+BILL_EVENT_RETRY_MS = 3000
+
+# Claims of users whose tokens predate them (api/authentication.py)
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = 60
+
+# List endpoints are cursor-paginated (api/pagination.py). Clients may ask for
+# a different page size with ?page_size=, up to API_MAX_PAGE_SIZE.
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+API_MAX_PAGE_SIZE = 200
+
+# Largest array accepted by the bulk bill endpoint (POST /api/shop/bills/bulk/)
+BULK_BILLS_MAX = 5000
+
+# Bulk customer enrollment (POST /api/shop/customers/bulk/): face processing
+# and password hashing run in this many worker processes (0 = in the request
+# process), shared by all requests. A request may enroll at most
+# BULK_ENROLL_MAX_ROWS customers, and beyond BULK_ENROLL_MAX_CONCURRENT
+# requests at once each process answers 503 "busy, retry".
+# Larger batches go through `manage.py enroll_customers`.
+BULK_ENROLL_WORKERS = config('BULK_ENROLL_WORKERS', default=2, cast=int)
+BULK_ENROLL_MAX_ROWS = 1000
+BULK_ENROLL_MAX_CONCURRENT = config('BULK_ENROLL_MAX_CONCURRENT', default=1, cast=int)
+
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
 ]
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
+
+
+# 1:N face identification index (api/template_index.py). Point this at a
+# directory written by `manage.py build_template_index` to memory-map the
+# packed histogram matrix instead of loading every template from the database.
+TEMPLATE_INDEX_PATH = config('TEMPLATE_INDEX_PATH', default=None)
+# Threads used to scan the index (defaults to the CPU count)
+TEMPLATE_INDEX_THREADS = None
+# Load the index when the WSGI/ASGI application starts rather than on the
+# first identify request
+TEMPLATE_INDEX_PRELOAD = config('TEMPLATE_INDEX_PRELOAD', default=True, cast=bool)
+# Seconds between checks for customers enrolled by other worker processes
+TEMPLATE_INDEX_REFRESH_INTERVAL = config('TEMPLATE_INDEX_REFRESH_INTERVAL', default=10, cast=float)
+# Seconds between full rebuilds, which drop deleted customers and pick up
+# templates converted or replaced in place
+TEMPLATE_INDEX_REBUILD_INTERVAL = config('TEMPLATE_INDEX_REBUILD_INTERVAL', default=300, cast=float)
+
+# Biometric worker pool (api/biometric_worker.py). OpenCV work runs in up to
+# POOL_SIZE processes with QUEUE_DEPTH more jobs waiting; further requests get
+# a 503 "busy, retry". A pool size of 0 runs the work inline.
+BIOMETRIC_WORKER_POOL_SIZE = config('BIOMETRIC_WORKER_POOL_SIZE', default=2, cast=int)
+BIOMETRIC_WORKER_QUEUE_DEPTH = config('BIOMETRIC_WORKER_QUEUE_DEPTH', default=8, cast=int)
+# Seconds a request waits for its job before giving up
+BIOMETRIC_WORKER_TIMEOUT = config('BIOMETRIC_WORKER_TIMEOUT', default=10.0, cast=float)
+
+# Serve the payment, bill list and wallet endpoints with their async views
+# (api/async_views.py). core/asgi.py turns this on for ASGI deployments.
+API_ASYNC_VIEWS = config('API_ASYNC_VIEWS', default=False, cast=bool)
+
+# Face detection (api/face_utils.py). "accurate" runs the Haar cascade over the
+# full-resolution frame; "fast" detects on a copy downscaled to
+# FACE_DETECTION_MAX_DIMENSION pixels on its longer side, looking only for faces
+# whose size is between the MIN and MAX ratios of the frame's shorter side.
+FACE_DETECTION_MODE = config('FACE_DETECTION_MODE', default='accurate')
+FACE_DETECTION_MAX_DIMENSION = 640
+FACE_DETECTION_MIN_FACE_RATIO = 0.15
+FACE_DETECTION_MAX_FACE_RATIO = 0.95
+# Pre-cropped faces posted to /api/pay/ as face_crop (api.face_utils.process_face_crop)
+FACE_CROP_MAX_BYTES = 64 * 1024
+FACE_CROP_MAX_DIMENSION = 256
+
+# Sharded shop wallets (api.models.WalletShard). Payments to a wallet with
+# shards credit one shard row, chosen by "hash" (bill id modulo the shard
+# count) or "round_robin" (a per-process counter).
+WALLET_SHARD_STRATEGY = config('WALLET_SHARD_STRATEGY', default='hash')
+
+# Wallet ledger (api.models.LedgerEntry). Balance snapshots only take in
+# entries older than LEDGER_SNAPSHOT_DELAY seconds, by when the transactions
+# that wrote them have committed; a snapshot never skips a late commit.
+LEDGER_SNAPSHOT_DELAY = 60
+
+# Structured logging: the api loggers write one JSON object per line to the
+# console (api.instrumentation.JsonFormatter). DEBUG adds a record per request
+# with its stage timings and per face comparison with its LBPH distance.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "api.instrumentation.JsonFormatter"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "json"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": config('LOG_LEVEL', default='INFO'), "propagate": False},
+    },
+}
+
+# Bearer token Prometheus must send to scrape /metrics (api/metrics.py).
+# Leave empty to serve metrics to anyone who can reach the endpoint.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
@@ -4,10 +4,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from api.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')), # Include our new API urls
+    path('metrics', metrics_view, name='metrics'),  # Prometheus scrape target
 ]
 
 # Add this line to serve media files during development
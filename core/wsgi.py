@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the settings configured above)
+
+if settings.TEMPLATE_INDEX_PRELOAD:
+    from api.template_index import warm_up_template_index
+
+    warm_up_template_index()